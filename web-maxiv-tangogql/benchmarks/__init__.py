@@ -0,0 +1,3 @@
+#!/usr/bin/env python3
+
+"""Benchmarks of the server, against a simulated TANGO control system."""
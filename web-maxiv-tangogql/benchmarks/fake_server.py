@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+"""Run the server against a simulated control system.
+
+    python -m benchmarks.fake_server --devices 1000 --event-period 0.1
+
+The server is the usual one (on port 5004, from the directory with
+config.json and static/), with the TANGO database and devices replaced by
+a FakeTango (see benchmarks.fake_tango), so that it can be load tested
+offline, e.g. with benchmarks.loadgen. It runs in a single process: the
+worker processes and the broker would not have the simulated backend.
+"""
+
+import argparse
+import os
+
+# Read when the server modules are imported
+os.environ["WORKERS"] = "1"
+os.environ.pop("BROKER_SOCKET", None)
+
+from benchmarks.fake_tango import add_arguments, from_options  # noqa: E402
+from tangogql import aioserver  # noqa: E402
+
+__all__ = ['main']
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Run tangogql against a simulated control system")
+    add_arguments(parser)
+    options = parser.parse_args(args)
+    backend = from_options(options)
+    backend.install()
+    try:
+        aioserver.run()
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,637 @@
+#!/usr/bin/env python3
+
+"""A simulated TANGO control system, living in the server process.
+
+FakeTango stands in for the TANGO database and the devices, with a
+configurable number of devices, attribute sizes, latency and failure rate,
+so that the server can be benchmarked (or tried out) without a control
+system. It is installed under tangogql.schema.base with
+
+    backend = FakeTango(devices=1000, latency=0.005)
+    backend.install()
+
+The devices are named sim<domain>/family<family>/dev<member>, and each has
+SCALAR (scalar_<i>, DevDouble), SPECTRUM (spectrum_<i>) and IMAGE
+(image_<i>) attributes. The values of the scalars are random, the arrays
+are the same for all the reads, so that the benchmarks measure the server
+rather than the simulation.
+
+When event_period is set, subscribed attributes get a change event every
+event_period seconds, otherwise subscribing to events fails and the server
+polls them, like for a device without events.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import PyTango
+
+from tangogql.devicetree import DEVICE_QUERY, SUMMARY_QUERY
+
+__all__ = ['FakeTango', 'FakeDatabase', 'FakeDeviceProxy', 'device_names',
+           'add_arguments', 'from_options', 'to_arguments']
+
+# Distributions of the simulated latency, from its mean
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "exponential")
+
+COMMANDS = ("Init", "Off", "On", "Status")
+
+SERVER = "SimServer"
+DEVICE_CLASS = "SimDevice"
+STARTED = "2020-01-01 00:00:00"
+
+
+def _failure(reason, desc, origin):
+    error = PyTango.DevError()
+    error.reason = reason
+    error.desc = desc
+    error.origin = origin
+    error.severity = PyTango.ErrSeverity.ERR
+    return PyTango.DevFailed(error)
+
+
+def _matching(pattern, names):
+    rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+    return sorted({name for name in names if rule.match(name)})
+
+
+def device_names(devices, family_size=50, domain_size=10):
+    """The names of the simulated devices, with the name of their server.
+
+    :return: (device, server/instance) of each device.
+    :rtype: list of tuple
+    """
+
+    names = []
+    for index in range(devices):
+        family = index // family_size
+        names.append((f"sim{family // domain_size}/family{family}"
+                      f"/dev{index % family_size}",
+                      f"{SERVER}/family{family}"))
+    return names
+
+
+def _select_result(rows, columns):
+    """Rows in the shape of a DbMySqlSelect result."""
+
+    return [len(rows), columns], [value for row in rows for value in row]
+
+
+class FakeAttributeValue(object):
+    """The result of reading an attribute, like PyTango.DeviceAttribute."""
+
+    __slots__ = ("name", "value", "w_value", "quality", "time",
+                 "data_format", "has_failed", "_errors")
+
+    def __init__(self, name, value, data_format, w_value=None, errors=None):
+        self.name = name
+        self.value = value
+        self.w_value = w_value
+        self.quality = PyTango.AttrQuality.ATTR_VALID
+        self.time = PyTango.TimeVal.fromtimestamp(time.time())
+        self.data_format = data_format
+        self.has_failed = errors is not None
+        self._errors = errors or ()
+
+    def get_err_stack(self):
+        return self._errors
+
+
+class FakeTango(object):
+    """The simulated control system.
+
+    :param devices: Number of devices.
+    :type devices: int
+    :param family_size: Number of devices per family (and server instance).
+    :type family_size: int
+    :param domain_size: Number of families per domain.
+    :type domain_size: int
+    :param scalars: Number of SCALAR attributes per device.
+    :type scalars: int
+    :param spectrums: Number of SPECTRUM attributes per device.
+    :type spectrums: int
+    :param spectrum_size: Length of the SPECTRUM values.
+    :type spectrum_size: int
+    :param images: Number of IMAGE attributes per device.
+    :type images: int
+    :param image_shape: Shape (rows, columns) of the IMAGE values.
+    :type image_shape: tuple
+    :param latency: Mean duration (in seconds) of the device calls.
+    :type latency: float
+    :param db_latency: Mean duration (in seconds) of the database calls.
+    :type db_latency: float
+    :param distribution: Distribution of the latency, one of
+                         LATENCY_DISTRIBUTIONS.
+    :type distribution: str
+    :param failure_rate: Probability that a device call, or the read of an
+                         attribute, fails.
+    :type failure_rate: float
+    :param event_period: Period (in seconds) of the change events, 0 for
+                         devices without events.
+    :type event_period: float
+    :param seed: Seed of the random values, latencies and failures.
+    :type seed: int
+    """
+
+    def __init__(self, devices=100, family_size=50, domain_size=10,
+                 scalars=10, spectrums=1, spectrum_size=1000, images=1,
+                 image_shape=(256, 256), latency=0.001, db_latency=0.001,
+                 distribution="constant", failure_rate=0.0, event_period=0.0,
+                 seed=0):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.config = {
+            "devices": devices, "family_size": family_size,
+            "domain_size": domain_size, "scalars": scalars,
+            "spectrums": spectrums, "spectrum_size": spectrum_size,
+            "images": images, "image_shape": list(image_shape),
+            "latency": latency, "db_latency": db_latency,
+            "distribution": distribution, "failure_rate": failure_rate,
+            "event_period": event_period, "seed": seed}
+        self.latency = latency
+        self.db_latency = db_latency
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self.event_period = event_period
+        # The number of calls, by "database.<method>" or "device.<method>"
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._random = random.Random(seed)
+        arrays = np.random.RandomState(seed)
+        self.spectrum = arrays.random_sample(spectrum_size)
+        self.image = arrays.random_sample(tuple(image_shape))
+        self.attributes = (
+            [(f"scalar_{i}", PyTango.AttrDataFormat.SCALAR)
+             for i in range(scalars)] +
+            [(f"spectrum_{i}", PyTango.AttrDataFormat.SPECTRUM)
+             for i in range(spectrums)] +
+            [(f"image_{i}", PyTango.AttrDataFormat.IMAGE)
+             for i in range(images)])
+        self._formats = dict(self.attributes)
+        self.devices = {name.lower(): (name, server)
+                        for name, server in device_names(
+                            devices, family_size, domain_size)}
+        self.database = FakeDatabase(self)
+        self._subscriptions = {}
+        self._event_ids = iter(range(1, 2 ** 62))
+        self._events_lock = threading.Lock()
+        self._events_thread = None
+
+    def device_proxy(self, name):
+        """Create the asyncio proxy of a device, see DeviceProxyCache."""
+
+        self.count("device.create")
+        self.sleep()
+        return FakeDeviceProxy(self, self.device_name(name))
+
+    def event_proxy(self, name):
+        """Create the synchronous proxy of a device, for the events."""
+
+        return FakeEventProxy(self, self.device_name(name))
+
+    def install(self):
+        """Replace the TANGO database and devices used by the server."""
+
+        from tangogql.schema import base
+
+        base.db.database = self.database
+        base.proxies.factory = self.device_proxy
+        if hasattr(base.subscriptions, "proxy_factory"):
+            base.subscriptions.proxy_factory = self.event_proxy
+
+    def close(self):
+        """Stop sending events."""
+
+        with self._events_lock:
+            self._subscriptions.clear()
+
+    def count(self, call):
+        """Count a call (from any thread)."""
+
+        with self._calls_lock:
+            self.calls[call] += 1
+
+    def calls_since(self, before=None):
+        """The calls counted since a previous result, or since the start.
+
+        :rtype: collections.Counter
+        """
+
+        with self._calls_lock:
+            calls = self.calls.copy()
+        return calls - before if before is not None else calls
+
+    def device_name(self, name):
+        """The name of a device, as configured.
+
+        :raises PyTango.DevFailed: If there is no such device.
+        """
+
+        try:
+            return self.devices[name.lower()][0]
+        except KeyError:
+            raise _failure("DB_DeviceNotDefined",
+                           f"device {name} not defined in the database !",
+                           "FakeTango.device_name") from None
+
+    def delay(self, mean=None):
+        """A random latency, in seconds."""
+
+        mean = self.latency if mean is None else mean
+        if mean <= 0 or self.distribution == "constant":
+            return max(mean, 0)
+        if self.distribution == "uniform":
+            return self._random.uniform(0, 2 * mean)
+        return self._random.expovariate(1 / mean)
+
+    def sleep(self, mean=None):
+        """Block for a random latency, like a synchronous call."""
+
+        delay = self.delay(mean)
+        if delay:
+            time.sleep(delay)
+
+    def fails(self):
+        return self.failure_rate and self._random.random() < self.failure_rate
+
+    def check(self, device, method):
+        """Count a device call, and make it fail sometimes.
+
+        :raises PyTango.DevFailed: If the call fails.
+        """
+
+        self.count(f"device.{method}")
+        if self.fails():
+            raise _failure("API_DeviceTimedOut",
+                           f"Simulated timeout of {device}",
+                           f"FakeDeviceProxy.{method}")
+
+    def read(self, device, name, value=None):
+        """Read an attribute, as PyTango would return it."""
+
+        data_format = self._formats.get(name.lower())
+        if data_format is None:
+            error = _failure("API_AttrNotFound",
+                             f"{name} is not an attribute of {device}",
+                             "FakeDeviceProxy.read_attributes")
+            return FakeAttributeValue(name, None,
+                                      PyTango.AttrDataFormat.SCALAR,
+                                      errors=error.args)
+        if self.fails():
+            error = _failure("API_AttrValueNotSet",
+                             f"Simulated read failure of {device}/{name}",
+                             "FakeDeviceProxy.read_attributes")
+            return FakeAttributeValue(name, None, data_format,
+                                      errors=error.args)
+        if value is None:
+            if data_format == PyTango.AttrDataFormat.SPECTRUM:
+                value = self.spectrum
+            elif data_format == PyTango.AttrDataFormat.IMAGE:
+                value = self.image
+            else:
+                value = self._random.random()
+        return FakeAttributeValue(name, value, data_format)
+
+    def subscribe_event(self, device, attribute, callback):
+        if self.event_period <= 0:
+            raise _failure("API_EventPropertiesNotSet",
+                           f"No events for {device}/{attribute}",
+                           "FakeEventProxy.subscribe_event")
+        with self._events_lock:
+            event_id = next(self._event_ids)
+            self._subscriptions[event_id] = (device, attribute, callback)
+            if self._events_thread is None:
+                self._events_thread = threading.Thread(
+                    target=self._send_events, name="fake-events",
+                    daemon=True)
+                self._events_thread.start()
+        return event_id
+
+    def unsubscribe_event(self, event_id):
+        with self._events_lock:
+            self._subscriptions.pop(event_id, None)
+
+    def _send_events(self):
+        # Like the TANGO event threads, the callbacks are called from here
+        while True:
+            started = time.time()
+            with self._events_lock:
+                subscriptions = list(self._subscriptions.values())
+            for device, attribute, callback in subscriptions:
+                self.count("device.event")
+                read = self.read(device, attribute)
+                callback(SimpleNamespace(
+                    err=read.has_failed,
+                    attr_value=None if read.has_failed else read,
+                    errors=read.get_err_stack()))
+            time.sleep(max(0, self.event_period - (time.time() - started)))
+
+
+class FakeDatabase(object):
+    """The TANGO database of a FakeTango, like PyTango.Database.
+
+    The methods are blocking, like the real ones.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.properties = {}
+
+    def _call(self, method):
+        self.backend.count(f"database.{method}")
+        self.backend.sleep(self.backend.db_latency)
+
+    def _names(self):
+        return [name for name, _ in self.backend.devices.values()]
+
+    def _parts(self, index):
+        return [name.split("/")[index] for name in self._names()]
+
+    def get_info(self):
+        self._call("get_info")
+        return (f"TANGO Database simulated\n\n"
+                f"Total number of devices: {len(self.backend.devices)}")
+
+    def get_device_exported(self, pattern):
+        self._call("get_device_exported")
+        return _matching(pattern, self._names())
+
+    def get_device_domain(self, pattern):
+        self._call("get_device_domain")
+        return _matching(pattern.split("/")[0], self._parts(0))
+
+    def get_device_family(self, pattern):
+        self._call("get_device_family")
+        domain, family = pattern.split("/")[:2]
+        return _matching(family, [name.split("/")[1]
+                                  for name in _matching(domain + "/*",
+                                                        self._names())])
+
+    def get_device_member(self, pattern):
+        self._call("get_device_member")
+        return [name.split("/")[2] for name in _matching(pattern,
+                                                          self._names())]
+
+    def get_server_name_list(self):
+        self._call("get_server_name_list")
+        return [SERVER]
+
+    def get_instance_name_list(self, server):
+        self._call("get_instance_name_list")
+        return sorted({full.split("/")[1]
+                       for _, full in self.backend.devices.values()
+                       if full.split("/")[0].lower() == server.lower()})
+
+    def get_device_class_list(self, instance):
+        self._call("get_device_class_list")
+        result = []
+        for name, full in sorted(self.backend.devices.values()):
+            if full.lower() == instance.lower():
+                result.extend([name, DEVICE_CLASS])
+        return result
+
+    def get_device_info(self, name):
+        self._call("get_device_info")
+        name = self.backend.device_name(name)
+        return SimpleNamespace(
+            name=name, exported=True, pid=1000, class_name=DEVICE_CLASS,
+            ds_full_name=self.backend.devices[name.lower()][1],
+            host="localhost", started_date=STARTED, stopped_date="")
+
+    def _device_properties(self, device):
+        return self.properties.setdefault(
+            device.lower(), {"polled_attr": ["scalar_0", "3000"],
+                             "description": [f"Simulated {device}"]})
+
+    def get_device_property_list(self, device, pattern):
+        self._call("get_device_property_list")
+        return _matching(pattern, self._device_properties(device))
+
+    def get_device_property(self, device, name):
+        self._call("get_device_property")
+        properties = self._device_properties(device)
+        return {name: list(properties.get(name, []))}
+
+    def put_device_property(self, device, properties):
+        self._call("put_device_property")
+        for name, value in properties.items():
+            if isinstance(value, str):
+                value = [value]
+            self._device_properties(device)[name] = list(value)
+
+    def delete_device_property(self, device, name):
+        self._call("delete_device_property")
+        self._device_properties(device).pop(name, None)
+
+    def command_inout(self, command, argin=None):
+        self._call(f"command_inout.{command}")
+        if command != "DbMySqlSelect":
+            raise _failure("API_CommandNotFound",
+                           f"Command {command} not simulated",
+                           "FakeDatabase.command_inout")
+        devices = sorted(self.backend.devices.values())
+        if argin == DEVICE_QUERY:
+            return _select_result([[name, server, DEVICE_CLASS, "1"]
+                                   for name, server in devices], 4)
+        if argin == SUMMARY_QUERY:
+            count = str(len(devices))
+            checksum = sum(zlib.crc32(f"{name} {server} {DEVICE_CLASS}"
+                                      .encode()) for name, server in devices)
+            return _select_result([[count, count, STARTED, "",
+                                    str(checksum)]], 5)
+        if argin.startswith("SELECT name, exported, pid"):
+            # The device infos, see tangogql.schema.loaders
+            wanted = re.findall(r"'((?:[^'\\]|\\.)*)'",
+                                argin.split(" IN ", 1)[1])
+            rows = []
+            for name in wanted:
+                device = self.backend.devices.get(name.lower())
+                if device is not None:
+                    rows.append([device[0], "1", "1000", DEVICE_CLASS,
+                                 device[1], "localhost", STARTED, ""])
+            return _select_result(rows, 8)
+        raise _failure("DB_SQLError", "Query not simulated",
+                       "FakeDatabase.command_inout")
+
+
+class FakeDeviceProxy(object):
+    """An asyncio proxy to a simulated device, like PyTango.DeviceProxy.
+
+    The calls that are coroutines with PyTango's asyncio green mode are
+    coroutines here too, the others are blocking.
+    """
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def dev_name(self):
+        return self.name
+
+    async def _call(self, method):
+        await asyncio.sleep(self.backend.delay())
+        self.backend.check(self.name, method)
+
+    async def state(self):
+        await self._call("state")
+        return PyTango.DevState.ON
+
+    async def read_attributes(self, names, extract_as=None):
+        await self._call("read_attributes")
+        return [self.backend.read(self.name, name) for name in names]
+
+    async def read_attribute(self, name, extract_as=None):
+        result, = await self.read_attributes([name])
+        return result
+
+    async def write_read_attribute(self, name, value):
+        await self._call("write_read_attribute")
+        return self.backend.read(self.name, name, value)
+
+    async def command_inout(self, command, argin=None):
+        await self._call("command_inout")
+        if command not in COMMANDS:
+            raise _failure("API_CommandNotFound",
+                           f"Command {command} not found",
+                           "FakeDeviceProxy.command_inout")
+        if command == "Status":
+            return "The device is in ON state."
+        return None
+
+    def attribute_list_query(self):
+        self.backend.sleep()
+        self.backend.check(self.name, "attribute_list_query")
+        infos = []
+        for name, data_format in self.backend.attributes:
+            info = PyTango.AttributeInfoEx()
+            info.name = name
+            info.label = name
+            info.data_format = data_format
+            info.data_type = PyTango.CmdArgType.DevDouble
+            info.writable = PyTango.AttrWriteType.READ_WRITE
+            for limit in ("min_value", "max_value", "min_alarm",
+                          "max_alarm"):
+                setattr(info, limit, "Not specified")
+            infos.append(info)
+        return infos
+
+    def command_list_query(self):
+        self.backend.sleep()
+        self.backend.check(self.name, "command_list_query")
+        return [SimpleNamespace(
+            cmd_name=command, cmd_tag=0,
+            disp_level=PyTango.DispLevel.OPERATOR,
+            in_type=PyTango.CmdArgType.DevVoid, in_type_desc="Uninitialised",
+            out_type=(PyTango.CmdArgType.DevString if command == "Status"
+                      else PyTango.CmdArgType.DevVoid),
+            out_type_desc="Uninitialised") for command in COMMANDS]
+
+    def info(self):
+        self.backend.sleep()
+        self.backend.check(self.name, "info")
+        return SimpleNamespace(
+            dev_class=DEVICE_CLASS, server_host="localhost",
+            server_id=self.backend.devices[self.name.lower()][1])
+
+
+class FakeEventProxy(object):
+    """A synchronous proxy to a simulated device, for the events."""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def get_attribute_config(self, attribute):
+        event = SimpleNamespace(abs_change="Not specified",
+                                rel_change="Not specified")
+        return SimpleNamespace(name=attribute,
+                               events=SimpleNamespace(ch_event=event))
+
+    def subscribe_event(self, attribute, event_type, callback):
+        return self.backend.subscribe_event(self.name, attribute, callback)
+
+    def unsubscribe_event(self, event_id):
+        self.backend.unsubscribe_event(event_id)
+
+
+def _shape(text):
+    try:
+        rows, columns = text.lower().split("x")
+        return int(rows), int(columns)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not rows x columns: {text}")
+
+
+# The command line options of the simulated control system, with the
+# keyword arguments of FakeTango
+OPTIONS = [
+    ("--devices", dict(type=int, default=500)),
+    ("--family-size", dict(type=int, default=50)),
+    ("--scalars", dict(type=int, default=10,
+                       help="SCALAR attributes per device")),
+    ("--spectrums", dict(type=int, default=1,
+                         help="SPECTRUM attributes per device")),
+    ("--spectrum-size", dict(type=int, default=1000)),
+    ("--images", dict(type=int, default=1,
+                      help="IMAGE attributes per device")),
+    ("--image-shape", dict(type=_shape, default=(256, 256),
+                           help="rows x columns, e.g. 256x256")),
+    ("--latency", dict(type=float, default=0.001,
+                       help="mean device call duration, in seconds")),
+    ("--db-latency", dict(type=float, default=0.001,
+                          help="mean database call duration, in seconds")),
+    ("--distribution", dict(default="constant",
+                            choices=LATENCY_DISTRIBUTIONS)),
+    ("--failure-rate", dict(type=float, default=0.0,
+                            help="probability of a failed call or read")),
+    ("--event-period", dict(type=float, default=0.1,
+                            help="seconds between change events, 0 to "
+                                 "poll")),
+    ("--seed", dict(type=int, default=0)),
+]
+
+
+def _dest(option):
+    return option[2:].replace("-", "_")
+
+
+def add_arguments(parser):
+    """Add the options of the simulated control system to a parser.
+
+    :type parser: argparse.ArgumentParser
+    """
+
+    group = parser.add_argument_group("simulated control system")
+    for option, kwargs in OPTIONS:
+        group.add_argument(option, **kwargs)
+
+
+def from_options(options):
+    """Create the FakeTango described by parsed command line options."""
+
+    return FakeTango(**{_dest(option): getattr(options, _dest(option))
+                        for option, _ in OPTIONS})
+
+
+def to_arguments(options):
+    """The command line options describing the same FakeTango.
+
+    :rtype: list of str
+    """
+
+    arguments = []
+    for option, _ in OPTIONS:
+        value = getattr(options, _dest(option))
+        if option == "--image-shape":
+            value = "x".join(str(size) for size in value)
+        arguments.extend([option, str(value)])
+    return arguments
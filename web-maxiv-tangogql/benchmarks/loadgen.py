@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+"""Load generator for the subscriptions, like many dashboards would do.
+
+Opens many graphql-ws connections to /socket, each subscribing to a set of
+attributes with Subscription.attributes, and reports the delivered frame
+rate, the end-to-end latency (from the timestamp of the value to its
+reception), the memory of the server and the frames it dropped, as JSON.
+
+Against a running server:
+
+    python -m benchmarks.loadgen --url http://localhost:5004 \\
+        --connections 2000 --per-client 10 --duration 30
+
+or against a server with a simulated control system, started (and stopped)
+for the run, so that it works offline:
+
+    python -m benchmarks.loadgen --spawn --devices 1000 --event-period 0.1
+
+The attributes are taken from --attribute (repeatable), or else from the
+SCALAR attributes of the simulated devices (see benchmarks.fake_tango).
+Each connection subscribes to --per-client of the first --pool-size ones,
+chosen at random, so that the connections share some of them.
+
+The server figures come from its /metrics: with several workers, they are
+the ones of the worker that answered. The latency assumes that the server
+(or the devices) and the load generator share a clock. Opening thousands of
+connections needs as many file descriptors (see ulimit -n), and a single
+load generator process may saturate its CPU before the server does, the
+CPU time it used is reported to tell.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+from benchmarks.fake_tango import add_arguments, device_names, to_arguments
+from benchmarks.stats import Reservoir, summary
+from tangogql.serializer import serializer
+
+__all__ = ['LoadStats', 'run_load', 'main']
+
+SUBSCRIPTION = """
+subscription Attributes($fullNames: [String]!) {
+  attributes(fullNames: $fullNames) { fullName value quality timestamp }
+}
+"""
+
+BATCHED_SUBSCRIPTION = """
+subscription Attributes($fullNames: [String]!) {
+  attributeFrames(fullNames: $fullNames) {
+    fullName value quality timestamp
+  }
+}
+"""
+
+# The server metrics reported, summed over their labels
+SERVER_METRICS = ("process_resident_memory_bytes", "tangogql_subscribers",
+                  "tangogql_subscribed_attributes",
+                  "tangogql_frames_sent_total",
+                  "tangogql_frames_dropped_total")
+
+# Seconds to wait for a spawned server to answer
+SPAWN_TIMEOUT = 60
+
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__)))
+
+
+class LoadStats(object):
+    """What the connections received, during the measurement window."""
+
+    def __init__(self, connections, samples=100000):
+        self.connected = 0
+        self.failed = Counter()
+        self.closed = 0
+        self.errors = 0
+        self.frames = 0
+        self.per_connection = [0] * connections
+        self.latency = Reservoir(samples)
+        self.measuring = False
+        self.started = None
+        self.stopped = None
+
+    def start(self):
+        self.measuring = True
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.measuring = False
+        self.stopped = time.perf_counter()
+
+    def add_frames(self, index, frames):
+        if not self.measuring:
+            return
+        now = time.time()
+        self.frames += len(frames)
+        self.per_connection[index] += len(frames)
+        for frame in frames:
+            timestamp = frame.get("timestamp")
+            if timestamp is not None:
+                self.latency.add(now - timestamp)
+
+    def report(self):
+        duration = (self.stopped or time.perf_counter()) - self.started
+        return {"duration": duration,
+                "connected": self.connected,
+                "failed": dict(self.failed),
+                "closed_by_server": self.closed,
+                "errors": self.errors,
+                "frames": self.frames,
+                "frames_per_second": self.frames / duration,
+                "frames_per_second_per_connection": summary(
+                    [count / duration for count in self.per_connection]),
+                "latency": self.latency.summary()}
+
+
+async def connection(session, url, index, attributes, stats,
+                     batched=False):
+    """One client: subscribe to the attributes, count what arrives."""
+
+    query = BATCHED_SUBSCRIPTION if batched else SUBSCRIPTION
+    field = "attributeFrames" if batched else "attributes"
+    try:
+        async with session.ws_connect(url, protocols=("graphql-ws",),
+                                      max_msg_size=0) as ws:
+            await ws.send_str(json.dumps({"type": "connection_init",
+                                          "payload": {}}))
+            await ws.send_str(json.dumps({
+                "id": "1", "type": "start",
+                "payload": {"query": query,
+                            "variables": {"fullNames": attributes}}}))
+            stats.connected += 1
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                data = serializer.loads(message.data)
+                kind = data.get("type")
+                if kind == "data":
+                    payload = data.get("payload") or {}
+                    if payload.get("errors"):
+                        stats.errors += 1
+                    frames = (payload.get("data") or {}).get(field)
+                    if frames:
+                        stats.add_frames(index, frames if batched
+                                         else [frames])
+                elif kind in ("error", "connection_error"):
+                    stats.errors += 1
+                elif kind == "complete":
+                    break
+            stats.closed += 1
+    except asyncio.CancelledError:
+        raise
+    except Exception as error:
+        stats.failed[type(error).__name__] += 1
+
+
+def parse_metrics(text, names=SERVER_METRICS):
+    """The values of some metrics in the Prometheus text format.
+
+    :return: The value of each metric, summed over its labels.
+    :rtype: dict
+    """
+
+    values = dict.fromkeys(names, 0.0)
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name = series.split("{", 1)[0]
+        if name in values:
+            values[name] += float(value)
+    return values
+
+
+async def scrape(session, url):
+    """The server metrics, None if they can not be read."""
+
+    try:
+        async with session.get(url + "/metrics") as response:
+            return parse_metrics(await response.text())
+    except aiohttp.ClientError:
+        return None
+
+
+async def wait_ready(session, url, server=None, timeout=SPAWN_TIMEOUT):
+    """Wait until the server answers on /health.
+
+    :param server: The spawned server process, if any.
+    :type server: subprocess.Popen
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url + "/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"The server exited ({server.returncode})")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"The server at {url} is not answering")
+        await asyncio.sleep(0.5)
+
+
+async def sample_server(session, url, samples, period=1.0):
+    """Scrape the server metrics periodically, forever."""
+
+    while True:
+        metrics = await scrape(session, url)
+        if metrics is not None:
+            samples.append(metrics)
+        await asyncio.sleep(period)
+
+
+def attribute_sets(options):
+    """The attributes of each connection."""
+
+    pool = options.attributes
+    if not pool:
+        pool = [f"{name}/scalar_{index % options.scalars}"
+                for index, (name, _) in enumerate(device_names(
+                    options.devices, options.family_size))]
+    pool = pool[:options.pool_size]
+    chooser = random.Random(options.seed)
+    size = min(options.per_client, len(pool))
+    return [chooser.sample(pool, size) for _ in range(options.connections)]
+
+
+def spawn_server(options):
+    """Start a server with a simulated control system."""
+
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_server"] +
+        to_arguments(options),
+        cwd=SERVER_DIRECTORY, stdout=subprocess.DEVNULL,
+        stderr=None if options.server_output else subprocess.DEVNULL)
+
+
+async def run_load(options):
+    """Run the load, return the results.
+
+    :rtype: dict
+    """
+
+    url = options.url.rstrip("/")
+    socket_url = url.replace("http", "ws", 1) + "/socket"
+    subscriptions = attribute_sets(options)
+    stats = LoadStats(options.connections)
+    samples = []
+    server = spawn_server(options) if options.spawn else None
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, url, server)
+            before = await scrape(session, url)
+            clients = []
+            opening = time.perf_counter()
+            for index, attributes in enumerate(subscriptions):
+                clients.append(asyncio.ensure_future(connection(
+                    session, socket_url, index, attributes, stats,
+                    options.batched)))
+                if options.connect_rate:
+                    await asyncio.sleep(1 / options.connect_rate)
+            opening = time.perf_counter() - opening
+            await asyncio.sleep(options.warmup)
+            sampler = asyncio.ensure_future(
+                sample_server(session, url, samples))
+            stats.start()
+            await asyncio.sleep(options.duration)
+            stats.stop()
+            sampler.cancel()
+            for client in clients:
+                client.cancel()
+            await asyncio.gather(*clients, return_exceptions=True)
+            # Let the server notice the disconnections
+            await asyncio.sleep(options.settle)
+            after = await scrape(session, url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result = {"options": vars(options),
+              "opening_seconds": opening,
+              "client": dict(stats.report(),
+                             cpu_seconds=usage.ru_utime + usage.ru_stime),
+              "server": None}
+    if before is not None and after is not None:
+        memory = [sample["process_resident_memory_bytes"]
+                  for sample in samples]
+        result["server"] = {
+            "rss_bytes": {"before": before["process_resident_memory_bytes"],
+                          "peak": max(memory, default=None),
+                          "after": after["process_resident_memory_bytes"]},
+            "subscribers_peak": max((sample["tangogql_subscribers"]
+                                     for sample in samples), default=None),
+            "attributes_peak": max(
+                (sample["tangogql_subscribed_attributes"]
+                 for sample in samples), default=None),
+            "frames_sent": (after["tangogql_frames_sent_total"] -
+                            before["tangogql_frames_sent_total"]),
+            "frames_dropped": (after["tangogql_frames_dropped_total"] -
+                               before["tangogql_frames_dropped_total"])}
+    return result
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Subscription load generator for tangogql")
+    parser.add_argument("--url", default="http://localhost:5004",
+                        help="base url of the server")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server with a simulated control "
+                             "system for the run (on port 5004)")
+    parser.add_argument("--server-output", action="store_true",
+                        help="show the logs of the spawned server")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--connect-rate", type=float, default=500,
+                        help="connections opened per second, 0 for all "
+                             "at once")
+    parser.add_argument("--attribute", dest="attributes", action="append",
+                        help="full name of an attribute to subscribe to "
+                             "(repeatable), default the simulated ones")
+    parser.add_argument("--pool-size", type=int, default=100,
+                        help="number of distinct attributes")
+    parser.add_argument("--per-client", type=int, default=10,
+                        help="attributes per connection")
+    parser.add_argument("--batched", action="store_true",
+                        help="use attributeFrames instead of attributes")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="seconds before measuring")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds of measurement")
+    parser.add_argument("--settle", type=float, default=2,
+                        help="seconds to wait for the server after "
+                             "disconnecting")
+    parser.add_argument("--output", help="file to write, default stdout")
+    add_arguments(parser)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_load(options))
+    text = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
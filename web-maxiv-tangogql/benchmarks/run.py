@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+"""Benchmarks of the query execution, against a simulated control system.
+
+The queries are executed in the process, like /db does (without the
+response cache), against a FakeTango backend (see benchmarks.fake_tango),
+and the results are printed as JSON, e.g.
+
+    python -m benchmarks.run --devices 2000 --latency 0.005 \\
+        --output results.json
+
+The scenarios are:
+
+- tree: browsing the domains, families and members, and the servers,
+  instances and classes, from the device tree index.
+- devices: the scalar attributes (value and quality) and state of all the
+  devices, in one query.
+- arrays: the SPECTRUM and IMAGE values of some devices, in each encoding.
+- mutations: writing attributes and running commands on random devices.
+- subscriptions: many subscribers (like websocket clients) to the same
+  attributes, through the subscription hub.
+
+Each scenario runs a few times; the first run (with cold caches) is
+reported on its own, and the others as statistics, in seconds. The calls
+to the simulated database and devices are counted for each run.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from graphql import parse
+from graphql.execution import execute
+from graphql.execution.executors.asyncio import AsyncioExecutor
+
+from benchmarks.fake_tango import add_arguments, from_options
+from benchmarks.stats import summary
+from tangogql.schema.authorization import (AuthenticationMiddleware,
+                                           AuthorizationMiddleware)
+from tangogql.schema.base import tree as device_tree
+from tangogql.schema.subscription import FRAMES_DROPPED, subscribe_frames
+from tangogql.schema.tango import tangoschema
+from tangogql.serializer import serializer
+
+__all__ = ['run_benchmarks', 'main']
+
+SCENARIOS = OrderedDict()
+
+TREE_QUERY = """
+{
+  domains { name families { name members { name } } }
+  servers { name instances { name classes { name devices { name } } } }
+}
+"""
+
+DEVICES_QUERY = """
+{
+  devices {
+    name state
+    attributes(pattern: "scalar_*") { name value quality timestamp }
+  }
+}
+"""
+
+ARRAYS_QUERY = """
+query Arrays($count: Int, $pattern: String, $encoding: String) {
+  devices(first: $count) {
+    name
+    attributes(pattern: $pattern) { name value(encoding: $encoding) }
+  }
+}
+"""
+
+SET_ATTRIBUTE_MUTATION = """
+mutation SetAttribute($device: String!, $value: ScalarTypes!) {
+  setAttributeValue(device: $device, name: "scalar_0", value: $value) {
+    ok message
+  }
+}
+"""
+
+COMMAND_MUTATION = """
+mutation Command($device: String!) {
+  executeCommand(device: $device, command: "Status") { ok message output }
+}
+"""
+
+
+def scenario(function):
+    """Register a benchmark scenario, by the name of the function."""
+
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+class Bench(object):
+    """What the scenarios need: the backend, the options and the schema."""
+
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.context = {"client_data": {"user": "benchmark", "groups": []},
+                        "config_data": {"required_groups": []},
+                        "native_arrays": serializer.numpy}
+        self._documents = {}
+
+    async def execute(self, query, variables=None):
+        """Execute a query like /db does.
+
+        :return: The size of the serialized response, and whether it had
+                 errors.
+        :rtype: tuple
+        """
+
+        # Parsed once, like the documents cache of the server does
+        document = self._documents.get(query)
+        if document is None:
+            document = self._documents[query] = parse(query)
+        result = await execute(
+            tangoschema, document, variable_values=variables,
+            middleware=[AuthenticationMiddleware, AuthorizationMiddleware],
+            context_value=dict(self.context), return_promise=True,
+            executor=AsyncioExecutor(loop=asyncio.get_event_loop()))
+        data = {"data": result.data}
+        if result.errors:
+            data["errors"] = [str(error) for error in result.errors]
+        return len(serializer.dumps(data)), bool(result.errors)
+
+    async def measure(self, function, runs=None):
+        """Run a coroutine function several times.
+
+        :param function: Returns the response size and whether there were
+                         errors, like execute.
+
+        :return: The duration of the first run and the statistics of the
+                 others, the response size, the runs with errors and the
+                 backend calls per run.
+        :rtype: dict
+        """
+
+        runs = runs or self.options.runs
+        durations = []
+        errors = 0
+        size = None
+        calls_before = self.backend.calls_since()
+        for _ in range(runs):
+            started = time.perf_counter()
+            size, failed = await function()
+            durations.append(time.perf_counter() - started)
+            errors += failed
+        calls = self.backend.calls_since(calls_before)
+        return {"first": durations[0], "warm": summary(durations[1:]),
+                "bytes": size, "runs_with_errors": errors,
+                "calls_per_run": {name: count / runs
+                                  for name, count in sorted(calls.items())}}
+
+
+@scenario
+async def tree(bench):
+    started = time.perf_counter()
+    await device_tree.refresh(full=True)
+    index_seconds = time.perf_counter() - started
+    result = await bench.measure(lambda: bench.execute(TREE_QUERY))
+    result["index_seconds"] = index_seconds
+    result["index"] = device_tree.footprint()
+    return result
+
+
+@scenario
+async def devices(bench):
+    return await bench.measure(lambda: bench.execute(DEVICES_QUERY))
+
+
+@scenario
+async def arrays(bench):
+    results = OrderedDict()
+    for kind in ("spectrum", "image"):
+        for encoding in ("json", "base64"):
+            variables = {"count": bench.options.array_devices,
+                         "pattern": f"{kind}_*", "encoding": encoding}
+            results[f"{kind}_{encoding}"] = await bench.measure(
+                lambda: bench.execute(ARRAYS_QUERY, variables))
+    return results
+
+
+@scenario
+async def mutations(bench):
+    names = [name for name, _ in bench.backend.devices.values()]
+
+    async def run_mutations():
+        size = 0
+        failed = False
+        for _ in range(bench.options.mutations // 2):
+            device = bench.random.choice(names)
+            for query, variables in [
+                    (SET_ATTRIBUTE_MUTATION,
+                     {"device": device, "value": bench.random.random()}),
+                    (COMMAND_MUTATION, {"device": device})]:
+                response_size, errors = await bench.execute(query, variables)
+                size += response_size
+                failed = failed or errors
+        return size, failed
+
+    result = await bench.measure(run_mutations)
+    result["mutations_per_run"] = bench.options.mutations // 2 * 2
+    return result
+
+
+@scenario
+async def subscriptions(bench):
+    options = bench.options
+    names = [name for name, _ in bench.backend.devices.values()]
+    attributes = [f"{name}/scalar_{index % bench.backend.config['scalars']}"
+                  for index, name in enumerate(names)][:options.subscribed]
+    latencies = []
+    received = [0]
+    dropped_before = FRAMES_DROPPED.value
+
+    async def client():
+        async for frames in subscribe_frames(attributes):
+            now = time.time()
+            received[0] += len(frames)
+            latencies.extend(now - frame.timestamp for frame in frames)
+
+    calls_before = bench.backend.calls_since()
+    clients = [asyncio.ensure_future(client())
+               for _ in range(options.clients)]
+    await asyncio.sleep(options.duration)
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    calls = bench.backend.calls_since(calls_before)
+    return {"clients": options.clients, "attributes": len(attributes),
+            "duration": options.duration, "frames": received[0],
+            "frames_per_second": received[0] / options.duration,
+            "latency": summary(latencies),
+            "dropped": FRAMES_DROPPED.value - dropped_before,
+            "upstream_calls": dict(sorted(calls.items()))}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(options):
+    """Run the selected scenarios, return the results.
+
+    :rtype: dict
+    """
+
+    backend = from_options(options)
+    backend.install()
+    bench = Bench(backend, options)
+    results = OrderedDict()
+    try:
+        for name in options.scenarios or SCENARIOS:
+            results[name] = await SCENARIOS[name](bench)
+    finally:
+        backend.close()
+    return OrderedDict([
+        ("timestamp", datetime.datetime.utcnow().isoformat() + "Z"),
+        ("revision", _git_revision()),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("options", vars(options)),
+        ("backend", backend.config),
+        ("scenarios", results)])
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark tangogql against a simulated control system")
+    parser.add_argument("--scenario", dest="scenarios", action="append",
+                        choices=list(SCENARIOS),
+                        help="scenario to run (repeatable, default all)")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="runs of each query scenario")
+    parser.add_argument("--output", help="file to write, default stdout")
+    add_arguments(parser)
+    scenarios = parser.add_argument_group("scenarios")
+    scenarios.add_argument("--array-devices", type=int, default=10,
+                           help="devices read by the arrays scenario")
+    scenarios.add_argument("--mutations", type=int, default=100,
+                           help="mutations per run")
+    scenarios.add_argument("--clients", type=int, default=100,
+                           help="subscribers of the subscriptions scenario")
+    scenarios.add_argument("--subscribed", type=int, default=20,
+                           help="attributes of each subscriber")
+    scenarios.add_argument("--duration", type=float, default=5,
+                           help="seconds of the subscriptions scenario")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_benchmarks(options))
+    text = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""Statistics of the benchmark measurements."""
+
+import random
+import statistics
+
+__all__ = ['percentile', 'summary', 'Reservoir']
+
+
+def percentile(values, fraction):
+    """The nearest-rank percentile of values, None if there are none."""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, int(round(fraction * len(ordered))) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summary(values):
+    """Statistics of durations (or any other values)."""
+
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "min": min(values),
+            "median": statistics.median(values),
+            "mean": statistics.mean(values),
+            "p95": percentile(values, 0.95), "p99": percentile(values, 0.99),
+            "max": max(values)}
+
+
+class Reservoir(object):
+    """A uniform random sample of at most size values, of any number.
+
+    :param size: Maximum number of values kept.
+    :type size: int
+    """
+
+    def __init__(self, size=100000, seed=0):
+        self.size = size
+        self.count = 0
+        self.values = []
+        self._random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = self._random.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
+
+    def summary(self):
+        """Statistics of the sample, with the count of all the values."""
+
+        return dict(summary(self.values), count=self.count)
@@ -3,4 +3,7 @@
 """Main executable."""
 
 from tangogql.aioserver import run
-run()
+
+# Guarded, as the worker processes import this module again
+if __name__ == "__main__":
+    run()
@@ -5,14 +5,15 @@
 The idea is that each client establishes a websocket connection with
 this server (on /socket), and sets up a number of subscriptions to
 TANGO attributes.  The server keeps track of changes to these
-attributes and sends events to the interested clients. The server uses
-Taurus for this, so polling, sharing listeners, etc is handled "under
-the hood".
+attributes and sends events to the interested clients. Each attribute
+has a single shared listener (see tangogql.listener), using TANGO events
+when available and polling otherwise.
 
 There is also a GraphQL endpoint (/db) for querying the TANGO database.
 """
 
 import logging
+import signal
 import aiohttp
 import aiohttp_cors
 import asyncio
@@ -22,10 +23,38 @@ import json
 import sys
 
 from tangogql.routes import routes
+from tangogql.schema.base import db, tree, subscriptions
+from tangogql.broker import RemoteHub
+from tangogql.tangodb import DB_PROBE_PERIOD
+from tangogql.devicetree import DEVICE_TREE_REFRESH
+from tangogql.metrics import monitor_loop_lag, LOOP_LAG_PERIOD
+from tangogql.workers import Supervisor, WORKERS, SHUTDOWN_TIMEOUT
+
+
+__all__ = ['run', 'start']
+
+async def start_background_tasks(app):
+    if isinstance(subscriptions, RemoteHub):
+        subscriptions.start()
+    if DB_PROBE_PERIOD > 0:
+        app["db_probe"] = asyncio.ensure_future(
+            db.watch_changes(DB_PROBE_PERIOD))
+    if DEVICE_TREE_REFRESH > 0:
+        app["device_tree"] = asyncio.ensure_future(
+            tree.watch(DEVICE_TREE_REFRESH))
+    if LOOP_LAG_PERIOD > 0:
+        app["loop_lag"] = asyncio.ensure_future(
+            monitor_loop_lag(LOOP_LAG_PERIOD))
+
+
+async def cleanup_background_tasks(app):
+    for name in ("db_probe", "device_tree", "loop_lag"):
+        if name in app:
+            app[name].cancel()
+    if isinstance(subscriptions, RemoteHub):
+        subscriptions.close()
 
 
-__all__ = ['run']
-
 # A factory function is needed to use aiohttp-devtools for live reload functionality.
 def setup_server():
     app = aiohttp.web.Application(debug=True)
@@ -41,6 +70,8 @@ def setup_server():
     for r in list(app.router.routes()):
         cors.add(r)
     app.router.add_static('/', 'static')
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(cleanup_background_tasks)
 
     return app
 
@@ -80,6 +111,10 @@ def setup():
     else:
         logfile = "/tmp/" + logfile
 
+    # The workers would otherwise rotate the same file
+    if os.environ.get("WORKER_ID"):
+        logfile = logfile + "-worker" + os.environ.get("WORKER_ID")
+
     logfile = logfile + ".log"
 
     return (
@@ -125,30 +160,58 @@ def dev_run():
     (app, _) = setup()
     return app
 
-def run():
+async def start(app, host='0.0.0.0', port=5004, reuse_port=False):
+    """Run the startup of the app and start serving it.
+
+    :param reuse_port: Share the port with other processes (SO_REUSEPORT).
+    :type reuse_port: bool
+
+    :return: The runner, to clean up when done.
+    :rtype: aiohttp.web.AppRunner
+    """
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, host, port,
+                               shutdown_timeout=SHUTDOWN_TIMEOUT,
+                               reuse_port=reuse_port or None)
+    await site.start()
+    return runner
+
+def run(reuse_port=False, ready=None):
+    """Run the server, in as many processes as WORKERS.
+
+    :param reuse_port: Share the port with other processes (SO_REUSEPORT),
+                       as the workers do.
+    :type reuse_port: bool
+    :param ready: Event to set once the server is listening.
+    :type ready: multiprocessing.Event
+    """
     (app, logger) = setup()
     # check configuration file
     if is_configuration_corrupt("config.json"):
         sys.exit(1)
+    if WORKERS > 1 and not reuse_port:
+        sys.exit(Supervisor(WORKERS).run())
     loop = asyncio.get_event_loop()
-    handler = app.make_handler(debug=True)
-    f = loop.create_server(handler, '0.0.0.0', 5004)
+    runner = loop.run_until_complete(start(app, reuse_port=reuse_port))
 
     # TODO: Get this value from an environment variable
     # hostname = "http://w-v-kitslab-web-0:5004/graphiql"
     hostname = "http://localhost:5004/graphiql"
 
     logger.debug(f"Point your browser to {hostname}")
-    srv = loop.run_until_complete(f)
+    if ready is not None:
+        ready.set()
+    # Stop gracefully, e.g. when a worker is replaced
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         print("Ctrl-C was pressed")
     finally:
-        loop.run_until_complete(handler.shutdown())
-        srv.close()
-        loop.run_until_complete(srv.wait_closed())
-        loop.run_until_complete(app.cleanup())
+        # Stop accepting connections, let the requests finish, then run
+        # the cleanup of the app
+        loop.run_until_complete(runner.cleanup())
     loop.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""Encoding of SPECTRUM and IMAGE attribute values.
+
+By default arrays are sent as (nested) JSON lists. For large arrays this
+means one Python object per element, so they can instead be sent as their
+raw little-endian buffer, encoded in base64 along with the dtype and shape
+needed to decode it, e.g. in the browser:
+
+    new Float64Array(Uint8Array.from(atob(data), c => c.charCodeAt(0)).buffer)
+
+The buffer is taken straight from the NumPy array, without going through
+Python objects.
+
+Arrays can also be cut down on the server before being sent, see
+reduce_array.
+"""
+
+import base64
+
+import numpy as np
+
+__all__ = ['ENCODINGS', 'to_buffer', 'encode_array', 'format_array',
+           'check_reduction', 'reduce_array', 'decimate']
+
+ENCODINGS = ("json", "base64")
+
+
+def to_buffer(value):
+    """Return an array as a C-contiguous little-endian NumPy array.
+
+    No copy is made if the array already has that layout.
+
+    :param value: The array.
+    :type value: numpy.ndarray
+
+    :return: The array, or None if it can not be represented as a buffer
+             (e.g. an array of strings).
+    :rtype: numpy.ndarray
+    """
+
+    array = np.asarray(value)
+    if array.dtype.kind not in "biuf":
+        return None
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+
+
+def encode_array(value):
+    """Encode an array as a base64 little-endian buffer.
+
+    :param value: The array.
+    :type value: numpy.ndarray
+
+    :return: The "dtype" (NumPy type string, e.g. "<f8"), "shape" and
+             base64 "data" of the array, or None if it can not be encoded.
+    :rtype: dict
+    """
+
+    array = to_buffer(value)
+    if array is None:
+        return None
+    return {
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "data": base64.b64encode(memoryview(array)).decode("ascii"),
+    }
+
+
+def format_array(value, encoding="json", native=False):
+    """Format a value for the GraphQL response.
+
+    Scalars are returned as is, arrays according to the encoding.
+
+    :param value: The value read from TANGO.
+    :param encoding: One of ENCODINGS.
+    :type encoding: str
+    :param native: Return numerical arrays as they are for the "json"
+                   encoding, when the response serializer encodes NumPy
+                   arrays itself (see tangogql.serializer).
+    :type native: bool
+
+    :raises ValueError: If the encoding is unknown.
+    """
+
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    if isinstance(value, np.ndarray):
+        if encoding == "base64":
+            encoded = encode_array(value)
+            if encoded is not None:
+                return encoded
+        elif native and value.dtype.kind in "biuf":
+            return value
+        return value.tolist()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def check_reduction(stride=None, max_points=None):
+    """Check the arguments of reduce_array that do not depend on the array.
+
+    :raises ValueError: If the stride is less than 1 or max_points less
+                        than 2.
+    """
+
+    if stride is not None and stride < 1:
+        raise ValueError("The stride must be at least 1")
+    if max_points is not None and max_points < 2:
+        raise ValueError("max_points must be at least 2")
+
+
+def reduce_array(value, roi=None, stride=None, max_points=None):
+    """Cut an array down to what the client needs.
+
+    Scalars are returned as is.
+
+    :param value: The array.
+    :type value: numpy.ndarray
+    :param roi: Region of interest, as a start and stop index for each
+                dimension: [start, stop] for a SPECTRUM and [row_start,
+                row_stop, column_start, column_stop] for an IMAGE. A stop
+                of 0 or less counts from the end, like in Python slices.
+    :type roi: list of int
+    :param stride: Only keep every stride-th element in each dimension.
+    :type stride: int
+    :param max_points: Decimate the array to at most this many points, see
+                       decimate.
+    :type max_points: int
+
+    :raises ValueError: If the ROI does not match the array dimensions, or
+                        the other arguments are invalid (see
+                        check_reduction).
+    """
+
+    check_reduction(stride, max_points)
+    if value is None or np.isscalar(value) or not (roi or stride or
+                                                   max_points):
+        return value
+    array = np.asarray(value)
+    if array.ndim == 0:
+        return value
+    if roi:
+        if len(roi) != 2 * array.ndim:
+            raise ValueError(f"The ROI needs {2 * array.ndim} indices")
+        array = array[tuple(slice(start, stop if stop > 0 else
+                                  (array.shape[dim] + stop))
+                            for dim, (start, stop)
+                            in enumerate(zip(roi[::2], roi[1::2])))]
+    if stride and stride > 1:
+        array = array[(slice(None, None, stride),) * array.ndim]
+    if max_points:
+        array = decimate(array, max_points)
+    return array
+
+
+def decimate(array, max_points):
+    """Decimate an array to at most max_points points, keeping the peaks.
+
+    A SPECTRUM is split in max_points / 2 buckets, and the minimum and the
+    maximum of each bucket are kept, in their original order. An IMAGE is
+    split in square blocks, and each block is reduced to its minimum or
+    its maximum, whichever is further from the mean of the block, so that
+    both the bright and the dark spots remain. Arrays that are not
+    numerical, or small enough already, are returned as is.
+
+    :param array: The array.
+    :type array: numpy.ndarray
+    :param max_points: The maximum number of points, at least 2.
+    :type max_points: int
+
+    :raises ValueError: If max_points is less than 2.
+    """
+
+    check_reduction(max_points=max_points)
+    if array.size <= max_points or array.dtype.kind not in "biuf":
+        return array
+    if array.ndim == 1:
+        buckets = max_points // 2
+        size = -(-len(array) // buckets)
+        padded = np.pad(array, (0, buckets * size - len(array)), "edge")
+        blocks = padded.reshape(buckets, size)
+        rows = np.arange(buckets)
+        low = blocks.argmin(axis=1)
+        high = blocks.argmax(axis=1)
+        first = np.minimum(low, high)
+        second = np.maximum(low, high)
+        result = np.empty((buckets, 2), dtype=array.dtype)
+        result[:, 0] = blocks[rows, first]
+        result[:, 1] = blocks[rows, second]
+        return result.ravel()
+    if array.ndim == 2:
+        factor = int(np.ceil(np.sqrt(array.size / max_points)))
+        while -(-array.shape[0] // factor) * \
+                -(-array.shape[1] // factor) > max_points:
+            factor += 1
+        rows = -(-array.shape[0] // factor)
+        columns = -(-array.shape[1] // factor)
+        padded = np.pad(array, ((0, rows * factor - array.shape[0]),
+                                (0, columns * factor - array.shape[1])),
+                        "edge")
+        blocks = padded.reshape(rows, factor, columns, factor)
+        low = blocks.min(axis=(1, 3))
+        high = blocks.max(axis=(1, 3))
+        mean = blocks.mean(axis=(1, 3))
+        return np.where(high - mean >= mean - low, high, low)
+    return array
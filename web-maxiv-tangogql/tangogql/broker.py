@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+"""Subscription broker, shared by the worker processes.
+
+When the server runs several worker processes (see tangogql.workers), each
+of them would otherwise have its own SubscriptionHub, and an attribute
+watched by clients of N workers would be read (or listened to) N times.
+Instead, a single broker process owns the hub, and the workers connect to
+it over a Unix socket with a RemoteHub, which has the same interface.
+
+A worker asks the broker for the attributes its clients subscribe to (once
+per attribute, however many local clients want it), and fans the frames it
+receives out to its own subscribers. The broker conflates the frames of a
+worker that is slow to read them, like for any other subscriber.
+
+The messages are tuples, pickled and prefixed by their length. The socket
+must only be accessible to the server (the workers create it in a private
+directory by default). The workers send a heartbeat with their status every
+BROKER_HEARTBEAT seconds, and each side drops the connection when the other
+has been silent for three heartbeats. The workers reconnect, and subscribe
+again, when the connection is lost.
+
+The broker can also run on its own, with
+
+    python -m tangogql.broker /path/to/socket
+
+and single process servers use it when BROKER_SOCKET is set.
+"""
+
+import asyncio
+import logging
+import os
+import pickle
+import signal
+import struct
+import sys
+
+import PyTango
+
+from tangogql.listener import Keeper, split_name
+
+logger = logging.getLogger('logger')
+
+__all__ = ['Broker', 'RemoteHub', 'read_message', 'write_message']
+
+# Path of the Unix socket of the broker, if the subscriptions go through one
+BROKER_SOCKET = os.environ.get("BROKER_SOCKET")
+
+# Period (in seconds) of the heartbeats between the workers and the broker
+HEARTBEAT_PERIOD = float(os.environ.get("BROKER_HEARTBEAT", 5))
+
+# Time (in seconds) to wait before connecting again to the broker
+RECONNECT_DELAY = 1.0
+
+_HEADER = struct.Struct("!I")
+
+
+async def read_message(reader):
+    """Read a message from a stream.
+
+    :raises asyncio.IncompleteReadError: If the stream is closed.
+    """
+
+    header = await reader.readexactly(_HEADER.size)
+    size, = _HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_message(writer, message):
+    """Write a message to a stream."""
+
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+def _portable(frame):
+    """A copy of a frame that can be sent to a worker."""
+
+    result = {}
+    for name, value in frame.items():
+        if name == "encoded":
+            continue
+        if isinstance(value, PyTango.DevState):
+            value = str(value)
+        result[name] = value
+    return result
+
+
+class Broker(object):
+    """Serve a SubscriptionHub to the workers.
+
+    :param hub: The hub doing the actual subscriptions.
+    :type hub: tangogql.listener.SubscriptionHub
+    :param path: Path of the Unix socket to listen on.
+    :type path: str
+    :param heartbeat: Expected period (in seconds) of the worker heartbeats.
+    :type heartbeat: float
+    """
+
+    def __init__(self, hub, path, heartbeat=HEARTBEAT_PERIOD):
+        self.hub = hub
+        self.path = path
+        self.heartbeat = heartbeat
+        # The status of each connected worker, by keeper
+        self.workers = {}
+        self._writers = set()
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve,
+                                                       path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._writers):
+            writer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def health(self):
+        """Return the last reported status of each worker."""
+
+        now = asyncio.get_event_loop().time()
+        return [dict(status, last_seen=now - seen)
+                for status, seen in self.workers.values()]
+
+    async def _serve(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        # Unbounded, as only the latest frame of each attribute is kept
+        keeper = Keeper(maxsize=0, policy="conflate", max_rate=0)
+        self.workers[keeper] = ({}, loop.time())
+        self._writers.add(writer)
+        sender = asyncio.ensure_future(self._send_frames(keeper, writer))
+        try:
+            while True:
+                message = await asyncio.wait_for(read_message(reader),
+                                                 3 * self.heartbeat)
+                kind = message[0]
+                status = self.workers[keeper][0]
+                self.workers[keeper] = (status, loop.time())
+                if kind == "subscribe":
+                    self.hub.subscribe(keeper, message[1])
+                elif kind == "unsubscribe":
+                    self.hub.unsubscribe(keeper, message[1])
+                elif kind == "heartbeat":
+                    self.workers[keeper] = (message[1], loop.time())
+                    write_message(writer, ("heartbeat",))
+                elif kind == "health":
+                    write_message(writer, ("health", self.health()))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError) as error:
+            logger.debug(f"Broker lost a worker: {error!r}")
+        finally:
+            sender.cancel()
+            self.hub.unsubscribe(keeper)
+            del self.workers[keeper]
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _send_frames(self, keeper, writer):
+        while True:
+            frames = await keeper.get_batch()
+            thresholds = {}
+            for frame in frames:
+                key = (frame["device"], frame["attribute"])
+                thresholds[key] = self.hub.change_thresholds(*key)
+            write_message(writer, ("frames", [_portable(frame)
+                                              for frame in frames],
+                                   thresholds))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+
+
+class RemoteHub(object):
+    """Stand-in for a SubscriptionHub, getting the frames from a broker.
+
+    :param path: Path of the Unix socket of the broker.
+    :type path: str
+    :param heartbeat: Period (in seconds) of the heartbeats.
+    :type heartbeat: float
+    """
+
+    def __init__(self, path, heartbeat=HEARTBEAT_PERIOD):
+        self.path = path
+        self.heartbeat = heartbeat
+        self.connected = False
+        self._keepers = {}
+        self._last = {}
+        self._thresholds = {}
+        self._health = []
+        self._writer = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._keepers)
+
+    def status(self):
+        """The status of this worker, as sent with the heartbeats."""
+
+        keepers = set()
+        for attribute_keepers in self._keepers.values():
+            keepers.update(attribute_keepers)
+        return {"pid": os.getpid(), "worker": os.environ.get("WORKER_ID"),
+                "attributes": len(self._keepers),
+                "subscribers": len(keepers)}
+
+    def change_thresholds(self, device, attribute):
+        """The configured (abs_change, rel_change) of an attribute."""
+
+        return self._thresholds.get((device, attribute), (None, None))
+
+    def subscribe(self, keeper, full_names):
+        """Register a keeper for updates of the given attributes.
+
+        See tangogql.listener.SubscriptionHub.subscribe.
+        """
+
+        self.start()
+        new = []
+        for full_name in full_names:
+            key = split_name(full_name)
+            keepers = self._keepers.get(key)
+            if keepers is None:
+                keepers = self._keepers[key] = set()
+                new.append(full_name)
+            keepers.add(keeper)
+            frame = self._last.get(key)
+            if frame is not None:
+                keeper.put(frame)
+        if new:
+            self._send(("subscribe", new))
+
+    def unsubscribe(self, keeper, full_names=None):
+        """Remove a keeper, releasing the attributes nobody uses any more.
+
+        :param full_names: Only remove the keeper from these attributes,
+                           by default from all of them.
+        :type full_names: list of str
+        """
+
+        keys = None
+        if full_names is not None:
+            keys = set(split_name(full_name) for full_name in full_names)
+        released = []
+        for key, keepers in list(self._keepers.items()):
+            if keys is not None and key not in keys:
+                continue
+            keepers.discard(keeper)
+            if not keepers:
+                del self._keepers[key]
+                self._last.pop(key, None)
+                self._thresholds.pop(key, None)
+                released.append("/".join(key))
+        if released:
+            self._send(("unsubscribe", released))
+
+    async def workers(self, timeout=None):
+        """Ask the broker for the status of all the workers.
+
+        :raises asyncio.TimeoutError: If the broker does not answer.
+        """
+
+        future = asyncio.get_event_loop().create_future()
+        self._health.append(future)
+        self.start()
+        self._send(("health",))
+        return await asyncio.wait_for(future, timeout or self.heartbeat)
+
+    def _send(self, message):
+        # While disconnected, nothing is sent; the subscriptions are
+        # sent again on reconnection
+        if self._writer is not None:
+            write_message(self._writer, message)
+
+    def start(self):
+        """Connect to the broker (done on first use otherwise)."""
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def close(self):
+        """Disconnect from the broker."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path)
+            except OSError as error:
+                logger.debug(f"Cannot connect to the broker: {error!r}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            self.connected = True
+            if self._keepers:
+                self._send(("subscribe", ["/".join(key)
+                                          for key in self._keepers]))
+            heartbeat = asyncio.ensure_future(self._send_heartbeats())
+            try:
+                await self._receive(reader)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                    ConnectionError) as error:
+                logger.warning(f"Lost the connection to the broker: "
+                               f"{error!r}")
+            finally:
+                heartbeat.cancel()
+                self._writer = None
+                self.connected = False
+                writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _send_heartbeats(self):
+        while True:
+            self._send(("heartbeat", self.status()))
+            await asyncio.sleep(self.heartbeat)
+
+    async def _receive(self, reader):
+        while True:
+            message = await asyncio.wait_for(read_message(reader),
+                                             3 * self.heartbeat)
+            kind = message[0]
+            if kind == "frames":
+                _, frames, thresholds = message
+                for frame in frames:
+                    key = (frame["device"], frame["attribute"])
+                    keepers = self._keepers.get(key)
+                    if not keepers:
+                        continue
+                    frame["encoded"] = {}
+                    self._last[key] = frame
+                    self._thresholds[key] = thresholds.get(key,
+                                                           (None, None))
+                    for keeper in list(keepers):
+                        keeper.put(frame)
+            elif kind == "health":
+                waiting, self._health = self._health, []
+                for future in waiting:
+                    if not future.done():
+                        future.set_result(message[1])
+
+
+def main(path=BROKER_SOCKET):
+    """Run a broker until it is terminated."""
+
+    from tangogql.coalescer import ReadCoalescer
+    from tangogql.listener import SubscriptionHub
+    from tangogql.tangodb import DeviceProxyCache
+
+    loop = asyncio.get_event_loop()
+    hub = SubscriptionHub(ReadCoalescer(DeviceProxyCache()))
+    broker = Broker(hub, path)
+    loop.run_until_complete(broker.start())
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(broker.close())
+    loop.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else BROKER_SOCKET)
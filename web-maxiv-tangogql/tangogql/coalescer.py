@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""Coalescing of attribute reads.
+
+When several requests want the same attribute at the same time, only one
+of them should actually read it from the device. The ReadCoalescer keeps
+track of the reads in flight, keyed by (device, attribute), and lets later
+requests wait for them instead of starting their own. Optionally, a read
+that completed less than a given time ago is served again, unless the
+attribute was written since (see ReadCoalescer.invalidate).
+"""
+
+import asyncio
+import os
+
+import PyTango
+
+from tangogql.metrics import Counter, Histogram
+
+__all__ = ['ReadCoalescer']
+
+# Default time (in seconds) a completed read may be served again
+FRESHNESS = float(os.environ.get("READ_FRESHNESS", 0))
+
+READ_SECONDS = Histogram(
+    "tangogql_device_read_seconds",
+    "Duration of the read_attributes calls, by device",
+    labels=("device",))
+READ_ERRORS = Counter(
+    "tangogql_device_read_errors_total",
+    "Failed read_attributes calls, by device",
+    labels=("device",))
+
+
+class ReadCoalescer(object):
+    """Share attribute reads between concurrent requests.
+
+    :param proxies: Where to get the device proxies from.
+    :type proxies: tangogql.tangodb.DeviceProxyCache
+    :param freshness: How long (in seconds) a completed read may be served
+                      to later requests, 0 to only share reads in flight.
+    :type freshness: float
+    :param max_recent: Maximum number of completed reads kept.
+    :type max_recent: int
+    """
+
+    def __init__(self, proxies, freshness=FRESHNESS, max_recent=10000):
+        self.proxies = proxies
+        self.freshness = freshness
+        self.max_recent = max_recent
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = {}
+        self._recent = {}
+
+    def stats(self):
+        """Return the hit/miss counters and the number of reads in flight."""
+
+        return {"hits": self.hits, "misses": self.misses,
+                "in_flight": len(self._in_flight),
+                "recent": len(self._recent)}
+
+    async def read(self, device, names):
+        """Read attributes of a device, sharing the reads of others.
+
+        The attributes that nobody is reading are read with a single
+        read_attributes call.
+
+        :param device: Name of the device.
+        :type device: str
+        :param names: Names of the attributes.
+        :type names: list of str
+
+        :return: The DeviceAttribute of each attribute, or the exception
+                 raised when reading it.
+        :rtype: list
+        """
+
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        futures = []
+        missing = []
+        for name in names:
+            key = (device, name)
+            future = self._in_flight.get(key)
+            if future is None and self.freshness:
+                recent = self._recent.get(key)
+                if recent is not None and now - recent[0] <= self.freshness:
+                    future = recent[1]
+            if future is None:
+                self.misses += 1
+                future = loop.create_future()
+                self._in_flight[key] = future
+                missing.append((name, future))
+            else:
+                self.hits += 1
+            futures.append(future)
+        if missing:
+            asyncio.ensure_future(self._read(device, missing))
+        # Shielded, so that a cancelled requester does not cancel the read
+        # for the others
+        return await asyncio.gather(*(asyncio.shield(future)
+                                      for future in futures),
+                                    return_exceptions=True)
+
+    async def read_attribute(self, device, name):
+        """Read one attribute, raising the exception if the read failed."""
+
+        result, = await self.read(device, [name])
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def invalidate(self, device, name):
+        """Forget the reads of an attribute, e.g. after writing it.
+
+        The next request reads it again, rather than getting a recent read
+        or joining a read that started before the change.
+        """
+
+        key = (device, name)
+        self._recent.pop(key, None)
+        self._in_flight.pop(key, None)
+
+    async def _read(self, device, missing):
+        names = [name for name, _ in missing]
+        try:
+            proxy = await self.proxies.get(device)
+            with READ_SECONDS.labels(device).time():
+                reads = await proxy.read_attributes(names)
+            results = [PyTango.DevFailed(*read.get_err_stack())
+                       if read.has_failed else read for read in reads]
+        except Exception as error:
+            READ_ERRORS.labels(device).inc()
+            results = [error] * len(names)
+        now = asyncio.get_event_loop().time()
+        for (name, future), result in zip(missing, results):
+            key = (device, name)
+            # Unless invalidated meanwhile
+            current = self._in_flight.get(key) is future
+            if current:
+                del self._in_flight[key]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+                # The requesters retrieve it through gather
+                future.exception()
+            else:
+                future.set_result(result)
+                if self.freshness and current:
+                    self._recent[key] = (now, future)
+        if len(self._recent) > self.max_recent:
+            self._prune(now)
+
+    def _prune(self, now):
+        for key, (completed, _) in list(self._recent.items()):
+            if now - completed > self.freshness:
+                del self._recent[key]
+        while len(self._recent) > self.max_recent:
+            del self._recent[next(iter(self._recent))]
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+"""Cost analysis of GraphQL queries, before they are executed.
+
+A small query can fan out to thousands of device accesses, e.g. the values
+of all the attributes of all the devices of all the servers. The cost of a
+query is estimated from its document alone:
+
+- each field costs its weight (1 by default, more for the fields that
+  access the devices, see FIELD_WEIGHTS)
+- the subfields of a list are counted once per expected item: the "first"
+  argument if given, otherwise a typical size for the field (LIST_SIZES)
+
+Queries costing more than MAX_QUERY_COST, or nested deeper than
+MAX_QUERY_DEPTH, are rejected. Queries costing more than HEAVY_QUERY_COST
+are run at most HEAVY_QUERY_CONCURRENCY at a time, so that they can not
+slow down everybody else.
+"""
+
+import asyncio
+import os
+from collections import namedtuple
+
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull
+
+__all__ = ['QueryCost', 'QueryTooExpensive', 'estimate_cost', 'check_cost',
+           'CostLimiter']
+
+# Limits, 0 for none
+MAX_QUERY_COST = float(os.environ.get("MAX_QUERY_COST", 0))
+MAX_QUERY_DEPTH = int(os.environ.get("MAX_QUERY_DEPTH", 0))
+
+# Queries costing more are throttled
+HEAVY_QUERY_COST = float(os.environ.get("HEAVY_QUERY_COST", 10000))
+HEAVY_QUERY_CONCURRENCY = int(os.environ.get("HEAVY_QUERY_CONCURRENCY", 2))
+
+# Cost of the fields that access a device or the database, by field name
+FIELD_WEIGHTS = {
+    "value": 10,
+    "writevalue": 10,
+    "quality": 10,
+    "timestamp": 10,
+    "state": 5,
+    "connected": 5,
+    "attributes": 5,
+    "commands": 5,
+    "server": 5,
+    "readAttributes": 10,
+    "properties": 2,
+    "exported": 2,
+    "deviceClass": 2,
+    "pid": 2,
+    "startedDate": 2,
+    "stoppedDate": 2,
+}
+
+# Expected number of items of the list fields without a "first" argument
+LIST_SIZES = {
+    "devices": 100,
+    "domains": 20,
+    "families": 20,
+    "members": 50,
+    "servers": 100,
+    "instances": 5,
+    "classes": 5,
+    "attributes": 30,
+    "commands": 30,
+    "properties": 20,
+    "userActions": 20,
+}
+DEFAULT_LIST_SIZE = 10
+
+QueryCost = namedtuple("QueryCost", ["cost", "depth"])
+
+
+class QueryTooExpensive(Exception):
+    """The query exceeds the cost or depth limit."""
+
+
+def _unwrap(graphql_type):
+    """Return the named type of a field type, and whether it is a list."""
+
+    is_list = False
+    while isinstance(graphql_type, (GraphQLList, GraphQLNonNull)):
+        if isinstance(graphql_type, GraphQLList):
+            is_list = True
+        graphql_type = graphql_type.of_type
+    return graphql_type, is_list
+
+
+def _argument(field, name, variables):
+    for argument in field.arguments or []:
+        if argument.name.value == name:
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                value = variables.get(value.name.value)
+                # Invalid values are reported when the query is executed
+                return value if type(value) is int else None
+            if isinstance(value, ast.IntValue):
+                return int(value.value)
+    return None
+
+
+def _list_length(field, name, variables):
+    """The length of a list argument, e.g. the attributes to read."""
+
+    for argument in field.arguments or []:
+        if argument.name.value == name:
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                value = variables.get(value.name.value)
+                return len(value) if isinstance(value, list) else None
+            if isinstance(value, ast.ListValue):
+                return len(value.values)
+    return None
+
+
+class _Estimator(object):
+
+    def __init__(self, schema, fragments, variables):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+
+    def selection_set(self, selection_set, parent_type, depth, visited):
+        """Return the cost and depth of a selection set."""
+
+        cost = 0
+        max_depth = depth
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                field_cost, field_depth = self.field(selection, parent_type,
+                                                     depth + 1, visited)
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(
+                        selection.type_condition.name.value)
+                field_cost, field_depth = self.selection_set(
+                    selection.selection_set, fragment_type, depth, visited)
+            else:
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                field_cost, field_depth = self.selection_set(
+                    fragment.selection_set,
+                    self.schema.get_type(fragment.type_condition.name.value),
+                    depth, visited | {name})
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def field(self, field, parent_type, depth, visited):
+        name = field.name.value
+        if name.startswith("__"):
+            # Introspection
+            return 0, depth
+        cost = FIELD_WEIGHTS.get(name, 1)
+        if field.selection_set is None:
+            return cost, depth
+        field_type, is_list = None, False
+        definition = getattr(parent_type, "fields", {}).get(name)
+        if definition is not None:
+            field_type, is_list = _unwrap(definition.type)
+        children, max_depth = self.selection_set(field.selection_set,
+                                                 field_type, depth, visited)
+        if is_list:
+            first = _argument(field, "first", self.variables)
+            if first is None:
+                first = _list_length(field, "fullNames", self.variables)
+            if first is None:
+                first = LIST_SIZES.get(name, DEFAULT_LIST_SIZE)
+            children *= max(first, 0)
+        return cost + children, max_depth
+
+
+def estimate_cost(schema, document, variables=None, operation_name=None):
+    """Estimate the cost of a query, before executing it.
+
+    :param schema: The schema the query is for.
+    :type schema: graphql.GraphQLSchema
+    :param document: The parsed query.
+    :type document: graphql.language.ast.Document
+    :param variables: The variables of the query.
+    :type variables: dict
+    :param operation_name: The operation to execute, if there are several.
+    :type operation_name: str
+
+    :return: The estimated cost and the depth of the query. If it is
+             unclear which operation will be executed, the most expensive
+             one is counted.
+    :rtype: QueryCost
+    """
+
+    fragments = {}
+    operations = []
+    for definition in document.definitions:
+        if isinstance(definition, ast.FragmentDefinition):
+            fragments[definition.name.value] = definition
+        elif isinstance(definition, ast.OperationDefinition):
+            if (operation_name is None or definition.name is None or
+                    definition.name.value == operation_name):
+                operations.append(definition)
+    estimator = _Estimator(schema, fragments, variables or {})
+    result = QueryCost(0, 0)
+    for operation in operations:
+        if operation.operation == "mutation":
+            root_type = schema.get_mutation_type()
+        elif operation.operation == "subscription":
+            root_type = schema.get_subscription_type()
+        else:
+            root_type = schema.get_query_type()
+        cost, depth = estimator.selection_set(operation.selection_set,
+                                              root_type, 0, frozenset())
+        result = QueryCost(max(result.cost, cost), max(result.depth, depth))
+    return result
+
+
+def check_cost(estimate, max_cost=MAX_QUERY_COST, max_depth=MAX_QUERY_DEPTH):
+    """Check a query estimate against the limits.
+
+    :param estimate: The estimate, from estimate_cost.
+    :type estimate: QueryCost
+
+    :raises QueryTooExpensive: If a limit is exceeded.
+    """
+
+    if max_cost and estimate.cost > max_cost:
+        raise QueryTooExpensive(
+            f"Query cost {estimate.cost} exceeds the limit of {max_cost},"
+            " use smaller pages (first) or fewer fields")
+    if max_depth and estimate.depth > max_depth:
+        raise QueryTooExpensive(
+            f"Query depth {estimate.depth} exceeds the limit of {max_depth}")
+
+
+class CostLimiter(object):
+    """Limit how many heavy queries run at the same time.
+
+    :param heavy_cost: Queries costing at least this much are throttled,
+                       0 for none.
+    :type heavy_cost: float
+    :param concurrency: How many heavy queries may run at the same time.
+    :type concurrency: int
+    """
+
+    def __init__(self, heavy_cost=HEAVY_QUERY_COST,
+                 concurrency=HEAVY_QUERY_CONCURRENCY):
+        self.heavy_cost = heavy_cost
+        self.concurrency = concurrency
+        self.waiting = 0
+        self._semaphore = None
+
+    async def run(self, estimate, execute):
+        """Run a query, waiting for its turn if it is heavy.
+
+        :param estimate: The estimate of the query.
+        :type estimate: QueryCost
+        :param execute: Coroutine function executing the query.
+
+        :return: What execute returns.
+        """
+
+        if not self.heavy_cost or estimate.cost < self.heavy_cost:
+            return await execute()
+        if self._semaphore is None:
+            # Created here, to belong to the running event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await execute()
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+"""An in-memory index of the devices in the TANGO database.
+
+Browsing the device tree (domains, families, members, servers...) means
+many small wildcard queries to the database, e.g. one per node expanded in
+a tree view. The DeviceTree instead keeps the whole device table in memory,
+as a domain/family/member tree and a server/instance/class/device tree, and
+answers these queries locally.
+
+The index is refreshed periodically. A cheap summary of the device table is
+checked first, and the table is only fetched again if it changed; only the
+devices that actually changed are then updated in the trees. The summary
+includes a checksum of the names, servers and classes, so that a device
+renamed or moved to another server or class is noticed like an added or
+exported one.
+"""
+
+import asyncio
+import bisect
+import fnmatch
+import logging
+import os
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+import PyTango
+
+__all__ = ['DeviceTree', 'DeviceRow']
+
+# How often (in seconds) the index is refreshed, 0 to not use it at all, and
+# how often it is fully fetched even if the summary did not change
+DEVICE_TREE_REFRESH = float(os.environ.get("DEVICE_TREE_REFRESH", 10))
+DEVICE_TREE_FULL_REFRESH = float(os.environ.get("DEVICE_TREE_FULL_REFRESH",
+                                                300))
+
+DEVICE_QUERY = "SELECT name, server, class, exported FROM device"
+SUMMARY_QUERY = ("SELECT COUNT(*), SUM(exported), MAX(started), MAX(stopped),"
+                 " SUM(CRC32(CONCAT_WS(' ', name, server, class)))"
+                 " FROM device")
+
+WILDCARDS = re.compile(r"[*?\[]")
+
+DeviceRow = namedtuple("DeviceRow", ["name", "server", "class_name",
+                                     "exported"])
+
+logger = logging.getLogger('logger')
+
+
+@lru_cache(maxsize=1024)
+def _compile(pattern):
+    return re.compile(fnmatch.translate(pattern.lower()))
+
+
+class _Node(object):
+    """A node of a tree, with its children by lower case name."""
+
+    __slots__ = ("name", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+
+    def add(self, name):
+        key = name.lower()
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = _Node(name)
+        return child
+
+    def remove(self, path):
+        """Remove the descendant at the path, and the emptied nodes."""
+
+        key = path[0].lower()
+        child = self.children.get(key)
+        if child is None:
+            return
+        if len(path) > 1:
+            child.remove(path[1:])
+        if len(path) == 1 or not child.children:
+            del self.children[key]
+
+    def match(self, pattern):
+        """Return the children matching a (case insensitive) glob pattern."""
+
+        if not WILDCARDS.search(pattern):
+            child = self.children.get(pattern.lower())
+            return [child] if child is not None else []
+        rule = _compile(pattern)
+        return [child for key, child in self.children.items()
+                if rule.match(key)]
+
+    def match_path(self, patterns):
+        """Return the descendants matching a pattern at each level."""
+
+        nodes = [self]
+        for pattern in patterns:
+            nodes = [child for node in nodes for child in node.match(pattern)]
+        return nodes
+
+    def size(self):
+        """Approximate memory size of the node and its descendants."""
+
+        return (sys.getsizeof(self) + sys.getsizeof(self.name) +
+                sys.getsizeof(self.children) +
+                sum(child.size() for child in self.children.values()))
+
+
+def _names(nodes):
+    """The distinct names of nodes, sorted."""
+
+    return sorted({node.name for node in nodes}, key=str.lower)
+
+
+class DeviceTree(object):
+    """In-memory index of the device table.
+
+    Until the first refresh succeeded, ready is False and the callers are
+    expected to ask the database instead.
+
+    :param db: The database to index.
+    :type db: tangogql.tangodb.CachedDatabase
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.ready = False
+        self._devices = {}
+        self._domains = _Node("")
+        self._servers = _Node("")
+        self._summary = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._devices)
+
+    async def refresh(self, full=False):
+        """Update the index from the database.
+
+        :param full: Fetch the device table even if its summary is the same.
+        :type full: bool
+
+        :return: The number of devices added, removed and changed.
+        :rtype: tuple
+
+        :raises PyTango.DevFailed: If the database can not be queried.
+        """
+
+        summary = await self.db.select(SUMMARY_QUERY)
+        if self.ready and not full and summary == self._summary:
+            return 0, 0, 0
+        rows = await self.db.select(DEVICE_QUERY)
+        changes = self.update(DeviceRow(name, server, class_name,
+                                        exported == "1")
+                              for name, server, class_name, exported in rows)
+        self._summary = summary
+        self.ready = True
+        return changes
+
+    def update(self, rows):
+        """Replace the indexed devices, only touching the changed ones.
+
+        :param rows: All the devices.
+        :type rows: iterable of DeviceRow
+
+        :return: The number of devices added, removed and changed.
+        :rtype: tuple
+        """
+
+        devices = {row.name.lower(): row for row in rows
+                   if row.name.count("/") == 2}
+        added = removed = changed = 0
+        for key in set(self._devices) - set(devices):
+            self._remove(self._devices.pop(key))
+            removed += 1
+        for key, row in devices.items():
+            old = self._devices.get(key)
+            if old == row:
+                continue
+            if old is None:
+                added += 1
+            else:
+                self._remove(old)
+                changed += 1
+            self._add(row)
+            self._devices[key] = row
+        if added or removed:
+            self._sorted = None
+        return added, removed, changed
+
+    def _add(self, row):
+        domain, family, member = row.name.split("/")
+        self._domains.add(domain).add(family).add(member)
+        server, _, instance = row.server.partition("/")
+        (self._servers.add(server).add(instance).add(row.class_name)
+         .add(row.name))
+
+    def _remove(self, row):
+        self._domains.remove(row.name.split("/"))
+        server, _, instance = row.server.partition("/")
+        self._servers.remove([server, instance, row.class_name, row.name])
+
+    def domains(self, pattern="*"):
+        """Names of the domains matching a pattern."""
+
+        return _names(self._domains.match(pattern))
+
+    def families(self, domain="*", pattern="*"):
+        """Names of the families matching a pattern, in matching domains."""
+
+        return _names(self._domains.match_path([domain, pattern]))
+
+    def members(self, domain="*", family="*", pattern="*"):
+        """Names of the members matching a pattern, in matching families."""
+
+        return _names(self._domains.match_path([domain, family, pattern]))
+
+    def devices(self, pattern="*", exported=None):
+        """Full names of the devices matching a pattern.
+
+        The literal beginning of the pattern, if any, is looked up in a
+        sorted list of the names, so only the devices sharing that prefix
+        are matched against the whole pattern.
+
+        :param pattern: Glob pattern, where * also matches slashes.
+        :type pattern: str
+        :param exported: Only the exported (or not exported) devices.
+        :type exported: bool
+        """
+
+        if self._sorted is None:
+            self._sorted = sorted(self._devices)
+        prefix = WILDCARDS.split(pattern.lower(), 1)[0]
+        start = bisect.bisect_left(self._sorted, prefix)
+        rule = _compile(pattern)
+        names = []
+        for key in self._sorted[start:]:
+            if not key.startswith(prefix):
+                break
+            row = self._devices[key]
+            if rule.match(key) and (exported is None or
+                                    row.exported == exported):
+                names.append(row.name)
+        return names
+
+    def servers(self, pattern="*"):
+        """Names of the servers (executables) matching a pattern."""
+
+        return _names(self._servers.match(pattern))
+
+    def instances(self, server, pattern="*"):
+        """Names of the instances of a server matching a pattern."""
+
+        return _names(self._servers.match_path([server, pattern]))
+
+    def classes(self, server, instance, pattern="*"):
+        """The classes of a server instance matching a pattern.
+
+        :return: The name of each class and the names of its devices.
+        :rtype: list of (str, list of str)
+        """
+
+        return [(node.name, sorted(child.name
+                                   for child in node.children.values()))
+                for node in self._servers.match_path([server, instance,
+                                                      pattern])]
+
+    def footprint(self):
+        """Report the size of the index.
+
+        :return: The number of devices, domains and servers, and the
+                 approximate memory used, in bytes.
+        :rtype: dict
+        """
+
+        size = sys.getsizeof(self._devices) + sum(
+            sys.getsizeof(key) + sys.getsizeof(row) +
+            sum(sys.getsizeof(value) for value in row)
+            for key, row in self._devices.items())
+        size += self._domains.size() + self._servers.size()
+        if self._sorted is not None:
+            size += sys.getsizeof(self._sorted)
+        return {"devices": len(self._devices),
+                "domains": len(self._domains.children),
+                "servers": len(self._servers.children),
+                "bytes": size}
+
+    async def watch(self, period=DEVICE_TREE_REFRESH,
+                    full_period=DEVICE_TREE_FULL_REFRESH):
+        """Refresh the index periodically, forever.
+
+        If the database does not allow the queries, the index is given up
+        and stays not ready.
+
+        :param period: Seconds between refreshes.
+        :type period: float
+        :param full_period: Seconds between full refreshes.
+        :type full_period: float
+        """
+
+        loop = asyncio.get_event_loop()
+        last_full = None
+        while True:
+            full = last_full is None or loop.time() - last_full >= full_period
+            try:
+                added, removed, changed = await self.refresh(full)
+            except PyTango.DevFailed as error:
+                if not self.ready:
+                    logger.warning("Device tree index disabled, the"
+                                   f" database can not be queried: {error}")
+                    return
+                logger.warning(f"Could not refresh the device tree: {error}")
+            except Exception as error:
+                logger.warning(f"Could not refresh the device tree: {error}")
+            else:
+                if full:
+                    last_full = loop.time()
+                    logger.debug(f"Device tree index: {self.footprint()}")
+                if added or removed or changed:
+                    logger.debug(f"Device tree: {added} devices added,"
+                                 f" {removed} removed, {changed} changed")
+            await asyncio.sleep(period)
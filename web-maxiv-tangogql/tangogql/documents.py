@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""Cache of parsed and validated GraphQL documents.
+
+Clients like webjive send the same few queries over and over. Parsing and
+validating them against the schema every time is wasted work, so the
+documents are kept, by the SHA-256 hash of the query text, in a bounded
+LRU cache.
+
+The same cache serves automatic persisted queries (as done by Apollo):
+a client may send only the hash of a query, in
+
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "..."}}}
+
+If the hash is unknown, the PersistedQueryNotFound error asks the client to
+send the query again along with its hash, and it is then remembered.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
+
+from graphql import parse, validate
+from graphql.language.printer import print_ast
+from graphql.error import GraphQLError
+
+__all__ = ['Document', 'DocumentCache', 'PersistedQueryNotFound',
+           'PersistedQueryMismatch', 'query_hash']
+
+# Maximum number of documents kept
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1000))
+
+# The parsed query, its validation errors, and the hash of the query as
+# normalized by the parser (without comments, extra whitespace...)
+Document = namedtuple("Document", ["ast", "errors", "key"])
+
+
+class PersistedQueryNotFound(Exception):
+    """The client sent the hash of a query that is not known (anymore)."""
+
+    code = "PERSISTED_QUERY_NOT_FOUND"
+
+    def __init__(self):
+        super().__init__("PersistedQueryNotFound")
+
+
+class PersistedQueryMismatch(Exception):
+    """The client sent a query along with the hash of another one."""
+
+    code = "PERSISTED_QUERY_HASH_MISMATCH"
+
+    def __init__(self):
+        super().__init__("provided sha does not match query")
+
+
+def query_hash(query):
+    """Return the hexadecimal SHA-256 hash of a query."""
+
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class DocumentCache(object):
+    """Parse and validate queries, remembering the results.
+
+    :param schema: The schema the queries are validated against.
+    :type schema: graphql.GraphQLSchema
+    :param max_documents: Maximum number of documents kept.
+    :type max_documents: int
+    """
+
+    def __init__(self, schema, max_documents=QUERY_CACHE_SIZE):
+        self.schema = schema
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get(self, query=None, sha256=None):
+        """Return the document of a query, given by its text or its hash.
+
+        Invalid queries are cached too, with their errors.
+
+        :param query: The query text.
+        :type query: str
+        :param sha256: The hash of the query, for persisted queries.
+        :type sha256: str
+
+        :raises PersistedQueryNotFound: If only the hash is given, and it is
+                                        unknown.
+        :raises PersistedQueryMismatch: If the hash is not the one of the
+                                        query.
+        :rtype: Document
+        """
+
+        if query is None and sha256 is None:
+            return Document(None, [GraphQLError("Must provide a query")],
+                            None)
+        if query is not None and not isinstance(query, str):
+            return Document(None,
+                            [GraphQLError("The query must be a string")],
+                            None)
+        if sha256 is not None and not isinstance(sha256, str):
+            return Document(None,
+                            [GraphQLError("The hash must be a string")],
+                            None)
+        if query is None:
+            key = sha256.lower()
+        else:
+            key = query_hash(query)
+            if sha256 is not None and sha256.lower() != key:
+                raise PersistedQueryMismatch()
+        document = self._documents.get(key)
+        if document is not None:
+            self.hits += 1
+            self._documents.move_to_end(key)
+            return document
+        if query is None:
+            raise PersistedQueryNotFound()
+        self.misses += 1
+        document = self._parse(query)
+        self._documents[key] = document
+        if len(self._documents) > self.max_documents:
+            self._documents.popitem(last=False)
+        return document
+
+    def _parse(self, query):
+        try:
+            ast = parse(query)
+        except GraphQLError as error:
+            return Document(None, [error], None)
+        return Document(ast, validate(self.schema, ast),
+                        query_hash(print_ast(ast)))
@@ -1,12 +1,55 @@
 #!/usr/bin/env python3
 
-from asyncio import QueueFull
+"""Shared attribute listeners for the GraphQL subscriptions.
+
+Every attribute that has at least one subscriber gets exactly one upstream
+source, no matter how many websocket clients are interested in it. The
+source is a TANGO change (or periodic) event subscription when the device
+supports it, otherwise the attribute is polled. Updates are fanned out to
+the "keepers" of all the subscribers, and the upstream source is torn down
+when the last subscriber leaves.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from functools import partial
+
 import numpy as np
-from taurus import Attribute
-from taurus.core.taurusbasetypes import TaurusEventType
 import PyTango
 
-# Manager().changeDefaultPollingPeriod(1000)
+from tangogql.arrays import format_array, reduce_array
+
+logger = logging.getLogger('logger')
+
+__all__ = ['Keeper', 'ChangeFilter', 'AttributeListener', 'SubscriptionHub',
+           'SubscriptionOverflow']
+
+# Polling period (in seconds) used for attributes without events
+POLL_PERIOD = 3.0
+
+# Maximum time (in seconds) a device may take to answer a polling read
+READ_TIMEOUT = 2.0
+
+# Default period (in seconds) after which an unchanged value is resent to
+# subscribers that only want changes
+KEEP_ALIVE = 10.0
+
+# Flow control towards each subscriber: the maximum number of pending
+# frames, what to do when there are more ("drop_oldest", "conflate" to the
+# latest value per attribute or "disconnect") and the maximum number of
+# frames per second (0 for no limit)
+QUEUE_SIZE = int(os.environ.get("SUBSCRIPTION_QUEUE_SIZE", 1000))
+OVERFLOW_POLICY = os.environ.get("SUBSCRIPTION_OVERFLOW_POLICY", "conflate")
+MAX_RATE = float(os.environ.get("SUBSCRIPTION_MAX_RATE", 0))
+
+OVERFLOW_POLICIES = ("drop_oldest", "conflate", "disconnect")
+
+# Event types to try, in order, before falling back to polling
+EVENT_TYPES = (PyTango.EventType.CHANGE_EVENT,
+               PyTango.EventType.PERIODIC_EVENT)
 
 
 def error_str(err):
@@ -17,80 +60,635 @@ def error_str(err):
     return str(err)
 
 
-def format_value(value, attr_type):
-    if attr_type is PyTango.ArgType.DevState:
-        return str(value)
-    if isinstance(value, np.ndarray):
-        # return value.tobytes()  # TODO: is this a copy..?
-        return value.tolist()
-    return value
+def format_frame(device, attribute, read):
+    """Turn a read (or event) DeviceAttribute into a subscription frame.
 
+    :param device: Name of the device.
+    :type device: str
+    :param attribute: Name of the attribute.
+    :type attribute: str
+    :param read: The value as returned by TANGO.
+    :type read: PyTango.DeviceAttribute
+
+    :return: The frame. SPECTRUM and IMAGE values are kept as NumPy arrays
+             until they are encoded with encode_frame.
+    :rtype: dict
+    """
 
-def format_value_event(evt):
     return {
-        "value": format_value(evt.value, evt.type),
-        "w_value": format_value(evt.w_value, evt.type),
-        "quality": str(evt.quality),
-        "time": evt.time.totime()
+        "device": device,
+        "attribute": attribute,
+        "value": read.value,
+        "write_value": read.w_value,
+        "quality": read.quality.name,
+        "timestamp": read.time.tv_sec + read.time.tv_usec * 1e-6,
+        "error": None,
+        "encoded": {},
     }
 
 
-def format_config_event(evt):
+def error_frame(device, attribute, error):
+    """A subscription frame telling that an attribute could not be read.
+
+    :param error: The error, e.g. from an error event or a failed read.
+    :type error: Exception
+
+    :return: The frame, without value and with an INVALID quality.
+    :rtype: dict
+    """
+
     return {
-        'description': evt.description,
-        'label': evt.label,
-        'unit': evt.unit if evt.unit != "No unit" else None,
-        'format': evt.format if evt.format != "Not specified" else None,
-        'data_format': str(evt.data_format),
-        'data_type': str(PyTango.CmdArgType.values[evt.data_type])
-        # ...
+        "device": device,
+        "attribute": attribute,
+        "value": None,
+        "write_value": None,
+        "quality": PyTango.AttrQuality.ATTR_INVALID.name,
+        "timestamp": time.time(),
+        "error": error_str(error),
+        "encoded": {},
     }
 
 
-# Based on code from the taurus-web project
-class TaurusWebAttribute(object):
+def encode_frame(frame, encoding="json", roi=None, stride=None,
+                 max_points=None):
+    """Return a frame with its values reduced and encoded for a subscriber.
+
+    Frames are shared by all the subscribers of an attribute, so this is
+    only computed once per frame for each combination of arguments.
+
+    :param frame: The frame, as created by format_frame.
+    :type frame: dict
+    :param encoding: One of tangogql.arrays.ENCODINGS.
+    :type encoding: str
+
+    See tangogql.arrays.reduce_array for the other arguments. A value they
+    do not apply to (e.g. a ROI for an IMAGE given with a SPECTRUM) gives
+    an error frame, as for a failed read, rather than an exception: the
+    other attributes of the subscription go on.
+
+    :return: Keyword arguments for an AttributeFrame.
+    :rtype: dict
+    """
+
+    key = (encoding, tuple(roi or ()), stride, max_points)
+    encoded = frame["encoded"].get(key)
+    if encoded is None:
+        encoded = {name: value for name, value in frame.items()
+                   if name != "encoded"}
+        try:
+            for name in ("value", "write_value"):
+                value = reduce_array(frame[name], roi, stride, max_points)
+                encoded[name] = format_array(value, encoding)
+        except ValueError as error:
+            encoded = error_frame(frame["device"], frame["attribute"], error)
+            del encoded["encoded"]
+            encoded["timestamp"] = frame["timestamp"]
+        frame["encoded"][key] = encoded
+    return encoded
+
+
+def parse_change(config):
+    """Parse a TANGO abs_change/rel_change setting.
+
+    The setting is either one threshold or a "decrease,increase" pair.
+
+    :return: The (decrease, increase) thresholds, None if not specified.
+    :rtype: tuple of float
+    """
+
+    try:
+        thresholds = [abs(float(part)) for part in config.split(",")]
+    except (AttributeError, ValueError):
+        return None
+    if len(thresholds) == 1:
+        return thresholds[0], thresholds[0]
+    return thresholds[0], thresholds[1]
+
 
-    def __init__(self, name, keeper):
-        self.name = name
-        self.keepers = [keeper]
-        self._last_time = 0
-        self.last_value_event = None
-        self.last_config_event = None
-        self.attribute = Attribute(self.name)
-        self.attribute.addListener(self)
+def _same(a, b):
+    try:
+        return bool(a == b)
+    except ValueError:
+        # Comparing arrays element-wise
+        return np.array_equal(a, b)
 
-    def eventReceived(self, evt_src, evt_type, evt_value):
 
-        # print(evt_value)
+def split_name(full_name):
+    """Split a full attribute name into its device and attribute names."""
 
-        if evt_type == TaurusEventType.Error:
-            action = "ERROR"
-            value = error_str(evt_value)
+    *parts, attribute = full_name.split("/")
+    return "/".join(parts), attribute
+
+
+class SubscriptionOverflow(Exception):
+    """Raised to a subscriber that could not keep up with its frames."""
+
+
+class Keeper(object):
+    """The mailbox of one subscriber, fed by the attribute listeners.
+
+    Putting a frame never blocks, so a slow subscriber cannot hold up the
+    fan-out to the others. At most maxsize frames are kept; on overflow the
+    policy either drops the oldest frame, conflates frames to the latest
+    one per attribute (dropping the oldest attribute when that is not
+    enough) or disconnects the subscriber (get_batch raises
+    SubscriptionOverflow, upon which the subscription closes the websocket
+    of the client, see tangogql.schema.subscription). Frames are handed
+    out at no more
+    than max_rate per second, the others wait (and conflate) meanwhile.
+
+    :param on_drop: Called with the number of frames, whenever frames are
+                    dropped or conflated away (e.g. to count them in a
+                    metric).
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy=OVERFLOW_POLICY,
+                 max_rate=MAX_RATE, on_drop=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_rate = max_rate
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.overflowed = False
+        if policy == "conflate":
+            self._frames = OrderedDict()
         else:
-            if evt_type == TaurusEventType.Config:
-                action = "CONFIG"
-                value = format_config_event(evt_src)
-                self.last_config_event = value
+            self._frames = deque()
+        self._ready = asyncio.Event()
+        self._tokens = max(1, max_rate)
+        self._refilled = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        if self.overflowed:
+            return
+        full = self.maxsize and len(self._frames) >= self.maxsize
+        if self.policy == "conflate":
+            key = (frame["device"], frame["attribute"])
+            if key in self._frames:
+                # The pending frame of the attribute is replaced
+                self._drop()
+            elif full:
+                self._frames.popitem(last=False)
+                self._drop()
+            self._frames[key] = frame
+        elif full and self.policy == "disconnect":
+            self.overflowed = True
+            self._drop(len(self._frames) + 1)
+            self._frames.clear()
+        else:
+            if full:
+                self._frames.popleft()
+                self._drop()
+            self._frames.append(frame)
+        self._ready.set()
+
+    def _drop(self, count=1):
+        self.dropped += count
+        if self.on_drop is not None:
+            self.on_drop(count)
+
+    async def get(self):
+        frames = []
+        while not frames:
+            frames = await self.get_batch(max_frames=1)
+        return frames[0]
+
+    async def get_batch(self, timeout=None, max_frames=None):
+        """Wait for a frame, then return it with all the pending ones.
+
+        :param timeout: Seconds to wait, an empty list is returned when
+                        nothing arrived in time.
+        :type timeout: float
+        :param max_frames: Maximum number of frames to return.
+        :type max_frames: int
+
+        :raises SubscriptionOverflow: If the subscriber is disconnected.
+        """
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        if self.overflowed:
+            raise SubscriptionOverflow(
+                f"More than {self.maxsize} frames pending, disconnected")
+        count = await self._throttle()
+        if max_frames is not None:
+            count = min(count, max_frames)
+        frames = []
+        while self._frames and len(frames) < count:
+            if self.policy == "conflate":
+                frames.append(self._frames.popitem(last=False)[1])
             else:
-                self._last_time = evt_value.time.tv_sec
-                action = "CHANGE"
-                value = format_value_event(evt_value)
-                self.last_value_event = value
+                frames.append(self._frames.popleft())
+        if self.max_rate:
+            self._tokens -= len(frames)
+        if not self._frames:
+            self._ready.clear()
+        return frames
+
+    async def _throttle(self):
+        """Wait for the rate limit, return how many frames may be sent."""
+
+        if not self.max_rate:
+            return len(self._frames)
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if self._refilled is not None:
+            self._tokens = min(max(1, self.max_rate), self._tokens +
+                               (now - self._refilled) * self.max_rate)
+        self._refilled = now
+        if self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.max_rate)
+            self._tokens = 1
+            self._refilled = loop.time()
+        return int(self._tokens)
+
+
+class ChangeFilter(object):
+    """Suppress the frames of one subscriber that carry no real change.
+
+    A frame is passed on if its quality, error or write value changed, or if
+    its value moved past the change thresholds. The thresholds given here
+    apply to all attributes, otherwise the abs_change/rel_change of the TANGO
+    change event configuration are used, and without those any change
+    counts. The latest value of every attribute is resent after keep_alive
+    seconds without frames.
+    """
+
+    def __init__(self, hub, abs_change=None, rel_change=None,
+                 keep_alive=KEEP_ALIVE):
+        self.hub = hub
+        self.abs_change = None if abs_change is None \
+            else (abs(abs_change), abs(abs_change))
+        self.rel_change = None if rel_change is None \
+            else (abs(rel_change), abs(rel_change))
+        self.keep_alive = keep_alive
+        self._sent = {}
+        self._latest = {}
+
+    def filter(self, frames, now):
+        """Return the frames that should be sent."""
+
+        result = []
+        for frame in frames:
+            key = (frame["device"], frame["attribute"])
+            self._latest[key] = frame
+            sent = self._sent.get(key)
+            if sent is None or self._changed(key, sent[0], frame):
+                self._sent[key] = (frame, now)
+                result.append(frame)
+        return result
+
+    def timeout(self, now):
+        """Seconds until the next keep-alive is due, None if never."""
 
-        # self.callback(self.name, {"type": action, "data": {self.name: value}})
-        # event = {"type": action, "data": value}
+        if not self.keep_alive or not self._sent:
+            return None
+        oldest = min(sent for _, sent in self._sent.values())
+        return max(0, oldest + self.keep_alive - now)
+
+    def keep_alives(self, now):
+        """Return the latest frames of the attributes due for keep-alive."""
+
+        if not self.keep_alive:
+            return []
+        result = []
+        for key, (_, sent) in self._sent.items():
+            if now - sent >= self.keep_alive:
+                frame = self._latest[key]
+                self._sent[key] = (frame, now)
+                result.append(frame)
+        return result
+
+    def _changed(self, key, old, new):
+        if old["quality"] != new["quality"]:
+            return True
+        if old.get("error") != new.get("error"):
+            return True
+        if not _same(old["write_value"], new["write_value"]):
+            return True
+        abs_change, rel_change = self.abs_change, self.rel_change
+        if abs_change is None and rel_change is None:
+            abs_change, rel_change = self.hub.change_thresholds(*key)
+        if abs_change is None and rel_change is None:
+            return not _same(old["value"], new["value"])
+        try:
+            delta = np.asarray(new["value"], dtype=float) \
+                - np.asarray(old["value"], dtype=float)
+        except (TypeError, ValueError):
+            # Not numerical, or the shape changed
+            return not _same(old["value"], new["value"])
+        if abs_change is not None:
+            if np.any(delta <= -abs_change[0]) or \
+               np.any(delta >= abs_change[1]):
+                return True
+        if rel_change is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                percent = 100 * delta / np.abs(
+                    np.asarray(old["value"], dtype=float))
+            percent = np.where(delta == 0, 0, percent)
+            if np.any(percent <= -rel_change[0]) or \
+               np.any(percent >= rel_change[1]):
+                return True
+        return False
+
+
+class AttributeListener(object):
+    """The single upstream source of one attribute.
+
+    The listener subscribes to TANGO events for the attribute, or polls it if
+    that is not possible, and forwards every update to its keepers.
+    """
+
+    def __init__(self, hub, device, attribute):
+        self.hub = hub
+        self.device = device
+        self.attribute = attribute
+        self.keepers = set()
+        self.last_frame = None
+        self.abs_change = None
+        self.rel_change = None
+        self._loop = None
+        self._closed = False
+        self._event_proxy = None
+        self._event_id = None
+        self._task = None
+        self._polling = False
+
+    @property
+    def full_name(self):
+        return f"{self.device}/{self.attribute}"
+
+    @property
+    def mode(self):
+        """How the attribute is followed: 'events', 'polling' or None."""
+
+        if self._event_id is not None:
+            return "events"
+        if self._polling:
+            return "polling"
+        return None
+
+    def add_keeper(self, keeper):
+        self.keepers.add(keeper)
+        if self.last_frame is not None:
+            # Let late subscribers start with the current value
+            keeper.put(self.last_frame)
+
+    def remove_keeper(self, keeper):
+        self.keepers.discard(keeper)
+
+    def dispatch(self, frame):
+        self.last_frame = frame
+        for keeper in list(self.keepers):
+            keeper.put(frame)
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        # An ongoing event subscription is not cancelled, _subscribe
+        # cleans up after itself once it notices we are closed
+        self._closed = True
+        if self._polling:
+            self._polling = False
+            self.hub.remove_polled(self)
+        if self._event_id is not None:
+            proxy, event_id = self._event_proxy, self._event_id
+            self._event_id = None
+            self._loop.run_in_executor(None, self._unsubscribe, proxy,
+                                       event_id)
+
+    async def _run(self):
+        if not await self._subscribe() and not self._closed:
+            self._polling = True
+            self.hub.add_polled(self)
+
+    async def _subscribe(self):
+        """Try to subscribe to events, return True on success."""
+
+        loop = self._loop
+        try:
+            proxy = await self.hub.event_proxy(self.device)
+        except PyTango.DevFailed:
+            return False
+        try:
+            config = await loop.run_in_executor(
+                None, proxy.get_attribute_config, self.attribute)
+            change = config.events.ch_event
+            self.abs_change = parse_change(change.abs_change)
+            self.rel_change = parse_change(change.rel_change)
+        except PyTango.DevFailed:
+            pass
+        for event_type in EVENT_TYPES:
+            try:
+                event_id = await loop.run_in_executor(
+                    None, self._subscribe_event, proxy, event_type)
+            except PyTango.DevFailed:
+                continue
+            if self._closed:
+                # Everybody left while we were subscribing
+                loop.run_in_executor(None, self._unsubscribe, proxy, event_id)
+            else:
+                self._event_proxy = proxy
+                self._event_id = event_id
+                logger.debug(f"Listening to {event_type} events on "
+                             f"{self.full_name}")
+            return True
+        return False
+
+    def _subscribe_event(self, proxy, event_type):
+        return proxy.subscribe_event(self.attribute, event_type,
+                                     self._push_event)
+
+    @staticmethod
+    def _unsubscribe(proxy, event_id):
+        try:
+            proxy.unsubscribe_event(event_id)
+        except PyTango.DevFailed as error:
+            logger.debug(f"Failed to unsubscribe event: {error_str(error)}")
+
+    def _push_event(self, event):
+        # Called from a TANGO thread, hand the event over to the loop
+        if not self._closed:
+            self._loop.call_soon_threadsafe(self._handle_event, event)
+
+    def _handle_event(self, event):
+        if self._closed:
+            return
+        if event.err:
+            # E.g. the device is down, rather than silence
+            errors = getattr(event, "errors", None) or ()
+            self.dispatch(error_frame(self.device, self.attribute,
+                                      PyTango.DevFailed(*errors)))
+        elif event.attr_value is not None:
+            self.dispatch(format_frame(self.device, self.attribute,
+                                       event.attr_value))
+
+
+class SubscriptionHub(object):
+    """Process wide registry of the attribute listeners.
+
+    Upstream load scales with the number of distinct attributes subscribed
+    to, not with the number of connected clients.
+
+    Attributes without events are polled in cycles: every cycle issues one
+    read_attributes call per device, all devices concurrently and each with
+    its own timeout, so a cycle takes about as long as the slowest device.
+    All the frames of a cycle are dispatched together.
+
+    Attributes that can not be read (error events, failed or timed out
+    polling reads) get frames with the error, see error_frame.
+
+    :param proxy_factory: Creates the (synchronous) proxy of a device name,
+                          used for the event subscriptions. One proxy is
+                          kept per device, as long as it has listeners.
+    """
+
+    def __init__(self, reads, poll_period=POLL_PERIOD,
+                 read_timeout=READ_TIMEOUT, proxy_factory=None):
+        self.reads = reads
+        self.proxy_factory = proxy_factory or partial(
+            PyTango.DeviceProxy, green_mode=PyTango.GreenMode.Synchronous)
+        self.poll_period = poll_period
+        self.read_timeout = read_timeout
+        self._listeners = {}
+        self._device_listeners = Counter()
+        self._event_proxies = {}
+        self._polled = {}
+        self._poll_task = None
+
+    def __len__(self):
+        return len(self._listeners)
+
+    def change_thresholds(self, device, attribute):
+        """The configured (abs_change, rel_change) of an attribute."""
+
+        listener = self._listeners.get((device, attribute))
+        if listener is None:
+            return None, None
+        return listener.abs_change, listener.rel_change
+
+    async def event_proxy(self, device):
+        """The proxy used for the event subscriptions of a device.
+
+        :raises PyTango.DevFailed: If the proxy can not be created.
+        """
+
+        future = self._event_proxies.get(device)
+        if future is None:
+            # Creating a proxy is a blocking call, keep it off the event loop
+            future = asyncio.get_event_loop().run_in_executor(
+                None, self.proxy_factory, device)
+            self._event_proxies[device] = future
         try:
-            for keeper in self.keepers:
-                keeper.put(self.name, action, value)
-        except QueueFull:
-            print("Queue full!")
-        # print(event)
+            # Shared by the listeners of the device
+            return await asyncio.shield(future)
+        except PyTango.DevFailed:
+            if self._event_proxies.get(device) is future:
+                # Try again with the next listener
+                del self._event_proxies[device]
+            raise
+
+    def subscribe(self, keeper, full_names):
+        """Register a keeper for updates of the given attributes.
+
+        :param keeper: The mailbox of the subscriber.
+        :type keeper: Keeper
+        :param full_names: Full names (device/attribute) of the attributes.
+        :type full_names: list of str
+        """
+
+        for full_name in full_names:
+            key = split_name(full_name)
+            listener = self._listeners.get(key)
+            if listener is None:
+                listener = AttributeListener(self, *key)
+                self._listeners[key] = listener
+                self._device_listeners[key[0]] += 1
+                listener.start()
+            listener.add_keeper(keeper)
+
+    def unsubscribe(self, keeper, full_names=None):
+        """Remove a keeper, stopping the listeners nobody uses any more.
+
+        :param full_names: Only remove the keeper from these attributes,
+                           by default from all of them.
+        :type full_names: list of str
+        """
+
+        keys = None
+        if full_names is not None:
+            keys = set(split_name(full_name) for full_name in full_names)
+        for key, listener in list(self._listeners.items()):
+            if keys is not None and key not in keys:
+                continue
+            listener.remove_keeper(keeper)
+            if not listener.keepers:
+                del self._listeners[key]
+                listener.stop()
+                self._device_listeners[key[0]] -= 1
+                if not self._device_listeners[key[0]]:
+                    del self._device_listeners[key[0]]
+                    self._event_proxies.pop(key[0], None)
 
-    def addKeeper(self,keeper):
-        self.keepers.append(keeper)
+    def add_polled(self, listener):
+        """Include a listener in the polling cycles."""
 
-    def removeKeeper(self,keeper):
-        self.keepers.remove(keeper)
+        attributes = self._polled.setdefault(listener.device, {})
+        attributes[listener.attribute] = listener
+        if self._poll_task is None:
+            self._poll_task = asyncio.ensure_future(self._poll())
 
-    def clear(self):
-        self.attribute.removeListener(self)
+    def remove_polled(self, listener):
+        attributes = self._polled.get(listener.device, {})
+        if attributes.get(listener.attribute) is listener:
+            del attributes[listener.attribute]
+        if not attributes:
+            self._polled.pop(listener.device, None)
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while self._polled:
+                started = loop.time()
+                await self.poll_once()
+                elapsed = loop.time() - started
+                await asyncio.sleep(max(0, self.poll_period - elapsed))
+        finally:
+            self._poll_task = None
+
+    async def poll_once(self):
+        """Run one polling cycle over all the polled devices."""
+
+        devices = [(device, list(attributes.items()))
+                   for device, attributes in self._polled.items()]
+        results = await asyncio.gather(*(
+            self._read_device(device, [name for name, _ in attributes])
+            for device, attributes in devices))
+        for (device, attributes), reads in zip(devices, results):
+            for (name, listener), read in zip(attributes, reads):
+                if listener.mode != "polling":
+                    continue
+                if isinstance(read, Exception):
+                    listener.dispatch(error_frame(device, name, read))
+                else:
+                    listener.dispatch(format_frame(device, name, read))
+
+    async def _read_device(self, device, names):
+        try:
+            # Through the coalescer, sharing reads with the other requests
+            return await asyncio.wait_for(self.reads.read(device, names),
+                                          self.read_timeout)
+        except asyncio.TimeoutError:
+            logger.debug(f"Polling {device} timed out")
+            error = asyncio.TimeoutError(
+                f"{device} did not answer within {self.read_timeout} s")
+            return [error] * len(names)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+"""Metrics, served on /metrics in the Prometheus text format.
+
+The metrics are kept in plain Python objects, and cost about a dictionary
+lookup and an addition when they are updated. Counts that the components
+already keep (e.g. the cache hits) are read only when the metrics are
+scraped, with callback metrics.
+
+Labeled metrics keep at most METRICS_MAX_SERIES series each (e.g. one per
+device), the label values seen after that are counted together under
+"_other", so that a big control system does not make the metrics explode.
+"""
+
+import asyncio
+import inspect
+import os
+import time
+from bisect import bisect_left
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'CallbackMetric', 'Registry',
+           'registry', 'ResolverMetricsMiddleware', 'monitor_loop_lag']
+
+# Maximum number of label combinations per metric
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 1000))
+
+# Period (in seconds) of the event loop lag measurements
+LOOP_LAG_PERIOD = float(os.environ.get("LOOP_LAG_PERIOD", 1))
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The label values used when a metric has too many series
+OTHER = "_other"
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"'
+             for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Registry(object):
+    """The collection of metrics served together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        if any(other.name == metric.name for other in self._metrics):
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics.append(metric)
+
+    def get(self, name):
+        """Return a registered metric by its name, None if unknown."""
+
+        for metric in self._metrics:
+            if metric.name == name:
+                return metric
+        return None
+
+    def render(self):
+        """Return all the metrics in the Prometheus text format.
+
+        :rtype: str
+        """
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=registry,
+                 max_series=METRICS_MAX_SERIES):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.max_series = max_series
+        self._children = {}
+        if not self.label_names:
+            self._unlabeled = self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Return the series with these label values."""
+
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels "
+                                 f"{self.label_names}")
+            if len(self._children) >= self.max_series:
+                values = (OTHER,) * len(values)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.label_names, values)} "
+                f"{_format_value(child.value)}"
+                for values, child in sorted(self._children.items())]
+
+
+class _Value(object):
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """A count that only goes up, e.g. of requests."""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._unlabeled.inc(amount)
+
+    @property
+    def value(self):
+        return self._unlabeled.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. a number of connections."""
+
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._unlabeled.inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabeled.dec(amount)
+
+    def set(self, value):
+        self._unlabeled.set(value)
+
+
+class _Timer(object):
+
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class _Buckets(object):
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last one counts the values above all the bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Observe the duration of a with block."""
+
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    """The distribution of values, e.g. of durations in seconds."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS,
+                 **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, **kwargs)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self._unlabeled.observe(value)
+
+    def time(self):
+        return self._unlabeled.time()
+
+    def render(self):
+        lines = []
+        for values, child in sorted(self._children.items()):
+            total = 0
+            bounds = self.buckets + (float("inf"),)
+            for bound, count in zip(bounds, child.counts):
+                total += count
+                labels = _format_labels(self.label_names, values,
+                                        [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} "
+                         f"{_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A metric whose values are read from a function when scraped.
+
+    :param function: Returns the value, or with labels a dict of the values
+                     by tuple of label values.
+    :param type: "counter" or "gauge".
+    """
+
+    def __init__(self, name, help, function, labels=(), type="gauge",
+                 **kwargs):
+        self.function = function
+        self.type = type
+        super().__init__(name, help, labels, **kwargs)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        values = self.function()
+        if not self.label_names:
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.label_names, labels)} "
+                f"{_format_value(value)}"
+                for labels, value in sorted(values.items())]
+
+
+RESOLVER_SECONDS = Histogram(
+    "tangogql_resolver_seconds",
+    "Duration of the asynchronous resolvers, by type and field",
+    labels=("resolver",))
+
+LOOP_LAG_SECONDS = Gauge(
+    "tangogql_event_loop_lag_seconds",
+    "How late the event loop last ran a timer")
+
+LOOP_LAG_HISTOGRAM = Histogram(
+    "tangogql_event_loop_lag_histogram_seconds",
+    "How late the event loop ran timers")
+
+
+def resident_memory():
+    """The resident memory of the process, in bytes (0 if unknown)."""
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+RESIDENT_MEMORY = CallbackMetric(
+    "process_resident_memory_bytes",
+    "Resident memory size in bytes",
+    resident_memory)
+
+
+def is_pending(result):
+    """Whether a resolver result is not available yet (e.g. it does I/O).
+
+    The results are promises, unless the middleware is used without
+    wrap_in_promise.
+    """
+
+    if hasattr(result, "is_pending"):
+        return result.is_pending
+    return inspect.isawaitable(result)
+
+
+def when_resolved(result, observe):
+    """Call observe with the time a pending resolver result takes.
+
+    :param result: The pending result, a promise or an awaitable.
+    :param observe: Called with the duration in seconds, once the result is
+                    available (or failed).
+
+    :return: What the middleware should return instead of the result.
+    """
+
+    started = time.perf_counter()
+    if not hasattr(result, "then"):
+        return _observed(result, observe, started)
+
+    def done(value):
+        observe(time.perf_counter() - started)
+        return value
+
+    def failed(error):
+        observe(time.perf_counter() - started)
+        raise error
+
+    return result.then(done, failed)
+
+
+async def _observed(result, observe, started):
+    try:
+        return await result
+    finally:
+        observe(time.perf_counter() - started)
+
+
+class ResolverMetricsMiddleware(object):
+    """GraphQL middleware timing the resolvers that don't return at once.
+
+    The other resolvers (attribute lookups and the like) are not timed,
+    so the overhead only applies to the ones doing I/O.
+    """
+
+    def __init__(self, histogram=RESOLVER_SECONDS):
+        self.histogram = histogram
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if not is_pending(result):
+            return result
+        series = self.histogram.labels(
+            f"{info.parent_type.name}.{info.field_name}")
+        return when_resolved(result, series.observe)
+
+
+async def monitor_loop_lag(period=LOOP_LAG_PERIOD):
+    """Measure, forever, how late the event loop wakes up from sleeps.
+
+    A busy loop (e.g. encoding a big response) delays everything else, this
+    shows by how much.
+    """
+
+    loop = asyncio.get_event_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(period)
+        lag = max(0, loop.time() - started - period)
+        LOOP_LAG_SECONDS.set(lag)
+        LOOP_LAG_HISTOGRAM.observe(lag)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""Profiling of the queries: where does the time go?
+
+A QueryProfiler is a GraphQL middleware for a single request. It records
+the wall time of every resolver that does not return at once (those doing
+I/O), aggregated by path without the list indices, e.g.
+"devices.attributes.value", and keeps the slowest individual ones with
+their full path and device, e.g. "devices.3.attributes.0.value" of
+"sys/tg_test/1".
+
+The requests taking more than SLOW_QUERY_THRESHOLD seconds are written to
+the slow query log, with the query, its variables and the breakdown. It is
+the main log unless SLOW_QUERY_LOG gives a file of its own.
+
+Clients can get the breakdown in "extensions.timing" of the response by
+asking for it, with "?timing" in the url or "timing": true in the
+extensions of the request, and everybody gets it with TIMING_EXTENSION set.
+"""
+
+import heapq
+import json
+import logging
+import logging.handlers
+import os
+import time
+from itertools import count
+
+from tangogql.metrics import is_pending, when_resolved
+
+__all__ = ['QueryProfiler', 'log_slow_query', 'wants_timing']
+
+# Requests taking longer (in seconds) are logged, 0 to log none
+SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD", 0))
+
+# File of the slow query log, by default the main log is used
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG")
+
+# Whether all the responses get extensions.timing
+TIMING_EXTENSION = bool(os.environ.get("TIMING_EXTENSION"))
+
+# Number of individual resolver timings kept, the slowest ones
+SLOWEST = 10
+
+# The types whose objects are devices, for the other types the device is
+# the "device" field of the object, if any
+DEVICE_TYPES = frozenset(["Device", "Member"])
+
+
+def _slow_query_logger():
+    if not SLOW_QUERY_LOG:
+        return logging.getLogger('logger')
+    slow_logger = logging.getLogger('slow_queries')
+    if not slow_logger.handlers:
+        path = SLOW_QUERY_LOG
+        # One file per worker, like the main log
+        if os.environ.get("WORKER_ID"):
+            root, extension = os.path.splitext(path)
+            path = f"{root}-worker{os.environ['WORKER_ID']}{extension}"
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=15 * 1024 * 1024, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        slow_logger.addHandler(handler)
+        slow_logger.setLevel(logging.INFO)
+        slow_logger.propagate = False
+    return slow_logger
+
+
+def wants_timing(request, payload):
+    """Whether the client asked for extensions.timing."""
+
+    extensions = payload.get("extensions") or {}
+    return (TIMING_EXTENSION or "timing" in request.query or
+            bool(extensions.get("timing")))
+
+
+def _device(root, info):
+    if info.parent_type.name in DEVICE_TYPES:
+        return getattr(root, "name", None)
+    return getattr(root, "device", None)
+
+
+class QueryProfiler(object):
+    """GraphQL middleware recording the resolver timings of one request."""
+
+    def __init__(self, slowest=SLOWEST):
+        self.started = time.perf_counter()
+        self.slowest = slowest
+        self._paths = {}
+        self._slowest = []
+        self._count = count()
+
+    @property
+    def elapsed(self):
+        """Seconds since the profiler was created."""
+
+        return time.perf_counter() - self.started
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if not is_pending(result):
+            return result
+        path = info.path or [info.field_name]
+
+        def observe(duration):
+            self._record(path, _device(root, info), duration)
+
+        return when_resolved(result, observe)
+
+    def _record(self, path, device, duration):
+        key = ".".join(str(part) for part in path
+                       if not isinstance(part, int))
+        stats = self._paths.get(key)
+        if stats is None:
+            stats = self._paths[key] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        entry = (duration, next(self._count), path, device)
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def timing(self):
+        """Return the breakdown of the request so far.
+
+        :return: The total duration, the count, total and maximum duration
+                 of the resolvers by path, and the slowest resolvers, all in
+                 seconds.
+        :rtype: dict
+        """
+
+        resolvers = {key: {"count": calls, "total": total, "max": longest}
+                     for key, (calls, total, longest)
+                     in sorted(self._paths.items())}
+        slowest = [{"path": ".".join(str(part) for part in path),
+                    "device": device, "duration": duration}
+                   for duration, _, path, device
+                   in sorted(self._slowest, reverse=True)]
+        return {"total": self.elapsed, "resolvers": resolvers,
+                "slowest": slowest}
+
+
+def log_slow_query(profiler, query, variables=None, operation_name=None,
+                   threshold=SLOW_QUERY_THRESHOLD):
+    """Log the request if it took longer than the threshold.
+
+    :param profiler: The profiler of the request.
+    :type profiler: QueryProfiler
+    :param query: The query text.
+    :type query: str
+
+    :return: Whether it was logged.
+    :rtype: bool
+    """
+
+    if not threshold:
+        return False
+    timing = profiler.timing()
+    if timing["total"] < threshold:
+        return False
+    record = {"duration": timing["total"], "query": query,
+              "variables": variables, "operationName": operation_name,
+              "timing": timing}
+    _slow_query_logger().warning(
+        "SLOW QUERY - " + json.dumps(record, default=str))
+    return True
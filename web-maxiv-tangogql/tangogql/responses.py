@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Cache of whole /db responses, for the queries that only read the
+database.
+
+Browsing the device tree means many identical queries from many clients
+(domains, families, members, properties...), whose answers only change when
+the database does. Such responses are kept for RESPONSE_CACHE_TTL seconds,
+keyed by the normalized query, the operation name and the variables.
+
+A query is only cached if it asks for none of the LIVE_FIELDS, which read
+the devices themselves, and is not a mutation. Queries are not
+authorized per user (only mutations are), so the user is not part of the
+key. The cache is cleared whenever the cached database results are
+invalidated, e.g. by a property mutation.
+"""
+
+import json
+import os
+
+from graphql.language import ast
+
+from tangogql.ttldict import TTLDict
+
+__all__ = ['ResponseCache', 'is_cacheable', 'LIVE_FIELDS']
+
+# How long (in seconds) responses are cached, 0 to not cache them, and how
+# many are kept
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 0))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1000))
+
+# The fields whose values come from the devices (or from the user action
+# log, or are the status of the database), by name in the query. The
+# attribute values are only reachable through these, "value" alone is also
+# the value of a property.
+LIVE_FIELDS = frozenset([
+    "state", "connected", "attributes", "commands", "server",
+    "readAttributes", "userActions", "info",
+])
+
+
+def _has_live_field(selection_set, fragments, visited):
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            if selection.name.value in LIVE_FIELDS:
+                return True
+            children = selection.selection_set
+        elif isinstance(selection, ast.InlineFragment):
+            children = selection.selection_set
+        else:
+            name = selection.name.value
+            if name in visited or name not in fragments:
+                continue
+            visited = visited | {name}
+            children = fragments[name].selection_set
+        if children is not None and _has_live_field(children, fragments,
+                                                    visited):
+            return True
+    return False
+
+
+def is_cacheable(document, operation_name=None):
+    """Whether the response to a query may be cached.
+
+    :param document: The parsed query.
+    :type document: graphql.language.ast.Document
+    :param operation_name: The operation to execute, if there are several.
+    :type operation_name: str
+
+    :return: True if the operations that may run are queries that don't
+             ask for any live field.
+    :rtype: bool
+    """
+
+    fragments = {definition.name.value: definition
+                 for definition in document.definitions
+                 if isinstance(definition, ast.FragmentDefinition)}
+    for definition in document.definitions:
+        if not isinstance(definition, ast.OperationDefinition):
+            continue
+        if (operation_name is not None and definition.name is not None and
+                definition.name.value != operation_name):
+            continue
+        if definition.operation != "query":
+            return False
+        if _has_live_field(definition.selection_set, fragments, frozenset()):
+            return False
+    return True
+
+
+class ResponseCache(object):
+    """Keep the serialized responses of the cacheable queries.
+
+    :param ttl: How long (in seconds) responses are kept, 0 to disable the
+                cache.
+    :type ttl: float
+    :param max_entries: Maximum number of responses kept.
+    :type max_entries: int
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_SIZE):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._responses = TTLDict(default_ttl=ttl, max_entries=max_entries)
+        self._cacheable = TTLDict(default_ttl=None, max_entries=max_entries)
+
+    def __len__(self):
+        return len(self._responses)
+
+    def key(self, document, variables=None, operation_name=None):
+        """Return the cache key of a request.
+
+        :param document: The document of the query.
+        :type document: tangogql.documents.Document
+        :param variables: The variables of the query.
+        :type variables: dict
+        :param operation_name: The operation to execute.
+        :type operation_name: str
+
+        :return: The key, or None if the response must not be cached.
+        """
+
+        if not self.ttl or document.key is None:
+            return None
+        cacheable = self._cacheable.get((document.key, operation_name))
+        if cacheable is None:
+            cacheable = is_cacheable(document.ast, operation_name)
+            self._cacheable[(document.key, operation_name)] = cacheable
+        if not cacheable:
+            return None
+        return (document.key, operation_name,
+                json.dumps(variables, sort_keys=True))
+
+    def get(self, key):
+        """Return the cached response body for a key, or None."""
+
+        body = self._responses.get(key)
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def put(self, key, body, generation):
+        """Cache a response body.
+
+        :param generation: The generation when the query started, the
+                           response is dropped if the cache was invalidated
+                           in the meantime.
+        :type generation: int
+        """
+
+        if generation == self.generation:
+            self._responses[key] = body
+
+    def invalidate(self, *args):
+        """Forget all the responses.
+
+        Takes any arguments, to be usable as an invalidation listener of
+        tangogql.tangodb.CachedDatabase.
+        """
+
+        self.generation += 1
+        self._responses.clear()
@@ -6,18 +6,112 @@ from aiohttp import web
 import json
 import jwt
 import os
+import time
 
 from graphql_ws.aiohttp import AiohttpSubscriptionServer
 from graphql import format_error
+from graphql.execution import execute as graphql_execute, ExecutionResult
 from graphql.execution.executors.asyncio import AsyncioExecutor
 
+import PyTango
+
 from tangogql.schema.tango import tangoschema
+from tangogql.schema.base import db, proxies, reads, subscriptions
+from tangogql.broker import RemoteHub
+from tangogql.arrays import check_reduction, reduce_array, to_buffer
+from tangogql.cost import (estimate_cost, check_cost, CostLimiter,
+                           QueryTooExpensive)
+from tangogql.documents import (DocumentCache, PersistedQueryNotFound,
+                                PersistedQueryMismatch)
+from tangogql.responses import ResponseCache
+from tangogql.serializer import serializer
+from tangogql.streaming import plan_stream, stream_query
+from tangogql.metrics import (registry, CallbackMetric, Histogram,
+                              ResolverMetricsMiddleware, CONTENT_TYPE)
+from tangogql.profiling import (QueryProfiler, log_slow_query, wants_timing,
+                                SLOW_QUERY_THRESHOLD)
 from tangogql.schema.authorization import AuthorizationMiddleware,AuthenticationMiddleware,UserUnauthorizedException
 
 from tangogql.schema.errors import ErrorParser
 
-subscription_server = AiohttpSubscriptionServer(tangoschema)
+
+class SubscriptionServer(AiohttpSubscriptionServer):
+    """Gives the subscriptions their websocket connection as context, so
+    that a client too slow for its subscriptions can be disconnected."""
+
+    def get_graphql_params(self, connection_context, payload):
+        params = super().get_graphql_params(connection_context, payload)
+        return dict(params, context_value={"connection": connection_context})
+
+
+subscription_server = SubscriptionServer(tangoschema)
+limiter = CostLimiter()
+documents = DocumentCache(tangoschema)
+responses = ResponseCache()
+db.add_invalidation_listener(responses.invalidate)
 routes = web.RouteTableDef()
+started = time.time()
+resolver_metrics = ResolverMetricsMiddleware()
+
+REQUEST_SECONDS = Histogram(
+    "tangogql_request_seconds",
+    "Duration of the /db requests, by HTTP status",
+    labels=("status",))
+
+
+def _by_result(stats, *names):
+    return {(name,): stats[name] for name in names}
+
+
+# Counts kept by the components themselves, read when scraped
+CallbackMetric(
+    "tangogql_db_cache_total",
+    "Cached database calls, by method and result (hits, misses or stale)",
+    lambda: {(method, result): counts[result]
+             for method, counts in db.cache_stats().items()
+             for result in ("hits", "misses", "stale")},
+    labels=("method", "result"), type="counter")
+CallbackMetric(
+    "tangogql_db_cache_entries",
+    "Results in the database cache, by method",
+    lambda: {(method,): counts["entries"]
+             for method, counts in db.cache_stats().items()},
+    labels=("method",))
+CallbackMetric(
+    "tangogql_read_coalescer_total",
+    "Attribute reads, shared with another request (hits) or not",
+    lambda: _by_result(reads.stats(), "hits", "misses"),
+    labels=("result",), type="counter")
+CallbackMetric(
+    "tangogql_reads_in_flight",
+    "Attribute reads in progress",
+    lambda: reads.stats()["in_flight"])
+CallbackMetric(
+    "tangogql_proxies",
+    "Device proxies in the cache",
+    lambda: len(proxies))
+CallbackMetric(
+    "tangogql_proxy_evictions_total",
+    "Device proxies dropped from the full cache",
+    lambda: proxies.evictions, type="counter")
+CallbackMetric(
+    "tangogql_subscribed_attributes",
+    "Attributes with at least one subscriber in this process",
+    lambda: len(subscriptions))
+CallbackMetric(
+    "tangogql_document_cache_total",
+    "Parsed queries, found in the cache (hits) or not",
+    lambda: {("hits",): documents.hits, ("misses",): documents.misses},
+    labels=("result",), type="counter")
+CallbackMetric(
+    "tangogql_response_cache_total",
+    "Cacheable responses, found in the cache (hits) or not",
+    lambda: {("hits",): responses.hits, ("misses",): responses.misses},
+    labels=("result",), type="counter")
+CallbackMetric(
+    "tangogql_heavy_queries_waiting",
+    "Expensive queries waiting for their turn",
+    lambda: limiter.waiting)
 
 # FIXME: aiohttp doesn't support automatic serving of index files when serving
 #        directories statically, so we need to define a number of routes to
@@ -39,22 +133,137 @@ routes.static('/graphiql/js', 'static/graphiql/js')
 @routes.post("/db")
 async def db_handler(request):
     """Serve GraphQL queries."""
+    begin = time.perf_counter()
+    response = await _serve_query(request)
+    REQUEST_SECONDS.labels(str(response.status)).observe(
+        time.perf_counter() - begin)
+    return response
+
+
+def _bad_request(message):
+    """A 400 response, with the error shaped like the query errors."""
+    return web.Response(
+        body=serializer.dumps({"errors": [{"reason": message}]}),
+        status=400, headers={"Content-Type": "application/json"})
+
+
+def _payload_error(payload):
+    """What is wrong with the shape of a request, None if nothing."""
+    if not isinstance(payload, dict):
+        return "The request must be a JSON object"
+    for name in ("variables", "extensions"):
+        if not isinstance(payload.get(name, {}), (dict, type(None))):
+            return f"{name} must be an object"
+    persisted = (payload.get("extensions") or {}).get("persistedQuery")
+    if not isinstance(persisted, (dict, type(None))):
+        return "extensions.persistedQuery must be an object"
+    sha256 = (persisted or {}).get("sha256Hash")
+    if not isinstance(sha256, (str, type(None))):
+        return "extensions.persistedQuery.sha256Hash must be a string"
+    return None
+
+
+async def _serve_query(request):
     loop = asyncio.get_event_loop()
-    payload = await request.json()
+    try:
+        payload = await request.json(loads=serializer.loads)
+    except ValueError:
+        return _bad_request("The request must be JSON")
+    error = _payload_error(payload)
+    if error is not None:
+        return _bad_request(error)
     query = payload.get("query")
     variables = payload.get("variables")
     context = _build_context(request,"config.json")
+    context["native_arrays"] = serializer.numpy
 
-    # Spawn query as a coroutine using asynchronous executor
-    response = await tangoschema.execute(
-        query,
-        variable_values=variables,
-        middleware=[AuthenticationMiddleware, AuthorizationMiddleware],
-        context_value=context,
-        return_promise=True,
-        executor=AsyncioExecutor(loop=loop),
-    )
     data = {}
+    extensions = {}
+    persisted = (payload.get("extensions") or {}).get("persistedQuery") or {}
+    try:
+        document = documents.get(query, persisted.get("sha256Hash"))
+    except (PersistedQueryNotFound, PersistedQueryMismatch) as error:
+        # The message and code are what the Apollo clients look for
+        data["errors"] = [{"message": str(error), "reason": str(error),
+                           "extensions": {"code": error.code}}]
+        return web.Response(
+            body=serializer.dumps(data),
+            headers={"Content-Type": "application/json"})
+    if document.errors:
+        data["errors"] = ErrorParser.remove_duplicated_errors(
+            [ErrorParser.parse(e) for e in document.errors])
+        return web.Response(
+            body=serializer.dumps(data),
+            headers={"Content-Type": "application/json"})
+
+    plan = None
+    if _wants_stream(request):
+        plan = plan_stream(document.ast, payload.get("operationName"))
+
+    timing = wants_timing(request, payload)
+    profiler = None
+    if timing or SLOW_QUERY_THRESHOLD:
+        profiler = QueryProfiler()
+    middleware = [AuthenticationMiddleware, AuthorizationMiddleware,
+                  resolver_metrics]
+    if profiler is not None:
+        middleware.append(profiler)
+
+    cache_key = None
+    # The timing of a cached response would be meaningless
+    if plan is None and not timing:
+        cache_key = responses.key(document, variables,
+                                  payload.get("operationName"))
+    if cache_key is not None:
+        body = responses.get(cache_key)
+        if body is not None:
+            return web.Response(
+                body=body, headers={"Content-Type": "application/json"})
+        generation = responses.generation
+
+    estimate = estimate_cost(tangoschema, document.ast, variables,
+                             payload.get("operationName"))
+    extensions["cost"] = {"estimated": estimate.cost,
+                          "depth": estimate.depth}
+    try:
+        check_cost(estimate)
+    except QueryTooExpensive as error:
+        data["errors"] = [ErrorParser.parse(error)]
+        data["extensions"] = extensions
+        return web.Response(
+            body=serializer.dumps(data),
+            headers={"Content-Type": "application/json"})
+
+    async def execute(ast=document.ast, context=context):
+        # Spawn query as a coroutine using asynchronous executor. The
+        # document is already validated, so it is executed directly.
+        try:
+            return await graphql_execute(
+                tangoschema,
+                ast,
+                variable_values=variables,
+                operation_name=payload.get("operationName"),
+                middleware=middleware,
+                context_value=context,
+                return_promise=True,
+                executor=AsyncioExecutor(loop=loop),
+            )
+        except Exception as error:
+            # E.g. invalid variables, like graphql() does
+            return ExecutionResult(errors=[error], invalid=True)
+
+    if plan is not None:
+        return await _stream_response(request, plan, execute, variables,
+                                      payload.get("operationName"),
+                                      context, extensions, profiler,
+                                      timing, query)
+
+    response = await limiter.run(estimate, execute)
+    if profiler is not None:
+        log_slow_query(profiler, query, variables,
+                       payload.get("operationName"))
+        if timing:
+            extensions["timing"] = profiler.timing()
     if response.errors:
         for e in response.errors:
             if hasattr(e,"original_error"):
@@ -65,13 +274,170 @@ async def db_handler(request):
             data['errors'] = ErrorParser.remove_duplicated_errors(parsed_errors)
     if response.data:
         data["data"] = response.data
-    jsondata = json.dumps(data)
+    if extensions:
+        data["extensions"] = extensions
+    body = serializer.dumps(data)
+    if cache_key is not None and not response.errors:
+        responses.put(cache_key, body, generation)
 
     return web.Response(
-        text=jsondata, headers={"Content-Type": "application/json"}
+        body=body, headers={"Content-Type": "application/json"}
     )
 
 
+def _wants_stream(request):
+    """Whether the client asked for a streamed (NDJSON) response."""
+    accept = request.headers.get("Accept", "")
+    return "stream" in request.query or "application/x-ndjson" in accept
+
+
+async def _stream_response(request, plan, execute, variables,
+                           operation_name, context, extensions,
+                           profiler=None, timing=False, query=None):
+    """Send the results of a query page by page, as NDJSON.
+
+    Each page is executed with its own copy of the context, without the
+    loaders, so that the values loaded for a page are not kept until the
+    end of the request. The timing of all the pages comes with the last
+    line.
+    """
+
+    async def execute_page(ast):
+        estimate = estimate_cost(tangoschema, ast, variables, operation_name)
+        return await limiter.run(
+            estimate, lambda: execute(ast, _page_context(context)))
+
+    response = web.StreamResponse(
+        headers={"Content-Type": "application/x-ndjson"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    try:
+        async for payload in stream_query(plan, execute_page, variables):
+            if "errors" in payload:
+                payload["errors"] = ErrorParser.remove_duplicated_errors(
+                    [ErrorParser.parse(e) for e in payload["errors"]])
+            await response.write(serializer.dumps(payload) + b"\n")
+        if profiler is not None:
+            log_slow_query(profiler, query, variables, operation_name)
+            if timing:
+                extensions["timing"] = profiler.timing()
+        await response.write(serializer.dumps(
+            {"hasNext": False, "extensions": extensions}) + b"\n")
+    except ConnectionResetError:
+        # The client went away, stop executing the rest
+        return response
+    await response.write_eof()
+    return response
+
+
+def _page_context(context):
+    """A copy of the context for one streamed page, with new loaders."""
+    return {name: value for name, value in context.items()
+            if name != "loaders"}
+
+
+@routes.get("/attribute/{full_name:.+}")
+async def attribute_handler(request):
+    """Serve the raw value of a numerical SPECTRUM or IMAGE attribute.
+
+    The body is the little-endian buffer of the value (the write value if
+    the "write" query parameter is given), its NumPy dtype and shape are in
+    the X-Dtype and X-Shape headers. The value can be reduced with the
+    "roi" (comma separated indices), "stride" and "max_points" query
+    parameters, as in the GraphQL queries (see tangogql.arrays).
+
+    The status is 400 for invalid parameters, 404 if the attribute can not
+    be read and 504 if the device did not answer in time.
+    """
+    *parts, attribute = request.match_info["full_name"].split("/")
+    device = "/".join(parts)
+    try:
+        roi, stride, max_points = _reduction(request.query)
+        check_reduction(stride, max_points)
+    except ValueError as error:
+        return web.HTTPBadRequest(text=str(error))
+    try:
+        read = await reads.read_attribute(device, attribute)
+    except asyncio.TimeoutError:
+        return web.HTTPGatewayTimeout(
+            text=f"{device} did not answer in time")
+    except PyTango.DevFailed as error:
+        if error.args[0].reason == "API_DeviceTimedOut":
+            return web.HTTPGatewayTimeout(text=error.args[0].desc)
+        return web.HTTPNotFound(text=error.args[0].desc)
+    value = read.w_value if "write" in request.query else read.value
+    array = to_buffer(value) if read.data_format != 0 else None
+    if array is None:
+        return web.HTTPBadRequest(
+            text=f"{device}/{attribute} is not a numerical array")
+    try:
+        array = to_buffer(reduce_array(array, roi, stride, max_points))
+    except ValueError as error:
+        return web.HTTPBadRequest(text=str(error))
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-Dtype": array.dtype.str,
+        "X-Shape": ",".join(str(size) for size in array.shape),
+        "X-Quality": read.quality.name,
+        "X-Timestamp": str(read.time.totime()),
+    }
+    return web.Response(body=memoryview(array).cast("B"), headers=headers)
+
+
+def _reduction(query):
+    """The roi, stride and max_points query parameters, None if missing.
+
+    :raises ValueError: If they are not integers.
+    """
+    try:
+        roi = stride = max_points = None
+        if query.get("roi"):
+            roi = [int(index) for index in query["roi"].split(",")]
+        if query.get("stride"):
+            stride = int(query["stride"])
+        if query.get("max_points"):
+            max_points = int(query["max_points"])
+    except ValueError:
+        raise ValueError("roi, stride and max_points must be integers")
+    return roi, stride, max_points
+
+
+@routes.get("/health")
+async def health_handler(request):
+    """Report the health of this server process.
+
+    With several workers, this is the worker that got the request; the
+    "all" query parameter adds the status of all the workers, as last
+    reported to the broker. The status is 503 if the broker is unreachable.
+    """
+    health = {
+        "pid": os.getpid(),
+        "worker": os.environ.get("WORKER_ID"),
+        "uptime": time.time() - started,
+        "attributes": len(subscriptions),
+        "reads": reads.stats(),
+    }
+    status = 200
+    if isinstance(subscriptions, RemoteHub):
+        health["broker"] = subscriptions.connected
+        if "all" in request.query:
+            try:
+                health["workers"] = await subscriptions.workers()
+            except asyncio.TimeoutError:
+                health["broker"] = False
+        if not health["broker"]:
+            status = 503
+    return web.Response(body=serializer.dumps(health), status=status,
+                        headers={"Content-Type": "application/json"})
+
+
+@routes.get("/metrics")
+async def metrics_handler(request):
+    """Serve the metrics, in the Prometheus text format."""
+    return web.Response(body=registry.render().encode("utf-8"),
+                        headers={"Content-Type": CONTENT_TYPE})
+
+
 @routes.get("/socket")
 async def socket_handler(request):
     ws = web.WebSocketResponse(protocols=("graphql-ws",))
@@ -2,7 +2,18 @@
 
 
 from tangogql.tangodb import CachedDatabase, DeviceProxyCache
+from tangogql.coalescer import ReadCoalescer
+from tangogql.listener import SubscriptionHub
+from tangogql.broker import RemoteHub, BROKER_SOCKET
+from tangogql.devicetree import DeviceTree
 
 
-db = CachedDatabase(ttl=10)
+db = CachedDatabase()
 proxies = DeviceProxyCache()
+reads = ReadCoalescer(proxies)
+if BROKER_SOCKET:
+    # Shared with the other worker processes, see tangogql.workers
+    subscriptions = RemoteHub(BROKER_SOCKET)
+else:
+    subscriptions = SubscriptionHub(reads)
+tree = DeviceTree(db)
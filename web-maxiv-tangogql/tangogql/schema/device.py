@@ -12,6 +12,8 @@ from tangogql.schema.attribute import ScalarDeviceAttribute
 from tangogql.schema.attribute import ImageDeviceAttribute
 from tangogql.schema.attribute import SpectrumDeviceAttribute
 from tangogql.schema.log import UserAction, user_actions
+from tangogql.schema.loaders import get_loaders
+from tangogql.schema.pagination import paginate
 
 class DeviceProperty(ObjectType, Interface):
     """ This class represents a property of a device.  """
@@ -20,7 +22,7 @@ class DeviceProperty(ObjectType, Interface):
     device = String()
     value = List(String)
 
-    def resolve_value(self, info):
+    async def resolve_value(self, info):
         """ This method fetch the value of the property by its name.
 
         :return: A list of string contains the values corespond to the name of
@@ -30,7 +32,7 @@ class DeviceProperty(ObjectType, Interface):
 
         device = self.device
         name = self.name
-        value = db.get_device_property(device, name)
+        value = await db.get_device_property(device, name)
         if value:
             return [line for line in value[name]]
 
@@ -60,24 +62,22 @@ class Device(ObjectType, Interface):
     name = String()
     state = String()
     connected = Boolean()
-    properties = List(DeviceProperty, pattern=String())
-    attributes = List(DeviceAttribute, pattern=String())
+    properties = List(DeviceProperty, pattern=String(), first=Int(),
+                      after=String())
+    attributes = List(DeviceAttribute, pattern=String(), first=Int(),
+                      after=String())
     commands = List(DeviceCommand, pattern=String())
     server = Field(DeviceInfo)
-    user_actions = List(UserAction, skip=Int(), first=Int())
+    user_actions = List(UserAction, skip=Int(), first=Int(), after=Int())
     device_class = String()
     # server = String()
     pid = Int()
     started_date = String()
     stopped_date = String()
     exported = Boolean()
-    def resolve_user_actions(self, info, skip=None, first=None):
-        result = user_actions.get(self.name)
-        if skip:
-            result = result[skip:]
-        if first:
-            result = result[:first]
-        return result
+    def resolve_user_actions(self, info, skip=None, first=None, after=None):
+        return user_actions.get(self.name, first=first, after=after,
+                                skip=skip)
 
     async def resolve_state(self, info):
         """This method fetch the state of the device.
@@ -86,34 +86,43 @@ class Device(ObjectType, Interface):
         :rtype: str
         """
         try:
-            proxy = self._get_proxy()
-            return await proxy.state()
+            return await get_loaders(info).states.load(self.name)
         except (PyTango.DevFailed, PyTango.ConnectionFailed,
                 PyTango.CommunicationFailed, PyTango.DeviceUnlocked):
             return "UNKNOWN"
         except Exception as e:
             return str(e)
 
-    def resolve_properties(self, info, pattern="*"):
+    async def resolve_properties(self, info, pattern="*", first=None,
+                                 after=None):
         """This method fetch the properties of the device.
 
         :param pattern: Pattern for filtering the result.
                         Returns only properties that matches the pattern.
         :type pattern: str
+        :param first: Maximum number of properties.
+        :type first: int
+        :param after: Only the properties after the one with this name.
+        :type after: str
 
         :return: List of properties for the device.
         :rtype: List of DeviceProperty
         """
-        #TODO:Db calls are not asynchronous in tango
-        props = db.get_device_property_list(self.name, pattern)
-        return [DeviceProperty(name=p, device=self.name) for p in props]
+        props = sorted(await db.get_device_property_list(self.name, pattern))
+        return [DeviceProperty(name=p, device=self.name)
+                for p in paginate(props, first, after)]
 
-    async def resolve_attributes(self, info, pattern="*"):
+    async def resolve_attributes(self, info, pattern="*", first=None,
+                                 after=None):
         """This method fetch all the attributes and its' properties of a device.
 
         :param pattern: Pattern for filtering the result.
                         Returns only properties that match the pattern.
         :type pattern: str
+        :param first: Maximum number of attributes.
+        :type first: int
+        :param after: Only the attributes after the one with this name.
+        :type after: str
 
         :return: List of attributes of the device.
         :rtype: List of DeviceAttribute
@@ -145,25 +154,28 @@ class Device(ObjectType, Interface):
                           )
                           )
         result = []
-        if await self._get_connected():
-            proxy = self._get_proxy()
-            attr_infos = proxy.attribute_list_query()
+        if await self._get_connected(info):
+            proxy = await self._get_proxy()
+            attr_infos = await proxies.call(self.name,
+                                            proxy.attribute_list_query)
 
             rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
-            sorted_info = sorted(attr_infos, key=attrgetter("name"))
-            for attr_info in sorted_info:
-                if rule.match(attr_info.name):
-                    if str(attr_info.data_format) == "SCALAR":
-                        append_to_result(result,
-                                        ScalarDeviceAttribute, attr_info)
-
-                    if str(attr_info.data_format) == "SPECTRUM":
-                        append_to_result(result,
-                                        SpectrumDeviceAttribute, attr_info)
-
-                    if str(attr_info.data_format) == "IMAGE":
-                        append_to_result(result,
-                                        ImageDeviceAttribute, attr_info)
+            sorted_info = sorted((attr_info for attr_info in attr_infos
+                                  if rule.match(attr_info.name)),
+                                 key=attrgetter("name"))
+            for attr_info in paginate(sorted_info, first, after,
+                                      key=attrgetter("name")):
+                if str(attr_info.data_format) == "SCALAR":
+                    append_to_result(result,
+                                    ScalarDeviceAttribute, attr_info)
+
+                if str(attr_info.data_format) == "SPECTRUM":
+                    append_to_result(result,
+                                    SpectrumDeviceAttribute, attr_info)
+
+                if str(attr_info.data_format) == "IMAGE":
+                    append_to_result(result,
+                                    ImageDeviceAttribute, attr_info)
         return result
 
     async def resolve_commands(self, info, pattern="*"):
@@ -176,9 +188,10 @@ class Device(ObjectType, Interface):
         :return: List of commands of the device.
         :rtype: List of DeviceCommand
         """
-        if await self._get_connected():
-            proxy = self._get_proxy()
-            cmd_infos = proxy.command_list_query()
+        if await self._get_connected(info):
+            proxy = await self._get_proxy()
+            cmd_infos = await proxies.call(self.name,
+                                           proxy.command_list_query)
             rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
 
             def create_device_command(cmd_info):
@@ -203,55 +216,54 @@ class Device(ObjectType, Interface):
         :return: List server info of a device.
         :rtype: List of DeviceInfo
         """
-        if await self._get_connected():
-            proxy = self._get_proxy()
-            dev_info = proxy.info()
+        if await self._get_connected(info):
+            proxy = await self._get_proxy()
+            dev_info = await proxies.call(self.name, proxy.info)
             return DeviceInfo(id=dev_info.server_id,
                             host=dev_info.server_host)
             
-    def resolve_exported(self, info):
+    async def resolve_exported(self, info):
         """ This method fetch the infomation about the device if it is exported or not.
 
         :return: True if exported, False otherwise.
         :rtype: bool
         """
 
-        return self._get_info().exported
+        return (await self._get_info(info)).exported
 
-    def resolve_device_class(self, info):
-        return self._get_info().class_name
+    async def resolve_device_class(self, info):
+        return (await self._get_info(info)).class_name
 
-    def resolve_pid(self, info):
-        return self._get_info().pid
+    async def resolve_pid(self, info):
+        return (await self._get_info(info)).pid
 
-    def resolve_started_date(self, info):
-        return self._get_info().started_date
+    async def resolve_started_date(self, info):
+        return (await self._get_info(info)).started_date
 
-    def resolve_stopped_date(self, info):
-        return self._get_info().stopped_date
+    async def resolve_stopped_date(self, info):
+        return (await self._get_info(info)).stopped_date
 
     async def resolve_connected(self, info):
-        return await self._get_connected()
+        return await self._get_connected(info)
 
-    def _get_proxy(self):
+    async def _get_proxy(self):
         if not hasattr(self, "_proxy"):
-            self._proxy = proxies.get(self.name)
+            self._proxy = await proxies.get(self.name)
         return self._proxy
 
-    async def _get_connected(self):
+    async def _get_connected(self, info):
         if not hasattr(self, "_connected"):
             try:
-                proxy = self._get_proxy()
-                await proxy.state()
+                await get_loaders(info).states.load(self.name)
                 self._connected = True
             except (PyTango.DevFailed, PyTango.ConnectionFailed):
                 self._connected = False
         return self._connected
 
 
-    def _get_info(self):
+    async def _get_info(self, info):
         """This method fetch all the information of a device."""
 
         if not hasattr(self, "_info"):
-            self._info = db.get_device_info(self.name)
+            self._info = await get_loaders(info).device_infos.load(self.name)
         return self._info
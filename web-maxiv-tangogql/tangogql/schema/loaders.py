@@ -0,0 +1,200 @@
+"""Request scoped batching of device and database accesses.
+
+Resolvers of the same request often ask for the same kind of data for many
+devices or attributes at once, e.g. the values of all the attributes of a
+device. Instead of fetching them one by one, they ask a loader, which
+collects the keys requested during one iteration of the event loop and
+fetches them together (in the spirit of Facebook's DataLoader).
+"""
+
+import asyncio
+import re
+from collections import OrderedDict, namedtuple
+
+import PyTango
+
+from tangogql.schema.base import db, proxies, reads
+
+__all__ = ['BatchLoader', 'Loaders', 'get_loaders']
+
+# The columns of the device table needed for DeviceInfo, formatted like the
+# DbGetDeviceInfo command does
+DEVICE_INFO_QUERY = (
+    "SELECT name, exported, pid, class, server, host,"
+    " DATE_FORMAT(started, '%D of %M %Y at %H:%i:%s'),"
+    " DATE_FORMAT(stopped, '%D of %M %Y at %H:%i:%s')"
+    " FROM device WHERE name IN ({})")
+
+# The names that can go in the query as they are
+DEVICE_NAME = re.compile(r"[\w.-]+/[\w.-]+/[\w.-]+")
+
+DeviceInfo = namedtuple("DeviceInfo", ["name", "exported", "pid",
+                                       "class_name", "ds_full_name", "host",
+                                       "started_date", "stopped_date"])
+
+
+class BatchLoader(object):
+    """Load values by key, batching the keys requested together.
+
+    :param batch_load: Coroutine function taking a list of keys, returning
+                       the list of their values. A value that is an
+                       exception is raised to the requester of its key.
+    """
+
+    def __init__(self, batch_load):
+        self._batch_load = batch_load
+        self._futures = {}
+        self._queue = []
+
+    def load(self, key):
+        """Return an awaitable for the value of the key.
+
+        Values are kept for the lifetime of the loader, so a key is only
+        loaded once.
+        """
+
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                loop.call_soon(self._dispatch)
+        return future
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        asyncio.ensure_future(self._load(keys))
+
+    async def _load(self, keys):
+        try:
+            values = await self._batch_load(keys)
+        except Exception as error:
+            values = [error] * len(keys)
+        for key, value in zip(keys, values):
+            future = self._futures[key]
+            if future.done():
+                continue
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+
+def _group_by_device(keys):
+    devices = OrderedDict()
+    for device, name in keys:
+        devices.setdefault(device, []).append(name)
+    return devices
+
+
+async def read_attributes(keys):
+    """Read (device, attribute) keys, with one call per device."""
+
+    devices = _group_by_device(keys)
+    results = await asyncio.gather(*(reads.read(device, names)
+                                     for device, names in devices.items()))
+    values = {}
+    for (device, names), result in zip(devices.items(), results):
+        for name, value in zip(names, result):
+            values[(device, name)] = value
+    return [values[key] for key in keys]
+
+
+async def read_states(devices):
+    """Read the state of the devices, concurrently."""
+
+    async def read_state(device):
+        try:
+            proxy = await proxies.get(device)
+            return await proxy.state()
+        except Exception as error:
+            return error
+
+    return await asyncio.gather(*(read_state(device) for device in devices))
+
+
+def _not_defined(device):
+    error = PyTango.DevError()
+    error.reason = "DB_DeviceNotDefined"
+    error.desc = f"device {device} not defined in the database !"
+    error.origin = "get_device_infos"
+    error.severity = PyTango.ErrSeverity.ERR
+    return PyTango.DevFailed(error)
+
+
+async def _select_device_infos(devices):
+    """The infos of the devices, by lower case name, with one query.
+
+    :param devices: Names that match DEVICE_NAME, so that they can be
+                    quoted as they are.
+
+    :raises PyTango.DevFailed: If the database does not allow queries.
+    """
+
+    query = DEVICE_INFO_QUERY.format(", ".join(f"'{device}'"
+                                               for device in devices))
+    infos = {}
+    for (name, exported, pid, class_name, server, host, started,
+         stopped) in await db.select(query):
+        info = DeviceInfo(name=name, exported=exported == "1",
+                          pid=int(pid or 0), class_name=class_name,
+                          ds_full_name=server, host=host,
+                          started_date=started, stopped_date=stopped)
+        infos[name.lower()] = info
+    return infos
+
+
+async def get_device_infos(devices):
+    """Get the database info of the devices, with one query if possible.
+
+    Only the names that are plain TANGO device names go in the query, the
+    others (and all of them, if the database does not allow queries) are
+    asked for one by one.
+    """
+
+    names = [device for device in devices if DEVICE_NAME.fullmatch(device)]
+    infos = None
+    if names:
+        try:
+            infos = await _select_device_infos(names)
+        except PyTango.DevFailed:
+            # Not allowed to run queries on this database
+            pass
+
+    async def get_device_info(device):
+        if infos is not None and DEVICE_NAME.fullmatch(device):
+            info = infos.get(device.lower())
+            return info if info is not None else _not_defined(device)
+        try:
+            return await db.get_device_info(device)
+        except Exception as error:
+            return error
+
+    return await asyncio.gather(*(get_device_info(device)
+                                  for device in devices))
+
+
+class Loaders(object):
+    """The loaders of one request."""
+
+    def __init__(self):
+        self.attribute_reads = BatchLoader(read_attributes)
+        self.states = BatchLoader(read_states)
+        self.device_infos = BatchLoader(get_device_infos)
+
+
+def get_loaders(info):
+    """Return the loaders of the request, shared by all its resolvers.
+
+    Without a request context (e.g. in tests), new loaders are returned
+    every time, so nothing is batched but everything still works.
+    """
+
+    context = info.context
+    if not isinstance(context, dict):
+        return Loaders()
+    if "loaders" not in context:
+        context["loaders"] = Loaders()
+    return context["loaders"]
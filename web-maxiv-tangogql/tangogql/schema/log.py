@@ -2,6 +2,7 @@ from graphene import String, Int, List, Boolean, Field, ObjectType, Interface
 from graphene.types.datetime import DateTime
 from tangogql.schema.types import ScalarTypes
 from functools import wraps
+from itertools import count
 import re
 import fnmatch
 import operator
@@ -9,22 +10,50 @@ import operator
 class ActivityLog:
     def __init__(self):
         self._log_container = []
+        self._ids = count(1)
 
     def put(self,log):
+        log.id = next(self._ids)
         self._log_container.append(log)
 
-    def get(self, pattern = "*"):
+    def get(self, pattern = "*", first = None, after = None, skip = None):
+        """Return the logs of the devices matching a pattern, newest first.
+
+        :param first: Maximum number of logs, None for all of them.
+        :type first: int
+        :param after: Only the logs older than the one with this id.
+        :type after: int
+        :param skip: Number of matching logs to skip.
+        :type skip: int
+
+        :raises ValueError: If first is negative.
+        """
+        if first is not None and first < 0:
+            raise ValueError("first must not be negative")
         result = []
+        if first == 0:
+            return result
         rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
-        for log in self._log_container:
+        skip = skip or 0
+        # The logs are stored in the order of their ids, starting at 1
+        end = len(self._log_container)
+        if after is not None:
+            end = max(0, min(end, after - 1))
+        for index in range(end - 1, -1, -1):
+            log = self._log_container[index]
             if rule.match(log.device):
+                if skip:
+                    skip -= 1
+                    continue
                 result.append(log)
-        result.sort(key = lambda e: e.timestamp, reverse=True)
+                if first is not None and len(result) >= first:
+                    break
         return result
     
 user_actions = ActivityLog()
 
 class UserAction(Interface):
+    id = Int()
     timestamp = DateTime() 
     user = String()
     device = String()
@@ -5,9 +5,8 @@ import logging
 
 from datetime import datetime 
 from graphene import ObjectType, Mutation, String, Boolean, List
-from tangogql.schema.base import db, proxies
+from tangogql.schema.base import db, proxies, reads
 from tangogql.schema.types import ScalarTypes
-from tangogql.schema.attribute import collaborative_read_attribute
 from tangogql.schema.log import ExcuteCommandUserAction
 from tangogql.schema.log import SetAttributeValueUserAction
 from tangogql.schema.log import PutDevicePropertyUserAction
@@ -61,7 +60,7 @@ class ExecuteDeviceCommand(Mutation):
         if type(argin) is ValueError:
             return ExecuteDeviceCommand(ok=False, message=[str(argin)])
         try:
-            proxy = proxies.get(device)
+            proxy = await proxies.get(device)
             result = await proxy.command_inout(command, argin)
             return ExecuteDeviceCommand(ok=True,
                                         message=["Success"],
@@ -109,8 +108,8 @@ class SetAttributeValue(Mutation):
         if type(value) is ValueError:
             return SetAttributeValue(ok=False, message=[str(value)])
         try:
-            proxy = proxies.get(device)
-            before = await collaborative_read_attribute(proxy,name)
+            proxy = await proxies.get(device)
+            before = await reads.read_attribute(device, name)
             result = await proxy.write_read_attribute(name, value)
             log = SetAttributeValueUserAction(
                                             timestamp = datetime.now(), 
@@ -129,6 +128,9 @@ class SetAttributeValue(Mutation):
             return SetAttributeValue(ok=False, message=[e.desc, e.reason])
         except Exception as e:
             return SetAttributeValue(ok=False, message=[str(e)])
+        finally:
+            # Even a failed write may have changed the value
+            reads.invalidate(device, name)
 
 
 class PutDeviceProperty(Mutation):
@@ -143,7 +145,7 @@ class PutDeviceProperty(Mutation):
     ok = Boolean()
     message = List(String)
 
-    def mutate(self, info, device, name, value=""):
+    async def mutate(self, info, device, name, value=""):
         """ This method adds property to a device.
 
         :param device: Name of a device
@@ -164,7 +166,8 @@ class PutDeviceProperty(Mutation):
         # wait = not args.get("async")
         try:
             
-            db.put_device_property(device, {name: value})
+            await db.put_device_property(device, {name: value})
+            db.invalidate_device_properties(device)
             log = PutDevicePropertyUserAction(
                                             timestamp = datetime.now(), 
                                             user = info.context["client_data"]["user"],
@@ -192,7 +195,7 @@ class DeleteDeviceProperty(Mutation):
     ok = Boolean()
     message = List(String)
 
-    def mutate(self, info, device, name):
+    async def mutate(self, info, device, name):
         """This method delete a property of a device.
 
         :param device: Name of the device
@@ -208,7 +211,8 @@ class DeleteDeviceProperty(Mutation):
         logger.info("MUTATION - DeleteDeviceProperty - User: {}, Device: {}, Name: {}".format(info.context["client_data"]["user"], device, name))
         
         try: 
-            db.delete_device_property(device, name)
+            await db.delete_device_property(device, name)
+            db.invalidate_device_properties(device)
             log = DeleteDevicePropertyUserAction(
                                             timestamp = datetime.now(), 
                                             user = info.context["client_data"]["user"],
@@ -0,0 +1,42 @@
+"""Pagination of list fields.
+
+The list fields that can be long take two arguments:
+
+- first: the maximum number of items to return
+- after: the cursor of the last item of the previous page, to continue from
+
+The cursor of an item is its name (or id, for user actions), so it stays
+valid when items are added or removed between two pages. The page is cut
+from the sorted names, before the GraphQL objects are created, so only the
+items of the page are built and serialized.
+"""
+
+import bisect
+
+__all__ = ['paginate']
+
+
+def paginate(items, first=None, after=None, key=None):
+    """Return a page of a list sorted by cursor.
+
+    :param items: The items, sorted by key.
+    :type items: list
+    :param first: Maximum number of items, None for all of them.
+    :type first: int
+    :param after: Only the items whose cursor comes after this one.
+    :param key: Function returning the cursor of an item, by default the
+                item itself.
+
+    :raises ValueError: If first is negative.
+    :rtype: list
+    """
+
+    if first is not None and first < 0:
+        raise ValueError("first must not be negative")
+    start = 0
+    if after is not None:
+        keys = items if key is None else [key(item) for item in items]
+        start = bisect.bisect_right(keys, after)
+    if first is None:
+        return items[start:]
+    return items[start:start + first]
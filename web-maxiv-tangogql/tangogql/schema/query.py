@@ -1,15 +1,20 @@
 """Module containing Queries."""
 
 import re
+import asyncio
 import fnmatch
 import PyTango
 import copy
 from collections import defaultdict
-from graphene import Interface, ObjectType, String, List, Field, Int
+from graphene import Interface, ObjectType, String, List, Field, Int, NonNull
 from tangogql.schema.types import ScalarTypes
-from tangogql.schema.base import db, proxies
+from tangogql.schema.base import db, proxies, reads, tree
+from tangogql.schema.subscription import AttributeFrame
+from tangogql.listener import format_frame, encode_frame, split_name, error_str
 from tangogql.schema.device import Device
+from tangogql.schema.loaders import get_loaders
 from tangogql.schema.log import user_actions, UserAction
+from tangogql.schema.pagination import paginate
 #from tangogql.schema.user import UserLog
 
 class Member(Device):
@@ -18,8 +23,7 @@ class Member(Device):
     domain = String()
     family = String()
 
-    @property
-    def info(self):
+    async def _get_info(self, info):
         """This method fetch a member of the device using the name of the
         domain and family.
         """
@@ -29,7 +33,8 @@ class Member(Device):
             #       than python 3.6, then use format ... buuuuuutttt,
             #       let's have some fun with the new f-strings
             devicename = f"{self.domain}/{self.family}/{self.name}"
-            self._info = db.get_device_info(devicename)
+            self._info = await get_loaders(info).device_infos.load(
+                devicename)
         return self._info
 
 
@@ -40,7 +45,7 @@ class Family(ObjectType, Interface):
     domain = String()
     members = List(Member, pattern=String())
 
-    def resolve_members(self, info, pattern="*"):
+    async def resolve_members(self, info, pattern="*"):
         """This method fetch members using the name of the domain and pattern.
 
         :param pattern: Pattern for filtering of the result.
@@ -51,7 +56,11 @@ class Family(ObjectType, Interface):
         :rtype: List of Member
         """
 
-        members = db.get_device_member(f"{self.domain}/{self.name}/{pattern}")
+        if tree.ready:
+            members = tree.members(self.domain, self.name, pattern)
+        else:
+            members = await db.get_device_member(
+                f"{self.domain}/{self.name}/{pattern}")
         return [Member(domain=self.domain, family=self.name, name=member)
                 for member in members]
 
@@ -62,7 +71,7 @@ class Domain(ObjectType, Interface):
     name = String()
     families = List(Family, pattern=String())
 
-    def resolve_families(self, info, pattern="*"):
+    async def resolve_families(self, info, pattern="*"):
         """This method fetch a list of families using pattern.
 
         :param pattern: Pattern for filtering of the result.
@@ -73,7 +82,10 @@ class Domain(ObjectType, Interface):
             families([Family]):List of families.
         """
 
-        families = db.get_device_family(f"{self.name}/{pattern}/*")
+        if tree.ready:
+            families = tree.families(self.name, pattern)
+        else:
+            families = await db.get_device_family(f"{self.name}/{pattern}/*")
         return [Family(name=family, domain=self.name) for family in families]
 
 
@@ -93,8 +105,15 @@ class ServerInstance(ObjectType, Interface):
     server = String()
     classes = List(DeviceClass, pattern=String())
 
-    def resolve_classes(self, info, pattern="*"):
-        devs_clss = db.get_device_class_list(f"{self.server}/{self.name}")
+    async def resolve_classes(self, info, pattern="*"):
+        if tree.ready:
+            return [DeviceClass(name=clss, server=self.server,
+                                instance=self.name,
+                                devices=[Device(name=device)
+                                         for device in devices])
+                    for clss, devices in tree.classes(self.server, self.name,
+                                                      pattern)]
+        devs_clss = await db.get_device_class_list(f"{self.server}/{self.name}")
         mapping = defaultdict(list)
         rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
 
@@ -113,7 +132,7 @@ class Server(ObjectType, Interface):
     name = String()
     instances = List(ServerInstance, pattern=String())
 
-    def resolve_instances(self, info, pattern="*"):
+    async def resolve_instances(self, info, pattern="*"):
         """ This method fetches all the intances using pattern.
 
         :param pattern: Pattern for filtering the result.
@@ -124,7 +143,10 @@ class Server(ObjectType, Interface):
         :rtype: List of ServerIntance
         """
 
-        instances = db.get_instance_name_list(self.name)
+        if tree.ready:
+            return [ServerInstance(name=inst, server=self.name)
+                    for inst in tree.instances(self.name, pattern)]
+        instances = await db.get_instance_name_list(self.name)
         rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
         return [ServerInstance(name=inst, server=self.name)
                 for inst in instances if rule.match(inst)]
@@ -134,19 +156,23 @@ class Query(ObjectType):
     """This class contains all the queries."""
 
     info = String()
-    devices = List(Device, pattern=String())
+    devices = List(Device, pattern=String(), first=Int(), after=String())
     device = Field(Device, name=String(required=True))
     domains = List(Domain, pattern=String())
     families = List(Family, domain=String(), pattern=String())
-    members = List(Member, domain=String(), family=String(), pattern=String())
-    user_actions = List(UserAction, pattern=String(),skip=Int(),first=Int())
-    servers = List(Server, pattern=String())
+    members = List(Member, domain=String(), family=String(), pattern=String(),
+                   first=Int(), after=String())
+    user_actions = List(UserAction, pattern=String(), skip=Int(), first=Int(),
+                        after=Int())
+    servers = List(Server, pattern=String(), first=Int(), after=String())
     instances = List(ServerInstance, server=String(), pattern=String())
     classes = List(DeviceClass, pattern=String())
+    read_attributes = List(AttributeFrame,
+                           full_names=List(NonNull(String), required=True),
+                           encoding=String())
 
     async def resolve_info(self, info):
-        db = PyTango.Database()
-        return db.get_info()
+        return await db.get_info()
 
     async def resolve_device(self, info, name=None):
         """ This method fetches the device using the name.
@@ -157,26 +183,35 @@ class Query(ObjectType):
         :return:  Device.
         :rtype: Device    
         """
-        device_names = db.get_device_exported(name)
+        device_names = await db.get_device_exported(name)
         if len(device_names) == 1:
             return Device(name=device_names[0])
         else:
             return None
 
-    async def resolve_devices(self, info, pattern="*"):
+    async def resolve_devices(self, info, pattern="*", first=None,
+                              after=None):
         """ This method fetches all the devices using the pattern.
 
         :param pattern: Pattern for filtering the result.
                         Returns only properties that matches the pattern.
         :type pattern: str
+        :param first: Maximum number of devices.
+        :type first: int
+        :param after: Only the devices after the one with this name.
+        :type after: str
 
         :return: List of devices.
         :rtype: List of Device    
         """
-        device_names = db.get_device_exported(pattern)
-        return [Device(name=name) for name in device_names]
+        if tree.ready:
+            device_names = tree.devices(pattern, exported=True)
+        else:
+            device_names = await db.get_device_exported(pattern)
+        return [Device(name=name)
+                for name in paginate(sorted(device_names), first, after)]
 
-    def resolve_domains(self, info, pattern="*"):
+    async def resolve_domains(self, info, pattern="*"):
         """This method fetches all the domains using the pattern.
 
         :param pattern: Pattern for filtering the result.
@@ -186,10 +221,13 @@ class Query(ObjectType):
         :return: List of domains.
         :rtype: List of Domain
         """
-        domains = db.get_device_domain("%s/*" % pattern)
+        if tree.ready:
+            domains = tree.domains(pattern)
+        else:
+            domains = await db.get_device_domain("%s/*" % pattern)
         return [Domain(name=d) for d in sorted(domains)]
 
-    def resolve_families(self, info, domain="*", pattern="*"):
+    async def resolve_families(self, info, domain="*", pattern="*"):
         """This method fetches all the families using the pattern.
 
         :param domain: Domain for filtering the result.
@@ -203,10 +241,14 @@ class Query(ObjectType):
         :rtype: List of Family
         """
 
-        families = db.get_device_family(f"{domain}/{pattern}/*")
+        if tree.ready:
+            families = tree.families(domain, pattern)
+        else:
+            families = await db.get_device_family(f"{domain}/{pattern}/*")
         return [Family(domain=domain, name=d) for d in sorted(families)]
 
-    def resolve_members(self, info, domain="*", family="*", pattern="*"):
+    async def resolve_members(self, info, domain="*", family="*",
+                              pattern="*", first=None, after=None):
         """This method fetches all the members using the pattern.
 
         :param domain: Domain for filtering the result.
@@ -219,45 +261,108 @@ class Query(ObjectType):
                         Returns only properties that matches the pattern.
         :type pattern: str
 
+        :param first: Maximum number of members.
+        :type first: int
+
+        :param after: Only the members after the one with this name.
+        :type after: str
+
         :return: List of members.
         :rtype: List of Domain
         """
 
-        members = db.get_device_member(f"{domain}/{family}/{pattern}")
+        if tree.ready:
+            members = tree.members(domain, family, pattern)
+        else:
+            members = await db.get_device_member(
+                f"{domain}/{family}/{pattern}")
         return [Member(domain=domain, family=family, name=member)
-                for member in sorted(members)]
+                for member in paginate(sorted(members), first, after)]
 
-    def resolve_servers(self, info, pattern="*"):
+    async def resolve_servers(self, info, pattern="*", first=None,
+                              after=None):
         """ This method fetches all the servers using the pattern.
 
         :param pattern: Pattern for filtering the result.
                         Returns only properties that matches the pattern.
         :type pattern: str
+        :param first: Maximum number of servers.
+        :type first: int
+        :param after: Only the servers after the one with this name.
+        :type after: str
 
         :return: List of servers.
         :rtype: List of Server.
         """
 
-        servers = db.get_server_name_list()
-        # The db service does not allow wildcard here, but it can still
-        # useful to limit the number of children. Let's fake it!
-        rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
-        return [Server(name=srv) for srv in sorted(servers) if rule.match(srv)]
-
-    def resolve_user_actions(self, info, pattern="*", first = None, skip = None):
-        """ This method fetches the user actions.
-
-        :param name: Name of the user.
-        :type name: str
+        if tree.ready:
+            servers = sorted(tree.servers(pattern))
+        else:
+            servers = await db.get_server_name_list()
+            # The db service does not allow wildcard here, but it can still
+            # useful to limit the number of children. Let's fake it!
+            rule = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+            servers = [srv for srv in sorted(servers) if rule.match(srv)]
+        return [Server(name=srv) for srv in paginate(servers, first, after)]
+
+    def resolve_user_actions(self, info, pattern="*", first=None, skip=None,
+                             after=None):
+        """ This method fetches the user actions, newest first.
+
+        :param pattern: Pattern for filtering the devices.
+        :type pattern: str
+        :param first: Maximum number of actions.
+        :type first: int
+        :param after: Only the actions older than the one with this id.
+        :type after: int
 
         :return:  Log.
         :rtype: Log    
         """
-        result = user_actions.get(pattern)
-        if skip:
-            result = result[skip:]
-
-        if first:
-            result = result[:first]
-        
-        return result
+        return user_actions.get(pattern, first=first, after=after, skip=skip)
+
+    async def resolve_read_attributes(self, info, full_names,
+                                      encoding="json"):
+        """ This method reads attributes of any number of devices at once.
+
+        The attributes are grouped by device, and each device is read with
+        a single read_attributes call, all devices concurrently.
+
+        :param full_names: Names of the attributes, as "device/attribute".
+        :type full_names: list of str
+        :param encoding: Encoding of SPECTRUM and IMAGE values, "json"
+                         (default) or "base64" (see tangogql.arrays).
+        :type encoding: str
+
+        :return: A frame per attribute, in the same order. The frames of
+                 the attributes that could not be read have the error.
+        :rtype: List of AttributeFrame
+        """
+        # The attributes of each device, without duplicates
+        by_device = defaultdict(dict)
+        keys = [split_name(full_name) for full_name in full_names]
+        for device, attribute in keys:
+            if device:
+                by_device[device][attribute] = None
+        devices = [(device, list(attributes))
+                   for device, attributes in by_device.items()]
+        results = await asyncio.gather(*(reads.read(device, attributes)
+                                         for device, attributes in devices))
+        values = {(device, attribute): read
+                  for (device, attributes), result in zip(devices, results)
+                  for attribute, read in zip(attributes, result)}
+        frames = []
+        for full_name, (device, attribute) in zip(full_names, keys):
+            read = values.get((device, attribute))
+            if read is None:
+                frames.append(AttributeFrame(
+                    device=device, attribute=attribute,
+                    error=f"Invalid attribute name: {full_name}"))
+            elif isinstance(read, Exception):
+                frames.append(AttributeFrame(device=device,
+                                             attribute=attribute,
+                                             error=error_str(read)))
+            else:
+                frames.append(AttributeFrame(**encode_frame(
+                    format_frame(device, attribute, read), encoding)))
+        return frames
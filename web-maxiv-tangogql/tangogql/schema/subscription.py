@@ -1,13 +1,26 @@
 """Module containing the Subscription implementation."""
 
-import time
 import asyncio
-import taurus
-import PyTango
-import numpy
+import time
 
-from graphene import ObjectType, String, Float, Interface, Field, List, Int
+from graphene import ObjectType, String, Float, Field, List, Boolean, Int
 from tangogql.schema.types import ScalarTypes
+from tangogql.arrays import check_reduction
+from tangogql.schema.base import subscriptions
+from tangogql.listener import (Keeper, ChangeFilter, KEEP_ALIVE,
+                               SubscriptionOverflow, encode_frame)
+from tangogql.metrics import Counter, Gauge
+
+SUBSCRIBERS = Gauge("tangogql_subscribers",
+                    "Subscriptions currently active")
+FRAMES_SENT = Counter("tangogql_frames_sent_total",
+                      "Attribute frames sent to subscribers")
+FRAMES_DROPPED = Counter("tangogql_frames_dropped_total",
+                         "Attribute frames dropped for slow subscribers")
+
+# Websocket close code for the clients disconnected for being too slow
+# (policy violation)
+OVERFLOW_CLOSE_CODE = 1008
 
 
 class AttributeFrame(ObjectType):
@@ -18,56 +31,119 @@ class AttributeFrame(ObjectType):
     write_value = ScalarTypes()
     quality = String()
     timestamp = Float()
+    error = String()
 
     def resolve_full_name(self, info):
+        if not self.device:
+            return self.attribute
         return f"{self.device}/{self.attribute}"
 
 
-SLEEP_DURATION = 3.0
+async def subscribe_frames(full_names, changes_only=False, abs_change=None,
+                           rel_change=None, keep_alive=KEEP_ALIVE,
+                           encoding="json", roi=None, stride=None,
+                           max_points=None, connection=None):
+    """Generate batches of frames for the given attributes.
+
+    The attributes are read (or listened to) by the shared hub, so that
+    clients watching the same attributes share the upstream load.
+
+    :param changes_only: Only send frames carrying a change, see
+                         ChangeFilter.
+    :type changes_only: bool
+    :param encoding: Encoding of SPECTRUM and IMAGE values, "json"
+                     (default) or "base64" (see tangogql.arrays).
+    :type encoding: str
+    :param connection: The websocket connection of the client, closed
+                       (with OVERFLOW_CLOSE_CODE) when the client is too
+                       slow and the overflow policy is to disconnect it,
+                       together with its other subscriptions.
+
+    The roi, stride and max_points arguments reduce SPECTRUM and IMAGE
+    values, see tangogql.arrays.reduce_array.
+
+    :raises ValueError: If the stride or max_points are invalid, see
+                        tangogql.arrays.check_reduction.
+    :raises SubscriptionOverflow: When the client is too slow and the
+                                  overflow policy is to disconnect it.
+    """
+
+    # Rather than on the first SPECTRUM or IMAGE frame
+    check_reduction(stride, max_points)
+    keeper = Keeper(on_drop=FRAMES_DROPPED.inc)
+    changes = None
+    if changes_only:
+        changes = ChangeFilter(subscriptions, abs_change, rel_change,
+                               keep_alive)
+    subscriptions.subscribe(keeper, full_names)
+    SUBSCRIBERS.inc()
+    try:
+        while True:
+            if changes is None:
+                frames = await keeper.get_batch()
+            else:
+                frames = await keeper.get_batch(changes.timeout(time.time()))
+                now = time.time()
+                frames = changes.filter(frames, now) + \
+                    changes.keep_alives(now)
+            if frames:
+                FRAMES_SENT.inc(len(frames))
+                yield [AttributeFrame(**encode_frame(frame, encoding, roi,
+                                                     stride, max_points))
+                       for frame in frames]
+    except SubscriptionOverflow:
+        if connection is not None:
+            # Closing ends the operations of the connection, this one
+            # included: the close itself must not be cancelled
+            await asyncio.shield(connection.close(OVERFLOW_CLOSE_CODE))
+        raise
+    finally:
+        subscriptions.unsubscribe(keeper)
+        SUBSCRIBERS.dec()
+
+
+def _connection(info):
+    """The websocket connection of a subscription, see routes."""
+
+    context = info.context
+    if isinstance(context, dict):
+        return context.get("connection")
+    return None
 
 
 class Subscription(ObjectType):
-    attributes = Field(AttributeFrame, full_names=List(String, required=True))
-
-    async def resolve_attributes(self, info, full_names):
-        device_proxies = {}
-        name_pairs = []
-
-        for full_name in full_names:
-            *parts, attribute = full_name.split("/")
-            device = "/".join(parts)
-            device_proxies[device] = PyTango.DeviceProxy(device)
-            name_pairs.append((device, attribute))
-
-        while True:
-            try:
-                for device, attribute in name_pairs:
-                    try:
-                        proxy = device_proxies[device]
-                        read = await proxy.read_attribute(
-                            attribute, extract_as=PyTango.ExtractAs.List
-                        )
-                    except Exception:
-                        continue
-
-                    sec = read.time.tv_sec
-                    micro = read.time.tv_usec
-                    timestamp = sec + micro * 1e-6
-
-                    value = read.value
-                    write_value = read.w_value
-                    quality = read.quality.name
-
-                    yield AttributeFrame(
-                        device=device,
-                        attribute=attribute,
-                        value=value,
-                        write_value=write_value,
-                        quality=quality,
-                        timestamp=timestamp,
-                    )
-
-                await asyncio.sleep(SLEEP_DURATION)
-
-            except StopAsyncIteration:
-                break
+    attributes = Field(AttributeFrame,
+                       full_names=List(String, required=True),
+                       changes_only=Boolean(),
+                       abs_change=Float(),
+                       rel_change=Float(),
+                       keep_alive=Float(),
+                       encoding=String(),
+                       roi=List(Int),
+                       stride=Int(),
+                       max_points=Int())
+    attribute_frames = List(AttributeFrame,
+                            full_names=List(String, required=True),
+                            changes_only=Boolean(),
+                            abs_change=Float(),
+                            rel_change=Float(),
+                            keep_alive=Float(),
+                            encoding=String(),
+                            roi=List(Int),
+                            stride=Int(),
+                            max_points=Int())
+
+    async def resolve_attributes(self, info, full_names, **kwargs):
+        async for frames in subscribe_frames(full_names,
+                                             connection=_connection(info),
+                                             **kwargs):
+            for frame in frames:
+                yield frame
+
+    async def resolve_attribute_frames(self, info, full_names, **kwargs):
+        # Same as attributes, but all the frames of a polling cycle (or
+        # whatever else is pending) are sent together
+        async for frames in subscribe_frames(full_names,
+                                             connection=_connection(info),
+                                             **kwargs):
+            yield frames
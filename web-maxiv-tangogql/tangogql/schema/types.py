@@ -4,6 +4,10 @@ import math
 from graphene import String
 from graphene.types import Scalar
 from graphql.language import ast
+from PyTango import DevState
+
+# The types of the values that coerce_type returns as they are
+_UNCHANGED_TYPES = frozenset([str, int, bool, type(None), list, tuple, dict])
 
 class ScalarTypes(Scalar):
     """
@@ -21,13 +25,17 @@ class ScalarTypes(Scalar):
 
         :return: Value (any)
         """
+        # Called for every value of a response, so dispatch on the exact
+        # type first, the most common ones need no conversion
+        value_type = type(value)
+        if value_type in _UNCHANGED_TYPES:
+            return value
         # value of type DevState should return as string
-        if type(value).__name__ == "DevState":
+        if value_type is DevState:
             return str(value)
         # json don't have support on infinity
-        elif isinstance(value, float):
-            if math.isinf(value):
-                return str(value)
+        if isinstance(value, float) and math.isinf(value):
+            return str(value)
         return value
         
     # TODO: Check if the following static methods really need to be static.
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""JSON serialization of the responses.
+
+The responses are encoded straight to bytes, with orjson when it is
+installed, and the standard json module otherwise. The serializer can be
+chosen with the JSON_SERIALIZER environment variable ("orjson" or "json").
+
+orjson also encodes NumPy arrays natively, so array values don't need to
+be converted to lists of Python objects first (see the native argument of
+tangogql.arrays.format_array). Note that it encodes NaN and infinite floats
+as null, where the json module writes NaN and Infinity, which are not valid
+JSON anyway.
+"""
+
+import json
+import os
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['JSONSerializer', 'OrjsonSerializer', 'get_serializer',
+           'serializer']
+
+
+def _default(value):
+    """Encode the values that the serializers don't know."""
+
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    # E.g. PyTango.DevState
+    return str(value)
+
+
+class JSONSerializer(object):
+    """Serializer using the standard json module."""
+
+    name = "json"
+    # Whether NumPy arrays are encoded natively
+    numpy = False
+
+    def dumps(self, data):
+        """Encode data as JSON.
+
+        :rtype: bytes
+        """
+
+        return json.dumps(data, default=_default).encode("utf-8")
+
+    def loads(self, text):
+        """Decode JSON."""
+
+        return json.loads(text)
+
+
+class OrjsonSerializer(object):
+    """Serializer using orjson."""
+
+    name = "orjson"
+    numpy = True
+
+    def dumps(self, data):
+        """Encode data as JSON.
+
+        :rtype: bytes
+        """
+
+        return orjson.dumps(data, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, text):
+        """Decode JSON."""
+
+        return orjson.loads(text)
+
+
+def get_serializer(name=None):
+    """Return a serializer.
+
+    :param name: "orjson" or "json", by default orjson if it is installed.
+    :type name: str
+
+    :raises ValueError: If the serializer is unknown or not installed.
+    """
+
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "json":
+        return JSONSerializer()
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+        return OrjsonSerializer()
+    raise ValueError(f"Unknown serializer: {name}")
+
+
+serializer = get_serializer(os.environ.get("JSON_SERIALIZER"))
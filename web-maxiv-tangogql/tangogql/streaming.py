@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Streaming of large query results.
+
+A query like "devices { attributes { ... } }" on a big control system can
+take a long time and produce tens of MB of JSON, which is normally built
+completely before anything is sent. In streaming mode, the top level list
+fields that support pagination (STREAMABLE_FIELDS) are instead executed one
+page at a time, and each page is sent as soon as it is ready, as a line of
+newline delimited JSON (NDJSON). The server only holds one page at a time,
+and the client can render the items as they arrive.
+
+The lines follow the shape of the GraphQL incremental delivery payloads:
+
+    {"data": {"info": "...", "devices": []}, "hasNext": true}
+    {"items": [{...}, {...}], "path": ["devices", 0], "hasNext": true}
+    {"items": [{...}], "path": ["devices", 2], "hasNext": true}
+    {"hasNext": false, "extensions": {...}}
+
+The first line has the other top level fields, with the streamed lists
+empty. Each following line has the next items of a list, with its index in
+"path". Errors are reported in the line of the page they happened in.
+"""
+
+import copy
+import os
+
+from graphql.language import ast
+
+__all__ = ['STREAMABLE_FIELDS', 'StreamPlan', 'plan_stream', 'stream_query']
+
+# Number of items per page
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", 50))
+
+# The top level fields that can be streamed, with the field used as cursor
+# and the AST type of the "after" argument
+STREAMABLE_FIELDS = {
+    "devices": ("name", ast.StringValue),
+    "members": ("name", ast.StringValue),
+    "servers": ("name", ast.StringValue),
+    "userActions": ("id", ast.IntValue),
+}
+
+# Alias of the cursor field added to the streamed items
+CURSOR = "_cursor"
+
+
+class StreamPlan(object):
+    """How a query is split into a head query and streamed fields.
+
+    :param document: The document, with only the operation to execute.
+    :param head: The top level selections that are executed at once.
+    :param streamed: The top level fields that are streamed, in order.
+    """
+
+    def __init__(self, document, operation, head, streamed):
+        self.document = document
+        self.operation = operation
+        self.head = head
+        self.streamed = streamed
+
+
+def _operation(document, operation_name):
+    operations = [definition for definition in document.definitions
+                  if isinstance(definition, ast.OperationDefinition)]
+    if operation_name is not None:
+        operations = [operation for operation in operations
+                      if operation.name is not None and
+                      operation.name.value == operation_name]
+    return operations[0] if len(operations) == 1 else None
+
+
+def plan_stream(document, operation_name=None):
+    """Split a query into what is executed at once and what is streamed.
+
+    :param document: The parsed query.
+    :type document: graphql.language.ast.Document
+    :param operation_name: The operation to execute.
+    :type operation_name: str
+
+    :return: The plan, or None if nothing in the query can be streamed
+             (e.g. a mutation), and it should be executed normally.
+    :rtype: StreamPlan
+    """
+
+    operation = _operation(document, operation_name)
+    if operation is None or operation.operation != "query":
+        return None
+    head = []
+    streamed = []
+    for selection in operation.selection_set.selections:
+        if (isinstance(selection, ast.Field) and
+                selection.name.value in STREAMABLE_FIELDS and
+                selection.selection_set is not None):
+            streamed.append(selection)
+        else:
+            head.append(selection)
+    if not streamed:
+        return None
+    return StreamPlan(document, operation, head, streamed)
+
+
+def _document(plan, selections):
+    """A copy of the document, with only these top level selections."""
+
+    operation = copy.copy(plan.operation)
+    operation.selection_set = ast.SelectionSet(selections=selections)
+    definitions = [operation if definition is plan.operation else definition
+                   for definition in plan.document.definitions
+                   if not isinstance(definition, ast.OperationDefinition) or
+                   definition is plan.operation]
+    return ast.Document(definitions=definitions)
+
+
+def _argument_value(field, name, variables):
+    for argument in field.arguments or []:
+        if argument.name.value == name:
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                return (variables or {}).get(value.name.value)
+            if isinstance(value, ast.IntValue):
+                return int(value.value)
+            if isinstance(value, ast.StringValue):
+                return value.value
+    return None
+
+
+def _page_field(field, first, after, skip=True):
+    """A copy of a streamed field, fetching one page with its cursor.
+
+    :param skip: Keep the "skip" argument, which only applies to the first
+                 page: the cursor of the following pages is past it.
+    :type skip: bool
+    """
+
+    cursor_field, after_type = STREAMABLE_FIELDS[field.name.value]
+    page = copy.copy(field)
+    replaced = ("first", "after") if skip else ("first", "after", "skip")
+    arguments = [argument for argument in field.arguments or []
+                 if argument.name.value not in replaced]
+    arguments.append(ast.Argument(name=ast.Name("first"),
+                                  value=ast.IntValue(str(first))))
+    if after is not None:
+        arguments.append(ast.Argument(name=ast.Name("after"),
+                                      value=after_type(str(after))))
+    page.arguments = arguments
+    cursor = ast.Field(alias=ast.Name(CURSOR), name=ast.Name(cursor_field))
+    page.selection_set = ast.SelectionSet(
+        selections=list(field.selection_set.selections) + [cursor])
+    return page
+
+
+async def stream_query(plan, execute, variables=None,
+                       page_size=STREAM_PAGE_SIZE):
+    """Execute a query in pages, yielding the payloads to send.
+
+    :param plan: The plan, from plan_stream.
+    :type plan: StreamPlan
+    :param execute: Coroutine function executing a document, returning
+                    the ExecutionResult.
+    :param variables: The variables of the query.
+    :type variables: dict
+    :param page_size: Number of items per page.
+    :type page_size: int
+
+    :return: The payloads, as dicts of "data", "items", "path", "errors"
+             and "hasNext".
+    """
+
+    data = {}
+    head = {"data": data, "hasNext": True}
+    if plan.head:
+        result = await execute(_document(plan, plan.head))
+        data.update(result.data or {})
+        if result.errors:
+            head["errors"] = result.errors
+    for field in plan.streamed:
+        data[(field.alias or field.name).value] = []
+    yield head
+
+    for field in plan.streamed:
+        key = (field.alias or field.name).value
+        remaining = _argument_value(field, "first", variables)
+        after = _argument_value(field, "after", variables)
+        index = 0
+        while remaining is None or remaining > 0:
+            first = page_size if remaining is None else min(page_size,
+                                                            remaining)
+            result = await execute(_document(
+                plan, [_page_field(field, first, after, skip=index == 0)]))
+            items = (result.data or {}).get(key) or []
+            for item in items:
+                after = item.pop(CURSOR, None)
+            payload = {"items": items, "path": [key, index],
+                       "hasNext": True}
+            if result.errors:
+                payload["errors"] = result.errors
+            if items or result.errors:
+                yield payload
+            if len(items) < first or result.errors:
+                break
+            index += len(items)
+            if remaining is not None:
+                remaining -= len(items)
@@ -2,69 +2,469 @@
 
 """
 A simple caching layer on top of a TANGO database.
+
+The TANGO database calls are blocking, so they are run in a bounded thread
+pool and exposed as coroutines, keeping the event loop responsive.
 """
 
+import asyncio
+import logging
+import os
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-from tango import Database, DeviceProxy, GreenMode
+from tango import Database, DeviceProxy, GreenMode, Except
 
+from tangogql.metrics import Counter, Histogram
 from tangogql.ttldict import TTLDict
 
+# Number of threads running the blocking database calls
+DB_THREADS = int(os.environ.get("DB_THREADS", 4))
+
+# Number of threads, and timeout (in seconds), for the blocking device
+# proxy calls, and the maximum number of threads the calls to one device
+# may take
+PROXY_THREADS = int(os.environ.get("PROXY_THREADS", 8))
+PROXY_TIMEOUT = float(os.environ.get("PROXY_TIMEOUT", 3))
+PROXY_CALLS_PER_DEVICE = int(os.environ.get("PROXY_CALLS_PER_DEVICE", 2))
+
+# Maximum number of cached results per database method, and how long (in
+# seconds) an expired result may still be served while it is refreshed
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", 10000))
+DB_CACHE_STALE = float(os.environ.get("DB_CACHE_STALE", 0))
+
+# How long (in seconds) database results are cached, and how often the
+# database history is checked for property changes made by others (0 to
+# never check)
+DB_CACHE_TTL = float(os.environ.get("DB_CACHE_TTL", 10))
+DB_PROBE_PERIOD = float(os.environ.get("DB_PROBE_PERIOD", 0))
+
+# The 'get' methods that are not cached: status output, e.g. the server
+# counts and uptimes of get_info, must be current
+UNCACHED_METHODS = frozenset(["get_info"])
+
+# The history tables recording property changes, with the devices whose
+# properties changed after a given date
+HISTORY_TABLES = ("property_device_hist", "property_attribute_device_hist")
+HISTORY_QUERY = ("SELECT device, MAX(date) FROM {table}"
+                 " WHERE date > '{since}' GROUP BY device")
+HISTORY_START = "SELECT MAX(date) FROM {table}"
+
+logger = logging.getLogger('logger')
+
+DB_CALL_SECONDS = Histogram(
+    "tangogql_db_call_seconds",
+    "Duration of the TANGO database calls (not cached), by method",
+    labels=("method",))
+PROXY_CREATE_SECONDS = Histogram(
+    "tangogql_proxy_create_seconds",
+    "Duration of the creation of device proxies")
+PROXY_TIMEOUTS = Counter(
+    "tangogql_proxy_timeouts_total",
+    "Blocking device proxy calls given up after PROXY_TIMEOUT")
+
+
+def _same_args(args, prefix):
+    """Whether call arguments start with the given ones.
 
-class CachedMethod(object):
-    """A cached wrapper for a DB method."""
+    Strings are compared case insensitively, like TANGO names.
+    """
 
-    def __init__(self, method, ttl=10):
-        self.cache = TTLDict(default_ttl=ttl)
+    if len(args) < len(prefix):
+        return False
+    for arg, expected in zip(args, prefix):
+        if isinstance(arg, str) and isinstance(expected, str):
+            if arg.lower() != expected.lower():
+                return False
+        elif arg != expected:
+            return False
+    return True
+
+
+def split_rows(result):
+    """Split the result of a DbMySqlSelect command into rows."""
+
+    lvalue, svalue = result
+    columns = lvalue[-1]
+    return [svalue[row * columns:(row + 1) * columns]
+            for row in range(lvalue[-2])]
+
+
+class DatabaseMethod(object):
+    """An awaitable wrapper for a DB method, run in a thread pool."""
+
+    def __init__(self, method, executor, name=None):
         self.method = method
+        self.executor = executor
+        self._seconds = DB_CALL_SECONDS.labels(
+            name or getattr(method, "__name__", "unknown"))
+
+    async def __call__(self, *args):
+        loop = asyncio.get_event_loop()
+        with self._seconds.time():
+            return await loop.run_in_executor(self.executor, self.method,
+                                              *args)
+
+
+class CachedMethod(DatabaseMethod):
+    """A cached wrapper for a DB method.
 
-    def __call__(self, *args):
-        if args in self.cache:
-            return self.cache[args]
-        value = self.method(*args)
-        self.cache[args] = value
+    Concurrent calls with the same arguments share a single database call.
+    A result that expired less than stale_ttl seconds ago is returned
+    immediately, while it is refreshed in the background.
+    """
+
+    def __init__(self, method, executor, ttl=10, max_entries=DB_CACHE_SIZE,
+                 stale_ttl=DB_CACHE_STALE, name=None):
+        super().__init__(method, executor, name)
+        self.cache = TTLDict(default_ttl=ttl, max_entries=max_entries,
+                             stale_ttl=stale_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._loading = {}
+        self._generation = 0
+
+    async def __call__(self, *args):
+        try:
+            value, fresh = self.cache.get_entry(args)
+        except KeyError:
+            self.misses += 1
+            return await asyncio.shield(self._load(args))
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            future = self._load(args)
+            # Nobody awaits a background refresh, don't warn about its errors
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception())
         return value
 
+    def _load(self, args):
+        if args not in self._loading:
+            future = asyncio.ensure_future(
+                self._fetch(args, self._generation))
+            future.add_done_callback(partial(self._loaded, args))
+            self._loading[args] = future
+        return self._loading[args]
+
+    def _loaded(self, args, future):
+        # An invalidation may have replaced the load in the meantime
+        if self._loading.get(args) is future:
+            del self._loading[args]
+
+    async def _fetch(self, args, generation):
+        value = await super().__call__(*args)
+        if generation == self._generation:
+            # Don't cache a result that may predate an invalidation
+            self.cache[args] = value
+        return value
+
+    def invalidate(self, *prefix):
+        """Forget the cached results of calls starting with the arguments.
+
+        Without arguments, everything is forgotten. Calls in progress are
+        not cached when they complete, and are not shared with later calls.
+        """
+
+        self._generation += 1
+        self.cache.remove_if(lambda args: _same_args(args, prefix))
+        for args in list(self._loading):
+            if _same_args(args, prefix):
+                del self._loading[args]
+
 
 class CachedDatabase(object):
-    """A TANGO database wrapper that caches 'get' methods."""
+    """A TANGO database wrapper that caches 'get' methods (but for the
+    UNCACHED_METHODS).
 
-    _db = Database()
-    _methods = {}
+    All the methods are coroutines.
 
-    def __init__(self, ttl):
+    :param database: The database to wrap, by default the one of TANGO_HOST,
+                     connected to on first use.
+    :type database: PyTango.Database
+    """
+
+    def __init__(self, ttl=DB_CACHE_TTL, threads=DB_THREADS, database=None):
+        self._database = database
         self._ttl = ttl
+        self._executor = ThreadPoolExecutor(threads)
+        self._methods = {}
+        self._listeners = []
+        self._history = {}
+
+    @property
+    def database(self):
+        """The wrapped database.
+
+        Replacing it (e.g. with a simulated one) forgets the cached results.
+        """
+
+        if self._database is None:
+            self._database = Database()
+        return self._database
+
+    @database.setter
+    def database(self, database):
+        self._database = database
+        self._methods.clear()
 
     def __getattr__(self, method):
-        if not method.startswith("get_"):
-            # caching 'set' methods doesn't make any sense anyway
-            # TODO: check that this really catches the right methods
-            return getattr(self._db, method)
+        if method.startswith("_"):
+            # Not a database method, e.g. looked up before __init__
+            raise AttributeError(method)
         if method not in self._methods:
-            self._methods[method] = CachedMethod(getattr(self._db, method),
-                                                 ttl=self._ttl)
+            if method.startswith("get_") and \
+                    method not in UNCACHED_METHODS:
+                self._methods[method] = CachedMethod(
+                    getattr(self.database, method), self._executor,
+                    ttl=self._ttl, name=method)
+            else:
+                # caching 'set' methods doesn't make any sense anyway
+                # TODO: check that this really catches the right methods
+                self._methods[method] = DatabaseMethod(
+                    getattr(self.database, method), self._executor,
+                    name=method)
         return self._methods[method]
 
+    def cache_stats(self):
+        """Return the hits, misses and stale hits of each cached method.
+
+        :rtype: dict
+        """
+
+        return {name: {"hits": method.hits, "misses": method.misses,
+                       "stale": method.stale_hits,
+                       "entries": len(method.cache)}
+                for name, method in self._methods.items()
+                if isinstance(method, CachedMethod)}
+
+    async def select(self, query):
+        """Run an SQL query on the database, with the DbMySqlSelect command.
+
+        :param query: The SELECT query.
+        :type query: str
+
+        :return: The rows, each a list of strings.
+        :rtype: list
+
+        :raises PyTango.DevFailed: If the database does not allow it.
+        """
+
+        return split_rows(await self.command_inout("DbMySqlSelect", query))
+
+    def add_invalidation_listener(self, callback):
+        """Call a function whenever cached results are invalidated.
+
+        :param callback: Called with the method name and the argument
+                         prefix given to invalidate.
+        """
+
+        self._listeners.append(callback)
+
+    def invalidate(self, method, *prefix):
+        """Forget the cached results of a method.
+
+        :param method: Name of the method, e.g. "get_device_property".
+        :type method: str
+        :param prefix: Only forget the calls starting with these arguments.
+        """
+
+        cached = self._methods.get(method)
+        if isinstance(cached, CachedMethod):
+            cached.invalidate(*prefix)
+        for callback in self._listeners:
+            callback(method, prefix)
+
+    def invalidate_device(self, device):
+        """Forget the cached results of the calls about a device.
+
+        :param device: Name of the device.
+        :type device: str
+        """
+
+        for method, cached in list(self._methods.items()):
+            if isinstance(cached, CachedMethod):
+                self.invalidate(method, device)
+
+    def invalidate_device_properties(self, device):
+        """Forget the cached properties of a device, after changing them.
+
+        :param device: Name of the device.
+        :type device: str
+        """
+
+        self.invalidate("get_device_property", device)
+        self.invalidate("get_device_property_list", device)
+
+    async def probe_changes(self):
+        """Invalidate the devices whose properties changed since last time.
+
+        The changes are found in the database history tables, so this
+        includes the changes made by other clients, e.g. Jive.
+
+        :return: The names of the devices that changed.
+        :rtype: set of str
+        """
+
+        changed = set()
+        for table in HISTORY_TABLES:
+            since = self._history.get(table)
+            if since is None:
+                # First probe, only look for later changes
+                rows = await self.select(HISTORY_START.format(table=table))
+                self._history[table] = (rows and rows[0][0]) or "1970-01-01"
+                continue
+            rows = await self.select(
+                HISTORY_QUERY.format(table=table, since=since))
+            for device, date in rows:
+                changed.add(device)
+                self._history[table] = max(self._history[table], date)
+        for device in changed:
+            self.invalidate_device(device)
+        return changed
+
+    async def watch_changes(self, period=DB_PROBE_PERIOD):
+        """Run probe_changes periodically, forever.
+
+        :param period: Seconds between probes.
+        :type period: float
+        """
+
+        while True:
+            try:
+                changed = await self.probe_changes()
+                if changed:
+                    logger.debug(f"Properties changed for {len(changed)}"
+                                 " devices, invalidated")
+            except Exception as error:
+                logger.warning(f"Could not probe the database history:"
+                               f" {error}")
+            await asyncio.sleep(period)
+
+
+class _DeviceCalls(object):
+    """The calls of one device, running or waiting to run."""
+
+    def __init__(self, size):
+        self.slots = asyncio.Semaphore(max(1, size))
+        self.users = 0
+
 
 class DeviceProxyCache(object):
-    """Keep a limited cache of device proxies that are reused."""
+    """Keep a limited cache of device proxies that are reused.
+
+    Creating a proxy and the metadata queries on it are blocking calls that
+    can hang for the whole CORBA timeout on an unreachable device, so they
+    run in a thread pool and are given up after a timeout.
+
+    A call that was given up still holds its thread until the device
+    answers, as threads can not be interrupted. So that a few unresponsive
+    devices cannot take all the threads, at most calls_per_device calls of
+    each device run at once, the others wait for one of them to finish
+    (within the same timeout).
+    """
     # TODO: does this actually work? Are the proxies really cleaned up
     # by PyTango after they are deleted?
 
-    def __init__(self, max_proxies=100):
+    def __init__(self, max_proxies=100, timeout=PROXY_TIMEOUT,
+                 threads=PROXY_THREADS, factory=None,
+                 calls_per_device=PROXY_CALLS_PER_DEVICE):
         self.max_proxies = max_proxies
+        self.calls_per_device = calls_per_device
+        # Creates the (asyncio) proxy of a device name, in the thread pool
+        self.factory = factory or partial(DeviceProxy,
+                                          green_mode=GreenMode.Asyncio)
+        self.timeout = timeout
+        self.evictions = 0
         self._device_proxies = OrderedDict()
+        self._pending = {}
+        self._running = {}
+        self._executor = ThreadPoolExecutor(threads)
 
-    def get(self, devname):
+    def __len__(self):
+        return len(self._device_proxies)
+
+    async def get(self, devname):
         if devname in self._device_proxies:
             # Proxy to this device already exists
             proxy = self._device_proxies.pop(devname)
             self._device_proxies[devname] = proxy  # putting it first
             return proxy
-        # Unknown device; let's create a new proxy
-        proxy = DeviceProxy(devname, green_mode=GreenMode.Asyncio)
-        if len(self._device_proxies) == self.max_proxies:
+        # Unknown device; let's create a new proxy, only once even if
+        # several requests want it at the same time
+        if devname not in self._pending:
+            self._pending[devname] = asyncio.ensure_future(
+                self._create(devname))
+        return await asyncio.shield(self._pending[devname])
+
+    async def _create(self, devname):
+        try:
+            with PROXY_CREATE_SECONDS.time():
+                proxy = await self.call(devname, self.factory, devname)
+        finally:
+            del self._pending[devname]
+        if len(self._device_proxies) >= self.max_proxies:
             # delete the oldest proxy last = False means FIFO
             self._device_proxies.popitem(last=False)
+            self.evictions += 1
         self._device_proxies[devname] = proxy
         return proxy
+
+    async def call(self, devname, method, *args, **kwargs):
+        """Run a blocking call for a device in the thread pool.
+
+        :param devname: Name of the device, for the error message.
+        :type devname: str
+        :param method: The blocking callable, e.g. proxy.info.
+
+        :raises PyTango.DevFailed: API_DeviceTimedOut, if the call did not
+                                   return within the timeout (including the
+                                   time waiting for the other calls of the
+                                   device). The call keeps its thread until
+                                   it returns, all the same.
+        """
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+        running = self._running.get(devname)
+        if running is None:
+            running = self._running[devname] = _DeviceCalls(
+                self.calls_per_device)
+        running.users += 1
+        try:
+            await asyncio.wait_for(running.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._release(devname, running, slot=False)
+            self._timed_out(devname)
+        except BaseException:
+            self._release(devname, running, slot=False)
+            raise
+        future = loop.run_in_executor(self._executor,
+                                      partial(method, *args, **kwargs))
+        # The slot is only free once the thread is
+        future.add_done_callback(
+            lambda _: self._release(devname, running, slot=True))
+        try:
+            # Shielded, as cancelling would release the slot too early
+            return await asyncio.wait_for(asyncio.shield(future),
+                                          max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self._timed_out(devname)
+
+    def _release(self, devname, running, slot):
+        if slot:
+            running.slots.release()
+        running.users -= 1
+        if not running.users and self._running.get(devname) is running:
+            del self._running[devname]
+
+    def _timed_out(self, devname):
+        PROXY_TIMEOUTS.inc()
+        Except.throw_exception(
+            "API_DeviceTimedOut",
+            f"Timeout ({self.timeout} s) waiting for device {devname}",
+            "DeviceProxyCache.call")
+
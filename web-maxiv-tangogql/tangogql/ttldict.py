@@ -4,63 +4,109 @@
 TTL dictionary
 
 Tricks / features:
- - calling len() will remove expired keys
+ - expired keys are removed lazily, using a heap ordered by expiry time, so
+   len() and iteration only pay for the keys that actually expired
+ - the size can be bounded by a number of entries and/or an (approximate)
+   number of bytes, the least recently used entries are evicted first
+ - expired entries can be kept a little longer as "stale", to be served
+   while they are being refreshed (see get_entry)
  - __repr__() might show expired values, doesn't remove expired ones
 """
 
-__all__ = ['TTLDict']
-__version__ = '0.0.4'
+__all__ = ['TTLDict', 'approximate_size']
+__version__ = '0.1.0'
 
-from collections import MutableMapping
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from heapq import heappush, heappop, heapify
+from itertools import count
 from threading import RLock
+import sys
 import time
 
 
+def approximate_size(value):
+    """Approximate memory size of a value, in bytes.
+
+    Containers are counted with their direct items, which is enough for the
+    lists of strings returned by the TANGO database.
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v)
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
 class TTLDict(MutableMapping):
     """
     Dictionary with TTL
     Extra args and kwargs are passed to initial .update() call
+
+    :param default_ttl: Seconds before a key expires, None for never.
+    :param max_entries: Maximum number of keys, None for no limit.
+    :param max_bytes: Maximum approximate size of the values, None for no
+                      limit.
+    :param stale_ttl: Seconds an expired key is kept as stale.
+    :param sizeof: Function computing the size of a value.
     """
-    def __init__(self, default_ttl, *args, **kwargs):
+    def __init__(self, default_ttl, *args, max_entries=None, max_bytes=None,
+                 stale_ttl=0, sizeof=approximate_size, **kwargs):
         self._default_ttl = default_ttl
-        self._values = {}
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._stale_ttl = stale_ttl
+        self._sizeof = sizeof
+        # key -> (expire, value, size), in least recently used order
+        self._values = OrderedDict()
+        # (expire, sequence, key), may contain outdated entries
+        self._heap = []
+        self._sequence = count()
+        self._bytes = 0
         self._lock = RLock()
+        self.evictions = 0
         self.update(*args, **kwargs)
 
     def __repr__(self):
-        return f""
-        return '<TTLDict@%#08x; ttl=%r, v=%r;>' % (id(self),
-                                                   self._default_ttl,
-                                                   self._values)
+        return '<TTLDict@%#08x; ttl=%r, v=%r;>' % (
+            id(self), self._default_ttl,
+            {key: value for key, (_, value, _) in self._values.items()})
+
+    @property
+    def size_bytes(self):
+        """Approximate size of the values, in bytes."""
+        return self._bytes
 
     def set_ttl(self, key, ttl, now=None):
         """ Set TTL for the given key """
         if now is None:
             now = time.time()
-        with self._lock:
-            _expire, value = self._values[key]
-            self._values[key] = (now + ttl, value)
+        self.expire_at(key, now + ttl)
 
     def get_ttl(self, key, now=None):
         """ Return remaining TTL for a key """
         if now is None:
             now = time.time()
         with self._lock:
-            expire, _value = self._values[key]
+            expire, _value, _size = self._values[key]
             return expire - now
 
     def expire_at(self, key, timestamp):
         """ Set the key expire timestamp """
         with self._lock:
-            _expire, value = self._values[key]
-            self._values[key] = (timestamp, value)
+            _expire, value, size = self._values[key]
+            self._values[key] = (timestamp, value, size)
+            self._push(timestamp, key)
 
     def is_expired(self, key, now=None, remove=False):
         """ Check if key has expired """
         with self._lock:
             if now is None:
                 now = time.time()
-            expire, _value = self._values[key]
+            expire, _value, _size = self._values[key]
             if expire is None:
                 return False
             expired = expire < now
@@ -68,17 +114,93 @@ class TTLDict(MutableMapping):
                 self.__delitem__(key)
             return expired
 
+    def get_entry(self, key, now=None):
+        """Return the value of a key and whether it is still fresh.
+
+        Expired keys are returned (as not fresh) during stale_ttl seconds.
+
+        :raises KeyError: If the key is missing, or expired for longer.
+        :rtype: tuple
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.purge(now)
+            expire, value, _size = self._values[key]
+            self._values.move_to_end(key)
+            return value, expire is None or expire >= now
+
+    def purge(self, now=None):
+        """Remove the keys that are expired (and no longer stale)."""
+        if now is None:
+            now = time.time()
+        limit = now - self._stale_ttl
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] < limit:
+                expire, _, key = heappop(heap)
+                entry = self._values.get(key)
+                # Skip heap entries outdated by a later set/expire_at
+                if entry is not None and entry[0] == expire:
+                    self.__delitem__(key)
+
+    def clear(self):
+        """ Remove all the keys """
+        with self._lock:
+            self._values.clear()
+            self._heap = []
+            self._bytes = 0
+
+    def remove_if(self, predicate):
+        """Remove the keys, stale ones included, matching a predicate.
+
+        :return: The number of keys removed.
+        """
+        with self._lock:
+            keys = [key for key in self._values if predicate(key)]
+            for key in keys:
+                self.__delitem__(key)
+            return len(keys)
+
+    def _push(self, expire, key):
+        if expire is None:
+            return
+        heappush(self._heap, (expire, next(self._sequence), key))
+        if len(self._heap) > 2 * len(self._values) + 64:
+            # Too many outdated entries, rebuild the heap
+            self._heap = [(entry[0], next(self._sequence), k)
+                          for k, entry in self._values.items()
+                          if entry[0] is not None]
+            heapify(self._heap)
+
+    def _evict(self):
+        while self._values and (
+                (self._max_entries is not None and
+                 len(self._values) > self._max_entries) or
+                (self._max_bytes is not None and
+                 self._bytes > self._max_bytes)):
+            _key, (_expire, _value, size) = self._values.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
     def __len__(self):
         with self._lock:
-            for key in self._values.keys():
-                self.is_expired(key, remove=True)
+            self.purge()
             return len(self._values)
 
     def __iter__(self):
         with self._lock:
-            for key in self._values.keys():
-                if not self.is_expired(key, remove=True):
-                    yield key
+            now = time.time()
+            self.purge(now)
+            keys = [key for key, (expire, _, _) in self._values.items()
+                    if expire is None or expire >= now]
+        return iter(keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._values:
+                return False
+            return not self.is_expired(key)
 
     def __setitem__(self, key, value):
         with self._lock:
@@ -86,13 +208,21 @@ class TTLDict(MutableMapping):
                 expire = None
             else:
                 expire = time.time() + self._default_ttl
-            self._values[key] = (expire, value)
+            size = self._sizeof(value) if self._max_bytes is not None else 0
+            if key in self._values:
+                self._bytes -= self._values.pop(key)[2]
+            self._values[key] = (expire, value, size)
+            self._bytes += size
+            self._push(expire, key)
+            self._evict()
 
     def __delitem__(self, key):
         with self._lock:
-            del self._values[key]
+            _expire, _value, size = self._values.pop(key)
+            self._bytes -= size
 
     def __getitem__(self, key):
         with self._lock:
             self.is_expired(key, remove=True)
+            self._values.move_to_end(key)
             return self._values[key][1]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Running the server as several worker processes.
+
+A single process executes all the queries, encodes all the responses and
+converts all the arrays on one core. With WORKERS set to more than 1, the
+server instead starts:
+
+- a broker process (see tangogql.broker), owning the single upstream
+  subscription of each attribute,
+- WORKERS worker processes, each running the whole server, all listening
+  on the same port with SO_REUSEPORT, so that the kernel spreads the
+  connections between them.
+
+The supervisor (the process that was started) restarts the processes that
+die. On SIGHUP, it restarts the workers one at a time: a new worker is
+started and is ready before the old one is stopped, so the port is never
+left unserved. A worker being stopped (with SIGTERM) stops accepting
+connections and lets the requests in progress finish, for at most
+WORKER_SHUTDOWN_TIMEOUT seconds. SIGTERM or SIGINT stop everything.
+
+Each worker keeps its own caches, including the DeviceTree, which it
+refreshes from the database every DEVICE_TREE_REFRESH seconds: the load
+on the database grows with the number of workers, so consider a longer
+refresh period with many of them. Each worker logs to its own file, named
+after the worker (see tangogql.aioserver.setup).
+
+The processes are started fresh ("spawn"), rather than forked, since the
+TANGO client library does not survive a fork.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+logger = logging.getLogger('logger')
+
+__all__ = ['Supervisor', 'WORKERS']
+
+# Number of worker processes, 1 to run in a single process
+WORKERS = int(os.environ.get("WORKERS", 1))
+
+# Time (in seconds) a stopped worker has to finish its requests
+SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", 10))
+
+# Time (in seconds) a new worker has to get ready
+READY_TIMEOUT = 60.0
+
+# Minimum time (in seconds) between two starts of the same process
+RESTART_DELAY = 1.0
+
+# Period (in seconds) of the checks of the processes
+CHECK_PERIOD = 0.5
+
+
+def worker_main(index, ready):
+    """Entry point of a worker process."""
+
+    os.environ["WORKER_ID"] = str(index)
+    # Hangups are for the supervisor
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    from tangogql import aioserver
+    aioserver.run(reuse_port=True, ready=ready)
+
+
+def broker_main(path):
+    """Entry point of the broker process."""
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    from tangogql import broker
+    broker.main(path)
+
+
+class _Process(object):
+    """A supervised process."""
+
+    def __init__(self, name, process, ready=None):
+        self.name = name
+        self.process = process
+        self.ready = ready
+        self.started = time.monotonic()
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Terminate the process gracefully, kill it if it takes too long."""
+
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout + 5)
+        if self.process.is_alive():
+            logger.warning(f"{self.name} did not stop, killing it")
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join()
+
+
+class Supervisor(object):
+    """Start and watch over the broker and the workers.
+
+    :param workers: Number of worker processes.
+    :type workers: int
+    :param socket_path: Path of the Unix socket of the broker, by default
+                        in a new private directory.
+    :type socket_path: str
+    """
+
+    def __init__(self, workers=WORKERS, socket_path=None):
+        self.count = workers
+        self.socket_path = socket_path
+        self._context = multiprocessing.get_context("spawn")
+        self._broker = None
+        self._workers = []
+        self._stopping = False
+        self._restarting = False
+
+    def run(self):
+        """Run until SIGTERM or SIGINT, return the exit status."""
+
+        if self.socket_path is None:
+            directory = tempfile.mkdtemp(prefix="tangogql-")
+            self.socket_path = os.path.join(directory, "broker.sock")
+        # Inherited by the processes started from now on
+        os.environ["BROKER_SOCKET"] = self.socket_path
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+
+        self._broker = self._start_broker()
+        self._workers = [self._start_worker(index)
+                         for index in range(self.count)]
+        logger.info(f"Started {self.count} workers, broker on "
+                    f"{self.socket_path}")
+        try:
+            while True:
+                time.sleep(CHECK_PERIOD)
+                if self._stopping:
+                    break
+                if self._restarting:
+                    self._restarting = False
+                    self.restart()
+                self._check()
+        finally:
+            for worker in self._workers:
+                worker.stop()
+            self._broker.stop()
+        return 0
+
+    def restart(self):
+        """Replace the workers one at a time."""
+
+        logger.info("Restarting the workers")
+        for index, old in enumerate(self._workers):
+            if self._stopping:
+                return
+            new = self._start_worker(index)
+            if not new.ready.wait(READY_TIMEOUT):
+                logger.error(f"{new.name} did not get ready, keeping the "
+                             f"old one")
+                new.stop()
+                continue
+            self._workers[index] = new
+            old.stop()
+
+    def _check(self):
+        """Start again the processes that died."""
+
+        now = time.monotonic()
+        if not self._broker.process.is_alive() and \
+                now - self._broker.started > RESTART_DELAY:
+            logger.error(f"The broker died (exit code "
+                         f"{self._broker.process.exitcode}), restarting it")
+            self._broker = self._start_broker()
+        for index, worker in enumerate(self._workers):
+            if not worker.process.is_alive() and \
+                    now - worker.started > RESTART_DELAY:
+                logger.error(f"{worker.name} died (exit code "
+                             f"{worker.process.exitcode}), restarting it")
+                self._workers[index] = self._start_worker(index)
+
+    def _start_broker(self):
+        process = self._context.Process(target=broker_main,
+                                        args=(self.socket_path,),
+                                        name="tangogql-broker")
+        process.start()
+        return _Process("The broker", process)
+
+    def _start_worker(self, index):
+        ready = self._context.Event()
+        process = self._context.Process(target=worker_main,
+                                        args=(index, ready),
+                                        name=f"tangogql-worker-{index}")
+        process.start()
+        return _Process(f"Worker {index}", process, ready)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _restart(self, signum, frame):
+        self._restarting = True
@@ -4,6 +4,15 @@ single_device_name = '''query{device(name: "sys/tg_test/1"){name}}'''
 
 device_state = """query{devices(pattern: "sys/tg_test/1"){state}}"""
 
+read_attributes = """query{readAttributes(fullNames: ["sys/tg_test/1/ampli", "sys/tg_test/1/double_scalar", "sys/tg_test/1/no_such_attribute"]){
+                                    fullName,
+                                    device,
+                                    attribute,
+                                    value,
+                                    quality,
+                                    timestamp,
+                                    error}}"""
+
 device_properties = """query{devices(pattern: "sys/tg_test/1"){properties(pattern:"Do_not_remove_this"){name,device,value}}}"""
 
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""Tests for the server and its HTTP endpoints."""
+
+import asyncio
+import json
+import time
+
+from aiohttp import test_utils
+
+from benchmarks.fake_tango import FakeTango
+from tangogql import aioserver, routes
+from tangogql.schema import base
+from tangogql.schema.loaders import Loaders
+from tangogql.tangodb import PROXY_TIMEOUT
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestServer(object):
+
+    def setup_method(self):
+        self.factories = (base.proxies.factory,
+                          getattr(base.subscriptions, "proxy_factory", None))
+        FakeTango(devices=2, latency=0, db_latency=0).install()
+
+    def teardown_method(self):
+        base.db.database = None
+        base.proxies.factory, proxy_factory = self.factories
+        if proxy_factory is not None:
+            base.subscriptions.proxy_factory = proxy_factory
+
+    def test_startup_and_cleanup(self):
+        app = aioserver.setup_server()
+        runner = run(aioserver.start(app, "127.0.0.1", 0))
+        tasks = [app[name] for name in ("device_tree", "loop_lag")
+                 if name in app]
+        assert tasks
+        assert not any(task.done() for task in tasks)
+        run(runner.cleanup())
+        run(asyncio.sleep(0))
+        assert all(task.cancelled() for task in tasks)
+
+    def test_bad_requests(self):
+        loop = asyncio.get_event_loop()
+        server = test_utils.TestServer(aioserver.setup_server(), loop=loop)
+        client = test_utils.TestClient(server, loop=loop)
+
+        async def post(body):
+            response = await client.post("/db", data=body)
+            return response.status, await response.json()
+
+        bodies = ["{", "[]", json.dumps({"query": "{ info }",
+                                         "variables": [1]}),
+                  json.dumps({"query": "{ info }", "extensions": "x"}),
+                  json.dumps({"extensions": {"persistedQuery": []}}),
+                  json.dumps({"extensions": {"persistedQuery": {
+                      "version": 1, "sha256Hash": 12}}})]
+        run(client.start_server())
+        try:
+            for body in bodies:
+                status, data = run(post(body))
+                assert status == 400, body
+                assert data["errors"][0]["reason"]
+        finally:
+            run(client.close())
+
+    def test_attribute_endpoint(self):
+        loop = asyncio.get_event_loop()
+        server = test_utils.TestServer(aioserver.setup_server(), loop=loop)
+        client = test_utils.TestClient(server, loop=loop)
+
+        async def get(path):
+            response = await client.get(path)
+            return response.status, response.headers, await response.read()
+
+        run(client.start_server())
+        try:
+            path = "/attribute/sim0/family0/dev0/spectrum_0"
+            status, headers, body = run(get(path + "?stride=2"))
+            assert status == 200
+            assert headers["X-Shape"] == "500"
+            assert len(body) == 500 * 8
+            for query in ("stride=0", "max_points=1", "roi=a", "stride=1.5",
+                          "roi=1,2,3"):
+                assert run(get(f"{path}?{query}"))[0] == 400
+            assert run(get(path[:-1] + "9"))[0] == 404
+
+            # A device that does not answer
+            base.proxies.timeout = 0.05
+            base.proxies.factory = lambda device: time.sleep(0.2)
+            assert run(get("/attribute/sim0/family0/dev1/spectrum_0"))[0] \
+                == 504
+        finally:
+            base.proxies.timeout = PROXY_TIMEOUT
+            run(client.close())
+
+    def test_stream_pages_have_own_loaders(self, monkeypatch):
+        # Loaders left in the request context must not be used by the pages
+        stale = Loaders()
+        build_context = routes._build_context
+        monkeypatch.setattr(routes, "_build_context", lambda *args: dict(
+            build_context(*args), loaders=stale))
+        loop = asyncio.get_event_loop()
+        server = test_utils.TestServer(aioserver.setup_server(), loop=loop)
+        client = test_utils.TestClient(server, loop=loop)
+
+        async def stream(query):
+            response = await client.post("/db?stream",
+                                         data=json.dumps({"query": query}))
+            return [json.loads(line)
+                    for line in (await response.text()).splitlines()]
+
+        run(client.start_server())
+        try:
+            lines = run(stream('{ devices(pattern: "*") { name state } }'))
+        finally:
+            run(client.close())
+        assert not any("errors" in line for line in lines)
+        devices = [device for line in lines
+                   for device in line.get("items", [])]
+        assert devices
+        assert all(device["state"] for device in devices)
+        assert not stale.states._futures
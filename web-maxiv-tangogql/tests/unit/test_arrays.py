@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""Tests for the encoding and reduction of SPECTRUM and IMAGE values."""
+
+import base64
+
+import numpy as np
+import pytest
+
+from tangogql.arrays import (decimate, encode_array, format_array,
+                             reduce_array)
+
+__docformat__ = "restructuredtext"
+
+
+class TestEncoding(object):
+
+    def test_encode_array(self):
+        array = np.arange(6, dtype=">i4").reshape(2, 3)
+        encoded = encode_array(array)
+        assert encoded["dtype"] == "<i4"
+        assert encoded["shape"] == [2, 3]
+        decoded = np.frombuffer(base64.b64decode(encoded["data"]),
+                                dtype=encoded["dtype"])
+        assert decoded.reshape(encoded["shape"]).tolist() == array.tolist()
+
+    def test_encode_strings(self):
+        assert encode_array(np.array(["a", "b"])) is None
+        assert format_array(np.array(["a", "b"]), "base64") == ["a", "b"]
+
+    def test_format_array(self):
+        array = np.arange(3.0)
+        assert format_array(array) == [0.0, 1.0, 2.0]
+        assert format_array(array, native=True) is array
+        assert format_array(1.5, "base64") == 1.5
+        assert format_array((1, 2)) == [1, 2]
+        with pytest.raises(ValueError):
+            format_array(array, "hex")
+
+
+class TestReduceArray(object):
+
+    def test_scalars(self):
+        assert reduce_array(1.5, roi=[0, 1], stride=2) == 1.5
+        assert reduce_array(None, max_points=10) is None
+
+    def test_roi_and_stride(self):
+        spectrum = np.arange(10)
+        assert reduce_array(spectrum, roi=[2, -2]).tolist() == \
+            list(range(2, 8))
+        assert reduce_array(spectrum, roi=[5, 0]).tolist() == \
+            list(range(5, 10))
+        assert reduce_array(spectrum, stride=3).tolist() == [0, 3, 6, 9]
+        image = np.arange(16).reshape(4, 4)
+        assert reduce_array(image, roi=[1, 3, 0, 2], stride=1).tolist() == \
+            [[4, 5], [8, 9]]
+        with pytest.raises(ValueError):
+            reduce_array(image, roi=[0, 1])
+
+    def test_invalid_arguments(self):
+        for arguments in ({"stride": 0}, {"stride": -2},
+                          {"max_points": 1}, {"max_points": -5}):
+            with pytest.raises(ValueError):
+                reduce_array(np.arange(10), **arguments)
+            # Whatever the value
+            with pytest.raises(ValueError):
+                reduce_array(1.0, **arguments)
+
+
+class TestDecimate(object):
+
+    def test_spectrum_keeps_minima_and_maxima(self):
+        spectrum = np.zeros(1000)
+        spectrum[100] = 5
+        spectrum[105] = -3
+        spectrum[900] = -7
+        for max_points in (2, 3, 10, 11):
+            result = decimate(spectrum, max_points)
+            assert len(result) <= max_points
+            assert result.max() == 5
+            assert result.min() == -7
+        # In their original order
+        assert decimate(spectrum, 10)[:2].tolist() == [5, -3]
+
+    def test_image_keeps_minima_and_maxima(self):
+        image = np.full((100, 100), 10, dtype=np.uint16)
+        image[10, 10] = 1000
+        image[80, 30] = 0
+        result = decimate(image, 100)
+        assert result.size <= 100
+        assert result.dtype == image.dtype
+        assert result.max() == 1000
+        assert result.min() == 0
+
+    def test_small_or_not_numerical(self):
+        spectrum = np.arange(5)
+        assert decimate(spectrum, 5) is spectrum
+        strings = np.array(["a"] * 10)
+        assert decimate(strings, 2) is strings
+
+    def test_invalid_max_points(self):
+        with pytest.raises(ValueError):
+            decimate(np.arange(10), 1)
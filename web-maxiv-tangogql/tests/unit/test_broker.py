@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""Tests for the subscription broker shared by the workers."""
+
+import asyncio
+
+from tangogql.broker import Broker, RemoteHub
+from tangogql.listener import Keeper, split_name
+
+__docformat__ = "restructuredtext"
+
+
+class FakeHub(object):
+    """Records the subscriptions, frames are sent with dispatch."""
+
+    def __init__(self):
+        self.keepers = {}
+
+    def subscribe(self, keeper, full_names):
+        for full_name in full_names:
+            self.keepers.setdefault(split_name(full_name), []).append(keeper)
+
+    def unsubscribe(self, keeper, full_names=None):
+        for key, keepers in list(self.keepers.items()):
+            if full_names is None or "/".join(key) in full_names:
+                keepers.remove(keeper)
+                if not keepers:
+                    del self.keepers[key]
+
+    def change_thresholds(self, device, attribute):
+        return (1.0, 1.0), None
+
+    def dispatch(self, device, attribute, value):
+        frame = {"device": device, "attribute": attribute, "value": value,
+                 "write_value": None, "quality": "ATTR_VALID",
+                 "timestamp": 1.0, "encoded": {}}
+        for keeper in self.keepers.get((device, attribute), []):
+            keeper.put(frame)
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+async def wait_for(condition):
+    for _ in range(300):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+class TestBroker(object):
+
+    def test_shared_subscription(self, tmp_path):
+        async def scenario():
+            hub = FakeHub()
+            broker = Broker(hub, str(tmp_path / "broker.sock"))
+            await broker.start()
+            remote = RemoteHub(broker.path)
+            first, second = Keeper(), Keeper()
+            try:
+                remote.subscribe(first, ["sys/tg_test/1/ampli"])
+                remote.subscribe(second, ["sys/tg_test/1/ampli"])
+                await wait_for(lambda: hub.keepers)
+                # One upstream subscription for the worker
+                assert len(hub.keepers[("sys/tg_test/1", "ampli")]) == 1
+
+                hub.dispatch("sys/tg_test/1", "ampli", 2.5)
+                frames = [await asyncio.wait_for(keeper.get(), 1)
+                          for keeper in (first, second)]
+                assert [frame["value"] for frame in frames] == [2.5, 2.5]
+                assert remote.change_thresholds("sys/tg_test/1", "ampli") \
+                    == ((1.0, 1.0), None)
+
+                workers = await remote.workers()
+                assert len(workers) == 1
+                assert workers[0]["attributes"] == 1
+
+                remote.unsubscribe(first)
+                remote.unsubscribe(second)
+                await wait_for(lambda: not hub.keepers)
+            finally:
+                remote.close()
+                await broker.close()
+
+        run(scenario())
+
+    def test_reconnect(self, tmp_path):
+        async def scenario():
+            hub = FakeHub()
+            path = str(tmp_path / "broker.sock")
+            broker = Broker(hub, path)
+            await broker.start()
+            remote = RemoteHub(path)
+            keeper = Keeper()
+            try:
+                remote.subscribe(keeper, ["sys/tg_test/1/ampli"])
+                await wait_for(lambda: hub.keepers)
+                await broker.close()
+                # A new broker, the subscriptions are sent again
+                hub = FakeHub()
+                broker = Broker(hub, path)
+                await broker.start()
+                await wait_for(lambda: hub.keepers)
+                hub.dispatch("sys/tg_test/1", "ampli", 1)
+                frame = await asyncio.wait_for(keeper.get(), 1)
+                assert frame["value"] == 1
+            finally:
+                remote.close()
+                await broker.close()
+
+        run(scenario())
+
+    def test_unsubscribe_some(self, tmp_path):
+        async def scenario():
+            hub = FakeHub()
+            broker = Broker(hub, str(tmp_path / "broker.sock"))
+            await broker.start()
+            remote = RemoteHub(broker.path)
+            keeper = Keeper()
+            try:
+                remote.subscribe(keeper, ["sys/tg_test/1/ampli",
+                                          "sys/tg_test/1/state"])
+                await wait_for(lambda: len(hub.keepers) == 2)
+                remote.unsubscribe(keeper, ["sys/tg_test/1/ampli"])
+                await wait_for(lambda: len(hub.keepers) == 1)
+                assert list(hub.keepers) == [("sys/tg_test/1", "state")]
+                remote.unsubscribe(keeper)
+                await wait_for(lambda: not hub.keepers)
+            finally:
+                remote.close()
+                await broker.close()
+
+        run(scenario())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""Tests for the coalescing of attribute reads."""
+
+import asyncio
+
+import PyTango
+
+from benchmarks.fake_tango import FakeAttributeValue
+from tangogql.coalescer import ReadCoalescer
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class Proxy(object):
+    """An asyncio device proxy, recording its reads."""
+
+    def __init__(self, values, latency=0.01):
+        self.values = values
+        self.latency = latency
+        self.calls = []
+
+    async def read_attributes(self, names):
+        self.calls.append(list(names))
+        values = [self.values[name] for name in names]
+        await asyncio.sleep(self.latency)
+        for value in values:
+            if isinstance(value, Exception):
+                raise value
+        return [FakeAttributeValue(name, value,
+                                   PyTango.AttrDataFormat.SCALAR,
+                                   errors=["Failed"] if value is None
+                                   else None)
+                for name, value in zip(names, values)]
+
+
+class Proxies(object):
+    """Stand-in for the DeviceProxyCache, with one device."""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    async def get(self, device):
+        return self.proxy
+
+
+class TestReadCoalescer(object):
+
+    def test_concurrent_reads(self):
+        proxy = Proxy({"x": 1.0, "y": 2.0, "z": 3.0})
+        reads = ReadCoalescer(Proxies(proxy))
+        first, second = run(asyncio.gather(reads.read("a/b/c", ["x", "y"]),
+                                           reads.read("a/b/c", ["y", "z"])))
+        assert [read.value for read in first] == [1.0, 2.0]
+        assert [read.value for read in second] == [2.0, 3.0]
+        # y was only read once
+        assert proxy.calls == [["x", "y"], ["z"]]
+        assert reads.stats()["hits"] == 1
+        # Nothing kept once done
+        run(reads.read("a/b/c", ["x"]))
+        assert len(proxy.calls) == 3
+        assert reads.stats()["in_flight"] == 0
+
+    def test_errors(self):
+        proxy = Proxy({"x": 1.0, "bad": None})
+        reads = ReadCoalescer(Proxies(proxy))
+        first, second = run(asyncio.gather(
+            reads.read("a/b/c", ["x", "bad"]),
+            reads.read("a/b/c", ["bad"])))
+        assert first[0].value == 1.0
+        # The failed attribute only, for each requester
+        assert isinstance(first[1], PyTango.DevFailed)
+        assert isinstance(second[0], PyTango.DevFailed)
+        assert len(proxy.calls) == 1
+
+    def test_failed_call(self):
+        proxy = Proxy({"x": RuntimeError("Timeout")})
+        reads = ReadCoalescer(Proxies(proxy))
+        results = run(asyncio.gather(reads.read("a/b/c", ["x"]),
+                                     reads.read("a/b/c", ["x"])))
+        assert all(isinstance(result, RuntimeError)
+                   for result, in results)
+
+        async def read_attribute():
+            try:
+                await reads.read_attribute("a/b/c", "x")
+            except RuntimeError:
+                return True
+
+        assert run(read_attribute())
+
+    def test_freshness(self):
+        proxy = Proxy({"x": 1.0}, latency=0)
+        reads = ReadCoalescer(Proxies(proxy), freshness=0.1)
+        run(reads.read("a/b/c", ["x"]))
+        run(reads.read("a/b/c", ["x"]))
+        assert len(proxy.calls) == 1
+        run(asyncio.sleep(0.15))
+        run(reads.read("a/b/c", ["x"]))
+        assert len(proxy.calls) == 2
+
+    def test_invalidate(self):
+        proxy = Proxy({"x": 1.0}, latency=0)
+        reads = ReadCoalescer(Proxies(proxy), freshness=10)
+        run(reads.read("a/b/c", ["x"]))
+        proxy.values["x"] = 2.0
+        reads.invalidate("a/b/c", "x")
+        read, = run(reads.read("a/b/c", ["x"]))
+        assert read.value == 2.0
+
+    def test_invalidate_in_flight(self):
+        proxy = Proxy({"x": 1.0}, latency=0.05)
+        reads = ReadCoalescer(Proxies(proxy), freshness=10)
+
+        async def scenario():
+            before = asyncio.ensure_future(reads.read("a/b/c", ["x"]))
+            await asyncio.sleep(0.01)
+            proxy.values["x"] = 2.0
+            reads.invalidate("a/b/c", "x")
+            after = await reads.read("a/b/c", ["x"])
+            return (await before)[0].value, after[0].value
+
+        assert run(scenario()) == (1.0, 2.0)
+        # The read started before the change is not served again
+        read, = run(reads.read("a/b/c", ["x"]))
+        assert read.value == 2.0
+        assert len(proxy.calls) == 2
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Tests for the query cost analysis."""
+
+import pytest
+from graphql import parse
+
+from tangogql.cost import (estimate_cost, check_cost, QueryCost,
+                           QueryTooExpensive, LIST_SIZES)
+from tangogql.schema.tango import tangoschema
+
+__docformat__ = "restructuredtext"
+
+
+def estimate(query, variables=None):
+    return estimate_cost(tangoschema, parse(query), variables)
+
+
+class TestCost(object):
+
+    def test_scalar_fields(self):
+        assert estimate("{ info }") == QueryCost(1, 1)
+
+    def test_list_multiplier(self):
+        cost = estimate("{ devices { name } }")
+        assert cost == QueryCost(1 + LIST_SIZES["devices"], 2)
+
+    def test_first_argument(self):
+        assert estimate("{ devices(first: 3) { name state } }").cost == \
+            1 + 3 * (1 + 5)
+        assert estimate("query ($n: Int) { devices(first: $n) { name } }",
+                        {"n": 2}).cost == 3
+
+    def test_list_argument_length(self):
+        query = '{ readAttributes(fullNames: ["a/b/c/d", "a/b/c/e"]) '\
+            '{ value } }'
+        assert estimate(query).cost == 10 + 2 * 10
+        query = "query ($names: [String!]!) "\
+            "{ readAttributes(fullNames: $names) { value } }"
+        assert estimate(query, {"names": ["a/b/c/d"]}).cost == 20
+
+    def test_fragments(self):
+        query = """
+            { devices(first: 2) { ...names } }
+            fragment names on Device { name }
+        """
+        assert estimate(query) == QueryCost(3, 2)
+
+    def test_introspection_is_free(self):
+        assert estimate("{ __schema { types { name } } }").cost == 0
+
+    def test_limits(self):
+        check_cost(QueryCost(10, 2), max_cost=10, max_depth=2)
+        with pytest.raises(QueryTooExpensive):
+            check_cost(QueryCost(11, 2), max_cost=10)
+        with pytest.raises(QueryTooExpensive):
+            check_cost(QueryCost(1, 3), max_depth=2)
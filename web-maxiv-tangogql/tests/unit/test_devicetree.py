@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Tests for the in-memory device tree index."""
+
+import asyncio
+import zlib
+
+from tangogql.devicetree import (DEVICE_QUERY, SUMMARY_QUERY, DeviceTree,
+                                 DeviceRow)
+
+__docformat__ = "restructuredtext"
+
+ROWS = [
+    DeviceRow("sys/tg_test/1", "TangoTest/test", "TangoTest", True),
+    DeviceRow("sys/tg_test/2", "TangoTest/test", "TangoTest", False),
+    DeviceRow("sys/database/2", "DataBaseds/2", "DataBase", True),
+    DeviceRow("dserver/TangoTest/test", "TangoTest/test", "DServer", True),
+]
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class Database(object):
+    """Answers the queries of the index from a list of rows.
+
+    All the devices were started at the same time, so only the checksum of
+    the summary tells a device moved.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.queries = []
+
+    async def select(self, query):
+        self.queries.append(query)
+        if query == DEVICE_QUERY:
+            return [[row.name, row.server, row.class_name,
+                     "1" if row.exported else "0"] for row in self.rows]
+        assert query == SUMMARY_QUERY
+        checksum = sum(zlib.crc32(" ".join(row[:3]).encode())
+                       for row in self.rows)
+        return [[str(len(self.rows)),
+                 str(sum(row.exported for row in self.rows)),
+                 "2020-01-01 00:00:00", "", str(checksum)]]
+
+
+def make_tree(rows=ROWS):
+    tree = DeviceTree(db=None)
+    tree.update(rows)
+    return tree
+
+
+class TestDeviceTree(object):
+
+    def test_domains_families_members(self):
+        tree = make_tree()
+        assert tree.domains() == ["dserver", "sys"]
+        assert tree.domains("S*") == ["sys"]
+        assert tree.families("sys") == ["database", "tg_test"]
+        assert tree.families() == ["database", "TangoTest", "tg_test"]
+        assert tree.members("sys", "tg_test") == ["1", "2"]
+        assert tree.members("sys", "*", "2") == ["2"]
+
+    def test_devices(self):
+        tree = make_tree()
+        assert tree.devices("sys/*") == ["sys/database/2", "sys/tg_test/1",
+                                         "sys/tg_test/2"]
+        assert tree.devices("*/tg_test/*", exported=True) == ["sys/tg_test/1"]
+        assert tree.devices("SYS/TG_TEST/1") == ["sys/tg_test/1"]
+
+    def test_servers(self):
+        tree = make_tree()
+        assert tree.servers() == ["DataBaseds", "TangoTest"]
+        assert tree.instances("tangotest") == ["test"]
+        assert tree.classes("TangoTest", "test") == [
+            ("TangoTest", ["sys/tg_test/1", "sys/tg_test/2"]),
+            ("DServer", ["dserver/TangoTest/test"])]
+        assert tree.classes("TangoTest", "test", "D*") == [
+            ("DServer", ["dserver/TangoTest/test"])]
+
+    def test_update_only_touches_changes(self):
+        tree = make_tree()
+        moved = DeviceRow("sys/tg_test/2", "TangoTest/other", "TangoTest",
+                          True)
+        rows = [ROWS[0], moved, ROWS[3]]
+        assert tree.update(rows) == (0, 1, 1)
+        assert tree.families("sys") == ["tg_test"]
+        assert tree.instances("TangoTest") == ["other", "test"]
+        assert tree.servers() == ["TangoTest"]
+        assert len(tree) == 3
+
+    def test_refresh(self):
+        db = Database(ROWS)
+        tree = DeviceTree(db)
+        assert run(tree.refresh()) == (4, 0, 0)
+        assert tree.ready
+        # Nothing changed, only the summary is queried
+        db.queries = []
+        assert run(tree.refresh()) == (0, 0, 0)
+        assert db.queries == [SUMMARY_QUERY]
+        # Same count, same exported devices and start times
+        db.rows[1] = DeviceRow("sys/tg_test/2", "TangoTest/other",
+                               "TangoTest", False)
+        assert run(tree.refresh()) == (0, 0, 1)
+        assert tree.instances("TangoTest") == ["other", "test"]
+
+    def test_footprint(self):
+        footprint = make_tree().footprint()
+        assert footprint["devices"] == 4
+        assert footprint["domains"] == 2
+        assert footprint["bytes"] > 0
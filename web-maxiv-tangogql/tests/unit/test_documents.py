@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""Tests for the document cache and the persisted queries."""
+
+import pytest
+
+from tangogql.documents import (DocumentCache, PersistedQueryNotFound,
+                                PersistedQueryMismatch, query_hash)
+from tangogql.schema.tango import tangoschema
+
+__docformat__ = "restructuredtext"
+
+
+class TestDocumentCache(object):
+
+    def test_cached(self):
+        documents = DocumentCache(tangoschema)
+        document = documents.get("{ info }")
+        assert document.errors == []
+        assert documents.get("{ info }") is document
+        assert (documents.hits, documents.misses) == (1, 1)
+
+    def test_invalid_query(self):
+        documents = DocumentCache(tangoschema)
+        assert documents.get("{ nope }").errors
+        assert documents.get("{ info").errors
+        assert documents.get().errors
+        assert documents.get(query=["{ info }"]).errors
+        assert documents.get(sha256=12).errors
+
+    def test_lru(self):
+        documents = DocumentCache(tangoschema, max_documents=1)
+        documents.get("{ info }")
+        documents.get("{ domains { name } }")
+        assert len(documents) == 1
+        with pytest.raises(PersistedQueryNotFound):
+            documents.get(sha256=query_hash("{ info }"))
+
+    def test_persisted_query(self):
+        documents = DocumentCache(tangoschema)
+        sha256 = query_hash("{ info }")
+        with pytest.raises(PersistedQueryNotFound):
+            documents.get(sha256=sha256)
+        document = documents.get("{ info }", sha256)
+        assert documents.get(sha256=sha256) is document
+
+    def test_persisted_query_mismatch(self):
+        documents = DocumentCache(tangoschema)
+        with pytest.raises(PersistedQueryMismatch):
+            documents.get("{ info }", query_hash("{ domains { name } }"))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Tests for the simulated control system of the benchmarks."""
+
+import asyncio
+
+import pytest
+import PyTango
+
+from benchmarks.fake_tango import FakeTango
+from tangogql.devicetree import DeviceTree
+from tangogql.tangodb import CachedDatabase, DeviceProxyCache
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestFakeTango(object):
+
+    def test_database(self):
+        backend = FakeTango(devices=120, family_size=50, latency=0,
+                            db_latency=0)
+        db = CachedDatabase(database=backend.database)
+        tree = DeviceTree(db)
+
+        async def scenario():
+            await tree.refresh()
+            exported = await db.get_device_exported("sim0/family2/*")
+            return exported, tree.devices("sim0/family2/*")
+
+        exported, indexed = run(scenario())
+        assert len(exported) == 20
+        assert sorted(indexed) == exported
+        assert backend.calls["database.get_device_exported"] == 1
+
+    def test_devices(self):
+        backend = FakeTango(devices=2, latency=0, spectrum_size=10)
+        proxies = DeviceProxyCache(factory=backend.device_proxy)
+
+        async def scenario():
+            proxy = await proxies.get("SIM0/family0/dev1")
+            reads = await proxy.read_attributes(["scalar_0", "spectrum_0",
+                                                 "nope"])
+            return proxy, reads
+
+        proxy, reads = run(scenario())
+        assert proxy.name == "sim0/family0/dev1"
+        assert isinstance(reads[0].value, float)
+        assert reads[1].value.shape == (10,)
+        assert reads[2].has_failed
+        with pytest.raises(PyTango.DevFailed):
+            run(proxies.get("sim9/family9/dev9"))
+
+    def test_failures(self):
+        backend = FakeTango(devices=1, latency=0, failure_rate=1)
+        proxies = DeviceProxyCache(factory=backend.device_proxy)
+
+        async def scenario():
+            proxy = await proxies.get("sim0/family0/dev0")
+            return await proxy.state()
+
+        with pytest.raises(PyTango.DevFailed):
+            run(scenario())
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+"""Tests for the shared attribute listeners of the subscriptions."""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import PyTango
+import pytest
+
+from benchmarks.fake_tango import FakeAttributeValue
+from tangogql.listener import (ChangeFilter, Keeper, SubscriptionHub,
+                               SubscriptionOverflow, parse_change)
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def settle(seconds=0.05):
+    """Let the listeners subscribe (in threads) and the events arrive."""
+
+    run(asyncio.sleep(seconds))
+
+
+def frame(attribute, value=0.0, device="sys/tg_test/1", quality="ATTR_VALID",
+          write_value=None, error=None):
+    return {"device": device, "attribute": attribute, "value": value,
+            "write_value": write_value, "quality": quality, "timestamp": 0.0,
+            "error": error, "encoded": {}}
+
+
+def dev_failed(desc):
+    error = PyTango.DevError()
+    error.reason = "API_DeviceNotExported"
+    error.desc = desc
+    error.origin = "test"
+    error.severity = PyTango.ErrSeverity.ERR
+    return PyTango.DevFailed(error)
+
+
+class EventProxy(object):
+    """A synchronous device proxy, with or without events."""
+
+    def __init__(self, device, events=True):
+        self.device = device
+        self.events = events
+        self.callbacks = {}
+        self.unsubscribed = []
+
+    def get_attribute_config(self, attribute):
+        raise dev_failed("No configuration")
+
+    def subscribe_event(self, attribute, event_type, callback):
+        if not self.events:
+            raise dev_failed("No events")
+        self.callbacks[attribute] = callback
+        return len(self.callbacks)
+
+    def unsubscribe_event(self, event_id):
+        self.unsubscribed.append(event_id)
+
+
+class ProxyFactory(object):
+    """Creates the EventProxy of the devices, keeping track of them."""
+
+    def __init__(self, events=True):
+        self.events = events
+        self.proxies = []
+        self._lock = threading.Lock()
+
+    def __call__(self, device):
+        proxy = EventProxy(device, self.events)
+        with self._lock:
+            self.proxies.append(proxy)
+        return proxy
+
+    def created(self, device):
+        return [proxy for proxy in self.proxies if proxy.device == device]
+
+
+class Reads(object):
+    """Stand-in for the read coalescer, recording the reads."""
+
+    def __init__(self, failing=(), hanging=()):
+        self.calls = []
+        self.failing = failing
+        self.hanging = hanging
+
+    async def read(self, device, names):
+        self.calls.append((device, list(names)))
+        if device in self.hanging:
+            await asyncio.sleep(10)
+        return [dev_failed(f"Failed {name}") if name in self.failing
+                else FakeAttributeValue(name, 1.0,
+                                        PyTango.AttrDataFormat.SCALAR)
+                for name in names]
+
+
+class TestSubscriptionHub(object):
+
+    def test_shared_listeners(self):
+        factory = ProxyFactory()
+        hub = SubscriptionHub(Reads(), proxy_factory=factory)
+        first, second = Keeper(), Keeper()
+        names = ["sys/tg_test/1/ampli", "sys/tg_test/1/double_scalar"]
+        hub.subscribe(first, names)
+        hub.subscribe(second, names[:1])
+        settle()
+        assert len(hub) == 2
+        # One proxy for the device, one event subscription per attribute
+        proxy, = factory.created("sys/tg_test/1")
+        assert sorted(proxy.callbacks) == ["ampli", "double_scalar"]
+
+        hub.unsubscribe(first)
+        assert len(hub) == 1
+        hub.unsubscribe(second)
+        settle()
+        assert len(hub) == 0
+        assert sorted(proxy.unsubscribed) == [1, 2]
+
+        # The proxy is not kept once nobody listens to the device
+        hub.subscribe(first, names[:1])
+        settle()
+        assert len(factory.created("sys/tg_test/1")) == 2
+        hub.unsubscribe(first)
+
+    def test_unsubscribe_some(self):
+        hub = SubscriptionHub(Reads(), proxy_factory=ProxyFactory())
+        keeper = Keeper()
+        hub.subscribe(keeper, ["a/b/c/x", "a/b/c/y"])
+        hub.unsubscribe(keeper, ["a/b/c/x"])
+        assert len(hub) == 1
+        hub.unsubscribe(keeper)
+        assert len(hub) == 0
+        settle()
+
+    def test_events(self):
+        factory = ProxyFactory()
+        hub = SubscriptionHub(Reads(), proxy_factory=factory)
+        keeper = Keeper(policy="drop_oldest")
+        hub.subscribe(keeper, ["sys/tg_test/1/ampli"])
+        settle()
+        callback = factory.proxies[0].callbacks["ampli"]
+        value = FakeAttributeValue("ampli", 2.0,
+                                   PyTango.AttrDataFormat.SCALAR)
+        callback(SimpleNamespace(err=False, attr_value=value, errors=()))
+        failed = dev_failed("Device down")
+        callback(SimpleNamespace(err=True, attr_value=None,
+                                 errors=failed.args))
+        settle()
+        frames = run(keeper.get_batch())
+        assert [frame["value"] for frame in frames] == [2.0, None]
+        assert frames[0]["error"] is None
+        assert frames[1]["quality"] == "ATTR_INVALID"
+        assert "Device down" in frames[1]["error"]
+        hub.unsubscribe(keeper)
+        settle()
+
+    def test_late_subscriber_gets_latest_frame(self):
+        factory = ProxyFactory()
+        hub = SubscriptionHub(Reads(), proxy_factory=factory)
+        first, second = Keeper(), Keeper()
+        hub.subscribe(first, ["sys/tg_test/1/ampli"])
+        settle()
+        value = FakeAttributeValue("ampli", 3.0,
+                                   PyTango.AttrDataFormat.SCALAR)
+        factory.proxies[0].callbacks["ampli"](
+            SimpleNamespace(err=False, attr_value=value, errors=()))
+        settle()
+        hub.subscribe(second, ["sys/tg_test/1/ampli"])
+        assert run(second.get())["value"] == 3.0
+        hub.unsubscribe(first)
+        hub.unsubscribe(second)
+        settle()
+
+
+class Thresholds(object):
+    """Stand-in for the hub, with the TANGO change configuration."""
+
+    def __init__(self, abs_change=None, rel_change=None):
+        self.thresholds = (abs_change, rel_change)
+
+    def change_thresholds(self, device, attribute):
+        return self.thresholds
+
+
+class TestChangeFilter(object):
+
+    def sent(self, changes, values, **kwargs):
+        return [passed["value"] for value in values
+                for passed in changes.filter([frame("a", value, **kwargs)],
+                                             0)]
+
+    def test_any_change(self):
+        changes = ChangeFilter(Thresholds(), keep_alive=0)
+        assert self.sent(changes, [1.0, 1.0, 1.5, 1.5, "x", "x"]) == [
+            1.0, 1.5, "x"]
+
+    def test_arrays(self):
+        changes = ChangeFilter(Thresholds(), keep_alive=0)
+        values = [np.arange(3.0), np.arange(3.0), np.arange(4.0)]
+        assert len(self.sent(changes, values)) == 2
+
+    def test_abs_change(self):
+        changes = ChangeFilter(Thresholds(), abs_change=1, keep_alive=0)
+        assert self.sent(changes, [0.0, 0.5, 0.9, 1.0, 0.2, -0.1]) == [
+            0.0, 1.0, -0.1]
+
+    def test_rel_change(self):
+        changes = ChangeFilter(Thresholds(), rel_change=10, keep_alive=0)
+        assert self.sent(changes, [100.0, 105.0, 110.0, 100.0, 98.0]) == [
+            100.0, 110.0, 98.0]
+
+    def test_tango_configuration(self):
+        # Decrease of 1 or increase of 2
+        changes = ChangeFilter(Thresholds(abs_change=parse_change("1,2")),
+                               keep_alive=0)
+        assert self.sent(changes, [0.0, 1.5, 2.0, 1.2, 1.0]) == [
+            0.0, 2.0, 1.0]
+        assert parse_change("Not specified") is None
+        assert parse_change("0.5") == (0.5, 0.5)
+
+    def test_quality_and_error(self):
+        changes = ChangeFilter(Thresholds(), abs_change=10, keep_alive=0)
+        sent = changes.filter([frame("a", 1.0), frame("a", 1.0),
+                               frame("a", 1.0, quality="ATTR_ALARM")], 0)
+        assert len(sent) == 2
+        sent = changes.filter([frame("a", None, error="Down"),
+                               frame("a", None, error="Down"),
+                               frame("a", None, error="Timeout")], 0)
+        assert [passed["error"] for passed in sent] == ["Down", "Timeout"]
+
+    def test_keep_alive(self):
+        changes = ChangeFilter(Thresholds(), keep_alive=10)
+        assert changes.timeout(0) is None
+        changes.filter([frame("a", 1.0)], 0)
+        changes.filter([frame("b", 1.0)], 4)
+        assert changes.filter([frame("a", 1.0)], 5) == []
+        assert changes.timeout(5) == 5
+        assert changes.keep_alives(9) == []
+        assert [due["attribute"] for due in changes.keep_alives(10)] == ["a"]
+        assert changes.timeout(10) == 4
+        assert [due["attribute"] for due in changes.keep_alives(14)] == ["b"]
+
+
+class TestKeeper(object):
+
+    def test_drop_oldest(self):
+        keeper = Keeper(maxsize=3, policy="drop_oldest")
+        for index in range(5):
+            keeper.put(frame("a", index))
+        assert keeper.dropped == 2
+        assert [item["value"] for item in run(keeper.get_batch())] == [
+            2, 3, 4]
+
+    def test_conflate(self):
+        keeper = Keeper(maxsize=2, policy="conflate")
+        keeper.put(frame("a", 0))
+        keeper.put(frame("b", 0))
+        keeper.put(frame("a", 1))
+        assert len(keeper) == 2
+        # No room for a third attribute, the one waiting the longest goes
+        keeper.put(frame("c", 0))
+        assert keeper.dropped == 2
+        assert [(item["attribute"], item["value"])
+                for item in run(keeper.get_batch())] == [("b", 0), ("c", 0)]
+
+    def test_disconnect(self):
+        keeper = Keeper(maxsize=2, policy="disconnect")
+        for index in range(3):
+            keeper.put(frame("a", index))
+        keeper.put(frame("a", 3))
+        assert keeper.overflowed
+        assert keeper.dropped == 3
+        with pytest.raises(SubscriptionOverflow):
+            run(keeper.get_batch())
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            Keeper(policy="block")
+
+    def test_timeout(self):
+        keeper = Keeper()
+        assert run(keeper.get_batch(timeout=0.01)) == []
+        keeper.put(frame("a"))
+        assert len(run(keeper.get_batch(timeout=0.01))) == 1
+
+    def test_max_frames(self):
+        keeper = Keeper(policy="drop_oldest")
+        for index in range(3):
+            keeper.put(frame("a", index))
+        assert run(keeper.get())["value"] == 0
+        assert len(run(keeper.get_batch(max_frames=1))) == 1
+        assert len(keeper) == 1
+
+    def test_rate_limit(self):
+        keeper = Keeper(policy="drop_oldest", max_rate=100)
+        for index in range(150):
+            keeper.put(frame("a", index))
+
+        async def receive():
+            frames = []
+            while len(frames) < 150:
+                frames.extend(await keeper.get_batch())
+            return frames
+
+        started = time.monotonic()
+        frames = run(receive())
+        # A burst of 100, the others at 100 per second
+        assert time.monotonic() - started >= 0.45
+        assert [item["value"] for item in frames] == list(range(150))
+
+    def test_drops_reported_at_once(self):
+        drops = []
+        keeper = Keeper(maxsize=2, policy="drop_oldest",
+                        on_drop=drops.append)
+        for index in range(3):
+            keeper.put(frame("a", index))
+        assert drops == [1]
+        conflating = Keeper(maxsize=2, policy="conflate",
+                            on_drop=drops.append)
+        conflating.put(frame("a"))
+        conflating.put(frame("a", 1.0))
+        assert drops == [1, 1]
+        assert conflating.dropped == 1
+
+
+class TestPolling(object):
+
+    def subscribe(self, hub, keeper, names):
+        hub.subscribe(keeper, names)
+        # The listeners fail to subscribe to events, and get polled
+        settle(0.1)
+
+    def test_one_read_per_device(self):
+        reads = Reads(failing={"broken"})
+        hub = SubscriptionHub(reads, poll_period=0.2,
+                              proxy_factory=ProxyFactory(events=False))
+        keeper = Keeper(policy="drop_oldest")
+        self.subscribe(hub, keeper, ["a/b/c/x", "a/b/c/y", "a/b/c/broken",
+                                     "d/e/f/z"])
+        reads.calls = []
+        run(keeper.get_batch())
+        run(hub.poll_once())
+        assert sorted((device, sorted(names))
+                      for device, names in reads.calls) == [
+            ("a/b/c", ["broken", "x", "y"]), ("d/e/f", ["z"])]
+        frames = run(keeper.get_batch())
+        assert sorted(frame["attribute"] for frame in frames) == [
+            "broken", "x", "y", "z"]
+        broken, = [frame for frame in frames
+                   if frame["attribute"] == "broken"]
+        assert "Failed broken" in broken["error"]
+
+        # Polling stops with the last subscriber
+        hub.unsubscribe(keeper)
+        settle(0.3)
+        reads.calls = []
+        settle(0.3)
+        assert reads.calls == []
+
+    def test_slow_device(self):
+        reads = Reads(hanging={"d/e/f"})
+        hub = SubscriptionHub(reads, poll_period=0.5, read_timeout=0.05,
+                              proxy_factory=ProxyFactory(events=False))
+        keeper = Keeper(policy="drop_oldest")
+        self.subscribe(hub, keeper, ["a/b/c/x", "d/e/f/z"])
+        run(keeper.get_batch())
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        run(hub.poll_once())
+        # Bounded by the read timeout, not by the slow device
+        assert loop.time() - started < 1
+        frames = {frame["attribute"]: frame
+                  for frame in run(keeper.get_batch())}
+        assert frames["x"]["value"] == 1.0
+        assert frames["z"]["value"] is None
+        assert "did not answer" in frames["z"]["error"]
+        hub.unsubscribe(keeper)
+        settle(0.6)
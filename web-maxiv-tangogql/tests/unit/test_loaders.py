@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Tests for the request scoped loaders."""
+
+import asyncio
+
+import PyTango
+
+from benchmarks.fake_tango import FakeTango
+from tangogql.schema import base
+from tangogql.schema.loaders import BatchLoader, get_device_infos
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestBatchLoader(object):
+
+    def test_batching(self):
+        batches = []
+
+        async def batch_load(keys):
+            batches.append(keys)
+            return [ValueError(key) if key == "bad" else key.upper()
+                    for key in keys]
+
+        loader = BatchLoader(batch_load)
+
+        async def scenario():
+            results = await asyncio.gather(
+                loader.load("a"), loader.load("b"), loader.load("a"),
+                loader.load("bad"), return_exceptions=True)
+            again = await loader.load("b")
+            return results, again
+
+        results, again = run(scenario())
+        assert batches == [["a", "b", "bad"]]
+        assert results[:3] == ["A", "B", "A"]
+        assert isinstance(results[3], ValueError)
+        assert again == "B"
+
+    def test_failed_batch(self):
+        async def batch_load(keys):
+            raise RuntimeError("down")
+
+        loader = BatchLoader(batch_load)
+        results = run(asyncio.gather(loader.load(1), loader.load(2),
+                                     return_exceptions=True))
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class TestDeviceInfos(object):
+
+    def setup_method(self):
+        self.factory = base.proxies.factory
+        self.backend = FakeTango(devices=3, latency=0, db_latency=0)
+
+    def teardown_method(self):
+        base.db.database = None
+        base.proxies.factory = self.factory
+
+    def test_one_query(self):
+        self.backend.install()
+        infos = run(get_device_infos(["sim0/family0/dev0",
+                                      "SIM0/FAMILY0/DEV2",
+                                      "sim0/family0/nodev"]))
+        assert infos[0].name == "sim0/family0/dev0"
+        assert infos[0].exported
+        assert infos[1].name == "sim0/family0/dev2"
+        assert isinstance(infos[2], PyTango.DevFailed)
+        calls = self.backend.calls
+        assert calls["database.command_inout.DbMySqlSelect"] == 1
+        assert calls["database.get_device_info"] == 0
+
+    def test_names_not_in_query(self):
+        queries = []
+        command_inout = self.backend.database.command_inout
+
+        def spy(command, argin=None):
+            queries.append(argin)
+            return command_inout(command, argin)
+
+        self.backend.database.command_inout = spy
+        self.backend.install()
+        name = "sim0/family0/dev0') OR ('1'='1"
+        infos = run(get_device_infos(["sim0/family0/dev1", name]))
+        assert infos[0].name == "sim0/family0/dev1"
+        assert isinstance(infos[1], PyTango.DevFailed)
+        assert len(queries) == 1
+        assert "'1'='1" not in queries[0]
+        assert self.backend.calls["database.get_device_info"] == 1
+
+    def test_queries_not_allowed(self):
+        def command_inout(command, argin=None):
+            raise PyTango.DevFailed()
+
+        self.backend.database.command_inout = command_inout
+        self.backend.install()
+        infos = run(get_device_infos(["sim0/family0/dev0",
+                                      "sim0/family0/nodev"]))
+        assert infos[0].name == "sim0/family0/dev0"
+        assert isinstance(infos[1], PyTango.DevFailed)
+        assert self.backend.calls["database.get_device_info"] == 2
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Tests for the subscription load generator."""
+
+from benchmarks.loadgen import (LoadStats, attribute_sets, parse_args,
+                                parse_metrics)
+from benchmarks.stats import Reservoir
+
+__docformat__ = "restructuredtext"
+
+
+class TestLoadgen(object):
+
+    def test_parse_metrics(self):
+        text = ("# HELP tangogql_frames_sent_total Frames\n"
+                "# TYPE tangogql_frames_sent_total counter\n"
+                "tangogql_frames_sent_total 12.0\n"
+                'tangogql_subscribed_attributes{mode="events"} 3.0\n'
+                'tangogql_subscribed_attributes{mode="polling"} 2.0\n'
+                "tangogql_subscribers_other 7.0\n")
+        metrics = parse_metrics(text)
+        assert metrics["tangogql_frames_sent_total"] == 12
+        assert metrics["tangogql_subscribed_attributes"] == 5
+        assert metrics["tangogql_subscribers"] == 0
+
+    def test_attribute_sets(self):
+        options = parse_args(["--connections", "3", "--devices", "100",
+                              "--pool-size", "4", "--per-client", "2"])
+        subscriptions = attribute_sets(options)
+        assert len(subscriptions) == 3
+        pool = set()
+        for attributes in subscriptions:
+            assert len(set(attributes)) == 2
+            pool.update(attributes)
+        assert pool <= {"sim0/family0/dev0/scalar_0",
+                        "sim0/family0/dev1/scalar_1",
+                        "sim0/family0/dev2/scalar_2",
+                        "sim0/family0/dev3/scalar_3"}
+
+    def test_stats(self):
+        stats = LoadStats(2)
+        stats.add_frames(0, [{"timestamp": 0}])
+        stats.start()
+        stats.add_frames(1, [{"timestamp": None}, {"fullName": "a/b/c/d"}])
+        stats.stop()
+        report = stats.report()
+        assert report["frames"] == 2
+        assert report["latency"]["count"] == 0
+
+    def test_reservoir(self):
+        reservoir = Reservoir(size=10)
+        for value in range(1000):
+            reservoir.add(value)
+        assert len(reservoir.values) == 10
+        assert reservoir.summary()["count"] == 1000
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Tests for the metrics."""
+
+import pytest
+
+from tangogql.metrics import (Registry, Counter, Gauge, Histogram,
+                              CallbackMetric)
+
+__docformat__ = "restructuredtext"
+
+
+class TestMetrics(object):
+
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        counter = Counter("requests_total", "Requests", registry=registry)
+        gauge = Gauge("clients", "Clients", registry=registry)
+        counter.inc()
+        counter.inc(2)
+        gauge.inc()
+        gauge.dec()
+        gauge.set(5)
+        assert registry.render() == (
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            "requests_total 3.0\n"
+            "# HELP clients Clients\n"
+            "# TYPE clients gauge\n"
+            "clients 5.0\n")
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = Histogram("read_seconds", "Reads", labels=("device",),
+                              buckets=(0.1, 1), registry=registry)
+        histogram.labels("sys/tg_test/1").observe(0.05)
+        histogram.labels("sys/tg_test/1").observe(0.1)
+        histogram.labels("sys/tg_test/1").observe(3)
+        lines = registry.render().splitlines()
+        assert 'read_seconds_bucket{device="sys/tg_test/1",le="0.1"} 2' \
+            in lines
+        assert 'read_seconds_bucket{device="sys/tg_test/1",le="1.0"} 2' \
+            in lines
+        assert 'read_seconds_bucket{device="sys/tg_test/1",le="+Inf"} 3' \
+            in lines
+        assert 'read_seconds_count{device="sys/tg_test/1"} 3' in lines
+
+    def test_max_series(self):
+        registry = Registry()
+        counter = Counter("reads_total", "Reads", labels=("device",),
+                          registry=registry, max_series=2)
+        for device in ("a", "b", "c", "d"):
+            counter.labels(device).inc()
+        lines = registry.render().splitlines()
+        assert 'reads_total{device="_other"} 2.0' in lines
+        assert len(lines) == 5
+
+    def test_callback(self):
+        registry = Registry()
+        CallbackMetric("hits_total", "Hits",
+                       lambda: {("a\"b",): 1}, labels=("name",),
+                       type="counter", registry=registry)
+        assert 'hits_total{name="a\\"b"} 1.0' in registry.render()
+
+    def test_duplicate(self):
+        registry = Registry()
+        Counter("requests_total", "Requests", registry=registry)
+        with pytest.raises(ValueError):
+            Counter("requests_total", "Requests", registry=registry)
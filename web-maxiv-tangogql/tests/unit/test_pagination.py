@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""Tests for the pagination of list fields."""
+
+from types import SimpleNamespace
+
+import pytest
+from tangogql.schema.log import ActivityLog
+from tangogql.schema.pagination import paginate
+
+__docformat__ = "restructuredtext"
+
+
+class TestPaginate(object):
+
+    def test_first(self):
+        assert paginate(["a", "b", "c"], first=2) == ["a", "b"]
+        assert paginate(["a", "b", "c"], first=0) == []
+
+    def test_after(self):
+        assert paginate(["a", "b", "c"], after="a") == ["b", "c"]
+        assert paginate(["a", "c"], after="b") == ["c"]
+        assert paginate(["a", "b", "c"], first=1, after="a") == ["b"]
+
+    def test_key(self):
+        items = [{"name": "a"}, {"name": "b"}]
+        assert paginate(items, after="a",
+                        key=lambda item: item["name"]) == [{"name": "b"}]
+
+    def test_negative_first(self):
+        with pytest.raises(ValueError):
+            paginate(["a"], first=-1)
+
+
+class TestActivityLog(object):
+
+    def setup_method(self):
+        self.log = ActivityLog()
+        for device in ("a/b/c", "a/b/d", "a/b/c"):
+            self.log.put(SimpleNamespace(device=device))
+
+    def ids(self, **arguments):
+        return [log.id for log in self.log.get(**arguments)]
+
+    def test_first(self):
+        assert self.ids() == [3, 2, 1]
+        assert self.ids(first=2) == [3, 2]
+        assert self.ids(first=0) == []
+        assert self.ids(pattern="a/b/c", first=1, after=3) == [1]
+        with pytest.raises(ValueError):
+            self.log.get(first=-1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""Tests for the query profiling."""
+
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from promise import Promise
+
+from tangogql.profiling import QueryProfiler, log_slow_query
+
+__docformat__ = "restructuredtext"
+
+
+def make_info(path, parent_type="DeviceAttribute"):
+    return SimpleNamespace(path=path, field_name=path[-1],
+                           parent_type=SimpleNamespace(name=parent_type))
+
+
+class TestQueryProfiler(object):
+
+    def test_synchronous_resolvers_are_skipped(self):
+        profiler = QueryProfiler()
+        result = profiler.resolve(lambda root, info: "sys/tg_test/1", None,
+                                  make_info(["devices", 0, "name"], "Device"))
+        assert result == "sys/tg_test/1"
+        assert profiler.timing()["resolvers"] == {}
+
+    def test_promises(self):
+        profiler = QueryProfiler()
+        device = SimpleNamespace(name="sys/tg_test/1")
+        attribute = SimpleNamespace(device="sys/tg_test/1")
+        pending = []
+        for path, root, parent_type in [
+                (["devices", 0, "state"], device, "Device"),
+                (["devices", 0, "attributes", 0, "value"], attribute,
+                 "DeviceAttribute"),
+                (["devices", 0, "attributes", 1, "value"], attribute,
+                 "DeviceAttribute")]:
+            promise = Promise()
+            result = profiler.resolve(lambda root, info: promise, root,
+                                      make_info(path, parent_type))
+            pending.append((promise, result))
+        for promise, result in pending:
+            promise.do_resolve(1)
+            assert result.get() == 1
+        timing = profiler.timing()
+        assert timing["resolvers"]["devices.attributes.value"]["count"] == 2
+        assert timing["resolvers"]["devices.state"]["count"] == 1
+        assert {entry["path"] for entry in timing["slowest"]} == {
+            "devices.0.state", "devices.0.attributes.0.value",
+            "devices.0.attributes.1.value"}
+        assert {entry["device"] for entry in timing["slowest"]} == {
+            "sys/tg_test/1"}
+
+    def test_coroutines(self):
+        profiler = QueryProfiler(slowest=1)
+
+        async def read(delay):
+            await asyncio.sleep(delay)
+            return delay
+
+        async def scenario():
+            return await asyncio.gather(*[
+                profiler.resolve(lambda root, info: read(delay), None,
+                                 make_info(["attribute", "value"]))
+                for delay in (0.01, 0.05)])
+
+        loop = asyncio.get_event_loop()
+        assert loop.run_until_complete(scenario()) == [0.01, 0.05]
+        timing = profiler.timing()
+        assert timing["resolvers"]["attribute.value"]["count"] == 2
+        assert len(timing["slowest"]) == 1
+        assert timing["slowest"][0]["duration"] >= 0.05
+
+    def test_slow_query_log(self, caplog):
+        profiler = QueryProfiler()
+        with caplog.at_level(logging.WARNING, logger="logger"):
+            assert not log_slow_query(profiler, "{ info }", threshold=0)
+            assert not log_slow_query(profiler, "{ info }", threshold=60)
+            assert log_slow_query(profiler, "{ info }", {"a": 1},
+                                  threshold=1e-9)
+        assert len(caplog.records) == 1
+        assert '"variables": {"a": 1}' in caplog.records[0].getMessage()
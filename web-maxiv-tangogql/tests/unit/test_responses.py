@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""Tests for the response cache."""
+
+from graphql import parse
+
+from tangogql.documents import Document
+from tangogql.responses import ResponseCache, is_cacheable
+
+__docformat__ = "restructuredtext"
+
+
+def document(query):
+    return Document(parse(query), [], query)
+
+
+class TestIsCacheable(object):
+
+    def test_database_fields(self):
+        assert is_cacheable(parse("{ domains { name families { name } } }"))
+        assert is_cacheable(parse(
+            "{ device(name: \"a/b/c\") { properties { name value } } }"))
+
+    def test_live_fields(self):
+        assert not is_cacheable(parse("{ devices { name state } }"))
+        assert not is_cacheable(parse(
+            "{ devices { attributes { name } } }"))
+        # The status of the database
+        assert not is_cacheable(parse("{ info }"))
+
+    def test_fragments(self):
+        query = """
+            { devices { ...live } }
+            fragment live on Device { connected }
+        """
+        assert not is_cacheable(parse(query))
+
+    def test_mutation(self):
+        assert not is_cacheable(parse(
+            "mutation { deleteDeviceProperty(device: \"a/b/c\", name: \"p\")"
+            " { ok } }"))
+
+
+class TestResponseCache(object):
+
+    def test_disabled(self):
+        cache = ResponseCache(ttl=0)
+        assert cache.key(document("{ domains { name } }")) is None
+
+    def test_get_put(self):
+        cache = ResponseCache(ttl=10)
+        key = cache.key(document("{ domains { name } }"), {"a": 1})
+        assert cache.get(key) is None
+        cache.put(key, "{}", cache.generation)
+        assert cache.get(key) == "{}"
+        assert cache.key(document("{ devices { state } }")) is None
+
+    def test_invalidate(self):
+        cache = ResponseCache(ttl=10)
+        key = cache.key(document("{ domains { name } }"))
+        generation = cache.generation
+        cache.put(key, "{}", generation)
+        cache.invalidate("get_device_property", ("a/b/c",))
+        assert cache.get(key) is None
+        # Started before the invalidation, may be outdated
+        cache.put(key, "{}", generation)
+        assert cache.get(key) is None
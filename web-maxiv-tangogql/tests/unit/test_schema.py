@@ -131,6 +131,24 @@ class TestDeviceClass(object):
         assert isinstance(result['stoppedDate'], str)
 
 
+@pytest.mark.usefixtures("client")
+class TestReadAttributes(object):
+
+    def test_read_attributes(self, client):
+        result = client.execute(queries.read_attributes)
+        assert 'readAttributes' in result
+        ampli, double, missing = result['readAttributes']
+        assert ampli['fullName'] == "sys/tg_test/1/ampli"
+        assert ampli['device'] == "sys/tg_test/1"
+        assert ampli['attribute'] == "ampli"
+        assert isinstance(ampli['quality'], str)
+        assert isinstance(ampli['timestamp'], float)
+        assert ampli['error'] is None
+        assert double['error'] is None
+        assert missing['value'] is None
+        assert isinstance(missing['error'], str)
+
+
 @pytest.mark.usefixtures("client")
 class TestDomainClass(object):
 
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""Tests for the JSON serialization of the responses."""
+
+import json
+
+import numpy as np
+import pytest
+
+from tangogql.serializer import get_serializer, orjson
+
+__docformat__ = "restructuredtext"
+
+NAMES = ["json"] + (["orjson"] if orjson is not None else [])
+
+
+@pytest.mark.parametrize("name", NAMES)
+class TestSerializer(object):
+
+    def test_plain_data(self, name):
+        data = {"data": {"devices": [{"name": "sys/tg_test/1"}]}}
+        body = get_serializer(name).dumps(data)
+        assert isinstance(body, bytes)
+        assert json.loads(body) == data
+
+    def test_numpy(self, name):
+        data = {"value": np.arange(6.0).reshape(2, 3),
+                "stride": np.arange(4)[::2], "scalar": np.int32(3)}
+        assert json.loads(get_serializer(name).dumps(data)) == {
+            "value": [[0, 1, 2], [3, 4, 5]], "stride": [0, 2], "scalar": 3}
+
+    def test_loads(self, name):
+        assert get_serializer(name).loads('{"a": [1]}') == {"a": [1]}
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        get_serializer("pickle")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Tests for the streaming of large query results."""
+
+import asyncio
+
+from graphql import parse
+from graphql.execution import ExecutionResult
+
+from tangogql.streaming import plan_stream, stream_query
+
+__docformat__ = "restructuredtext"
+
+DEVICES = ["sys/tg_test/%d" % i for i in range(5)]
+
+
+def _arguments(field):
+    return {argument.name.value: argument.value.value
+            for argument in field.arguments}
+
+
+async def execute(document):
+    """Fake execution, paging through DEVICES like the schema does."""
+
+    field = document.definitions[0].selection_set.selections[0]
+    key = (field.alias or field.name).value
+    if field.name.value == "info":
+        return ExecutionResult(data={key: "info"})
+    arguments = _arguments(field)
+    names = [name for name in DEVICES if name > arguments.get("after", "")]
+    names = names[int(arguments.get("skip", 0)):]
+    names = names[:int(arguments["first"])]
+    return ExecutionResult(data={key: [{"name": name, "_cursor": name}
+                                       for name in names]})
+
+
+def collect(plan, variables=None, page_size=2):
+    async def run():
+        return [payload async for payload
+                in stream_query(plan, execute, variables, page_size)]
+    return asyncio.get_event_loop().run_until_complete(run())
+
+
+class TestPlanStream(object):
+
+    def test_streamed_fields(self):
+        plan = plan_stream(parse("{ info devices { name } }"))
+        assert [field.name.value for field in plan.streamed] == ["devices"]
+        assert [field.name.value for field in plan.head] == ["info"]
+
+    def test_not_streamable(self):
+        assert plan_stream(parse("{ info }")) is None
+        assert plan_stream(parse(
+            "mutation { deleteDeviceProperty(device: \"a/b/c\", name: \"p\")"
+            " { ok } }")) is None
+
+    def test_operation_name(self):
+        document = parse("query A { info } query B { devices { name } }")
+        assert plan_stream(document, "A") is None
+        assert plan_stream(document, "B") is not None
+        assert plan_stream(document) is None
+
+
+class TestStreamQuery(object):
+
+    def test_pages(self):
+        payloads = collect(plan_stream(parse("{ info devices { name } }")))
+        assert payloads[0] == {"data": {"info": "info", "devices": []},
+                               "hasNext": True}
+        assert [payload["path"] for payload in payloads[1:]] == [
+            ["devices", 0], ["devices", 2], ["devices", 4]]
+        names = [item["name"] for payload in payloads[1:]
+                 for item in payload["items"]]
+        assert names == DEVICES
+        assert all("_cursor" not in item for payload in payloads[1:]
+                   for item in payload["items"])
+
+    def test_first_and_after(self):
+        plan = plan_stream(parse(
+            "query ($n: Int) { d: devices(first: $n, after: \"sys/tg_test/0\")"
+            " { name } }"))
+        payloads = collect(plan, {"n": 3})
+        assert payloads[0]["data"] == {"d": []}
+        names = [item["name"] for payload in payloads[1:]
+                 for item in payload["items"]]
+        assert names == DEVICES[1:4]
+
+    def test_skip(self):
+        plan = plan_stream(parse("{ devices(skip: 1) { name } }"))
+        names = [item["name"] for payload in collect(plan)[1:]
+                 for item in payload["items"]]
+        assert names == DEVICES[1:]
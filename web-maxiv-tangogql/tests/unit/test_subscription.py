@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""Tests for the GraphQL subscriptions, through the websocket."""
+
+import asyncio
+import json
+from functools import partial
+
+from aiohttp import WSMsgType, test_utils
+
+from benchmarks.fake_tango import FakeTango
+from tangogql import aioserver
+from tangogql.listener import Keeper, split_name
+from tangogql.schema import base, subscription
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class FloodingHub(object):
+    """Sends a burst of frames for the attributes named "flood"."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.keepers = []
+
+    def subscribe(self, keeper, full_names):
+        self.keepers.append(keeper)
+        for full_name in full_names:
+            device, attribute = split_name(full_name)
+            if attribute != "flood":
+                continue
+            for index in range(self.frames):
+                keeper.put({"device": device, "attribute": attribute,
+                            "value": index, "write_value": None,
+                            "quality": "ATTR_VALID", "timestamp": 0.0,
+                            "error": None, "encoded": {}})
+
+    def unsubscribe(self, keeper, full_names=None):
+        self.keepers.remove(keeper)
+
+
+class TestSubscriptions(object):
+
+    def setup_method(self):
+        self.factories = (base.proxies.factory,
+                          getattr(base.subscriptions, "proxy_factory", None))
+        FakeTango(devices=1, latency=0, db_latency=0).install()
+
+    def teardown_method(self):
+        base.db.database = None
+        base.proxies.factory, proxy_factory = self.factories
+        if proxy_factory is not None:
+            base.subscriptions.proxy_factory = proxy_factory
+
+    def test_slow_client_disconnected(self, monkeypatch):
+        hub = FloodingHub(frames=5)
+        monkeypatch.setattr(subscription, "subscriptions", hub)
+        monkeypatch.setattr(subscription, "Keeper",
+                            partial(Keeper, maxsize=2, policy="disconnect"))
+        loop = asyncio.get_event_loop()
+        server = test_utils.TestServer(aioserver.setup_server(), loop=loop)
+        client = test_utils.TestClient(server, loop=loop)
+
+        async def scenario():
+            ws = await client.ws_connect("/socket", protocols=("graphql-ws",))
+            await ws.send_json({"type": "connection_init", "payload": {}})
+            assert (await ws.receive_json())["type"] == "connection_ack"
+            # A quiet subscription first, then one the client cannot
+            # keep up with
+            for op_id, attribute in (("1", "quiet"), ("2", "flood")):
+                query = ("subscription { attributes(fullNames: "
+                         f'["sys/tg_test/1/{attribute}"]) {{ value }} }}')
+                await ws.send_json({"id": op_id, "type": "start",
+                                    "payload": {"query": query}})
+                await asyncio.sleep(0.1)
+            while True:
+                message = await asyncio.wait_for(ws.receive(), 5)
+                if message.type != WSMsgType.TEXT:
+                    break
+                # Nothing makes it through once overflowed
+                assert json.loads(message.data).get("type") != "data"
+            assert message.type == WSMsgType.CLOSE
+            return message.data
+
+        run(client.start_server())
+        try:
+            assert run(scenario()) == subscription.OVERFLOW_CLOSE_CODE
+            # Both subscriptions ended with the connection
+            run(asyncio.sleep(0.1))
+            assert hub.keepers == []
+        finally:
+            run(client.close())
+
+    def test_roi_for_some_attributes(self):
+        loop = asyncio.get_event_loop()
+        server = test_utils.TestServer(aioserver.setup_server(), loop=loop)
+        client = test_utils.TestClient(server, loop=loop)
+        query = """subscription {
+            attributeFrames(fullNames: ["sim0/family0/dev0/spectrum_0",
+                                        "sim0/family0/dev0/image_0"],
+                            roi: [2, 12]) {
+                attribute value error
+            }
+        }"""
+
+        async def scenario():
+            ws = await client.ws_connect("/socket", protocols=("graphql-ws",))
+            await ws.send_json({"type": "connection_init", "payload": {}})
+            await ws.receive_json()
+            await ws.send_json({"id": "1", "type": "start",
+                                "payload": {"query": query}})
+            frames = {}
+            while len(frames) < 2:
+                message = await asyncio.wait_for(ws.receive_json(), 5)
+                assert message["type"] == "data"
+                assert "errors" not in message["payload"]
+                for frame in message["payload"]["data"]["attributeFrames"]:
+                    frames[frame["attribute"]] = frame
+            await ws.send_json({"id": "1", "type": "stop"})
+            await ws.close()
+            return frames
+
+        run(client.start_server())
+        try:
+            frames = run(scenario())
+        finally:
+            run(client.close())
+        assert len(frames["spectrum_0"]["value"]) == 10
+        assert frames["spectrum_0"]["error"] is None
+        # The ROI is for a SPECTRUM, the IMAGE gets an error of its own
+        assert frames["image_0"]["value"] is None
+        assert "4 indices" in frames["image_0"]["error"]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""Tests for the caching layer on top of the TANGO database and devices."""
+
+import asyncio
+import threading
+
+import PyTango
+import pytest
+
+from tangogql.tangodb import CachedDatabase, DeviceProxyCache
+
+__docformat__ = "restructuredtext"
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class Database(object):
+    """Counts the calls of each method."""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_server_list(self, pattern):
+        self.calls.append("get_server_list")
+        return ["a/1"]
+
+    def get_info(self):
+        self.calls.append("get_info")
+        return f"Call {len(self.calls)}"
+
+
+class TestCachedDatabase(object):
+
+    def test_cached_and_uncached(self):
+        database = Database()
+        db = CachedDatabase(database=database)
+        for _ in range(2):
+            assert run(db.get_server_list("*")) == ["a/1"]
+        assert database.calls == ["get_server_list"]
+        # The status is always current
+        assert run(db.get_info()) != run(db.get_info())
+
+
+class TestDeviceProxyCache(object):
+
+    def setup_method(self):
+        # Released at the end, like a device that finally answers
+        self.hanging = threading.Event()
+
+    def teardown_method(self):
+        self.hanging.set()
+
+    def hang(self):
+        self.hanging.wait(10)
+        return "late"
+
+    def test_shared_proxy(self):
+        created = []
+
+        def factory(name):
+            created.append(name)
+            return name.upper()
+
+        proxies = DeviceProxyCache(factory=factory, max_proxies=1)
+        assert run(asyncio.gather(proxies.get("a/b/c"),
+                                  proxies.get("a/b/c"))) == ["A/B/C"] * 2
+        assert created == ["a/b/c"]
+        run(proxies.get("d/e/f"))
+        assert len(proxies) == 1
+        assert proxies.evictions == 1
+
+    def test_timeout(self):
+        proxies = DeviceProxyCache(timeout=0.05, factory=str)
+        with pytest.raises(PyTango.DevFailed):
+            run(proxies.call("a/b/c", self.hang))
+
+    def test_unresponsive_devices(self):
+        proxies = DeviceProxyCache(timeout=0.05, threads=3,
+                                   calls_per_device=1, factory=str)
+
+        async def scenario():
+            calls = [proxies.call(device, self.hang)
+                     for device in ("a/b/c", "d/e/f") for _ in range(5)]
+            failed = await asyncio.gather(*calls, return_exceptions=True)
+            # One thread is still free
+            answer = await proxies.call("g/h/i", lambda: "ok")
+            return failed, answer
+
+        failed, answer = run(scenario())
+        assert all(isinstance(result, PyTango.DevFailed) for result in failed)
+        assert answer == "ok"
+
+    def test_device_answers_again(self):
+        proxies = DeviceProxyCache(timeout=0.05, calls_per_device=1,
+                                   factory=str)
+        with pytest.raises(PyTango.DevFailed):
+            run(proxies.call("a/b/c", self.hang))
+        self.hanging.set()
+        run(asyncio.sleep(0.05))
+        assert run(proxies.call("a/b/c", lambda: "ok")) == "ok"
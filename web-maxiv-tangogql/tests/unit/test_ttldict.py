@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""Tests for the TTL dictionary."""
+
+import time
+
+import pytest
+from tangogql.ttldict import TTLDict
+
+__docformat__ = "restructuredtext"
+
+
+class TestTTLDict(object):
+
+    def test_get_set(self):
+        cache = TTLDict(10)
+        cache["a"] = 1
+        assert cache["a"] == 1
+        assert "a" in cache
+        assert len(cache) == 1
+        assert list(cache) == ["a"]
+
+    def test_expiry(self):
+        cache = TTLDict(10, a=1, b=2)
+        cache.expire_at("a", time.time() - 1)
+        assert "a" not in cache
+        assert len(cache) == 1
+        assert list(cache) == ["b"]
+        with pytest.raises(KeyError):
+            cache["a"]
+
+    def test_no_ttl(self):
+        cache = TTLDict(None, a=1)
+        assert not cache.is_expired("a")
+        assert cache["a"] == 1
+
+    def test_reset_extends_ttl(self):
+        cache = TTLDict(10, a=1)
+        cache.expire_at("a", time.time() - 1)
+        cache["a"] = 2
+        assert len(cache) == 1
+        assert cache["a"] == 2
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = TTLDict(10, max_entries=2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache["a"]
+        cache["c"] = 3
+        assert sorted(cache) == ["a", "c"]
+        assert cache.evictions == 1
+
+    def test_max_bytes(self):
+        cache = TTLDict(10, max_bytes=100, sizeof=len)
+        cache["a"] = "x" * 60
+        cache["b"] = "y" * 60
+        assert list(cache) == ["b"]
+        assert cache.size_bytes == 60
+        del cache["b"]
+        assert cache.size_bytes == 0
+
+    def test_stale_entry(self):
+        cache = TTLDict(10, stale_ttl=5, a=1)
+        now = time.time()
+        assert cache.get_entry("a", now) == (1, True)
+        assert cache.get_entry("a", now + 12) == (1, False)
+        with pytest.raises(KeyError):
+            cache.get_entry("a", now + 20)
+
+    def test_heap_stays_bounded(self):
+        cache = TTLDict(10)
+        for i in range(1000):
+            cache["a"] = i
+        assert len(cache._heap) < 100
+
+    def test_remove_if_includes_stale(self):
+        cache = TTLDict(10, stale_ttl=5, a=1, b=2)
+        cache.expire_at("a", time.time() - 1)
+        assert cache.remove_if(lambda key: key in ("a", "b")) == 2
+        assert not cache._values
+
+    def test_clear(self):
+        cache = TTLDict(10, max_bytes=100, sizeof=len, a="x", b="y")
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.size_bytes == 0